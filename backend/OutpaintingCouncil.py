@@ -1,13 +1,49 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable, Awaitable, AsyncIterator
 import re
 import asyncio  
-from .llm_client import query_models_parallel, query_model
-from .config import COUNCIL_MEMBERS_STAGE1, COUNCIL_MEMBERS_STAGE2, CHAIRMAN_ID
-from typing import Optional
+from .llm_client import query_model
+from .config import (COUNCIL_MEMBERS_STAGE1, COUNCIL_MEMBERS_STAGE2, CHAIRMAN_ID,
+                     COUNCIL_EXECUTION_MODE, STAGE_POLICIES)
+from .stage_policy import gather_with_quorum
+from .hedging import hedged_query
+from typing import Optional, Union
+from .image_handle import ImageHandle
+from .response_cache import CACHE_USE
 from .prompt import (outpainting_prompt_stage1, 
                      outpainting_prompt_stage2,
                      outpainting_prompt_stage3)
 
+EXECUTION_STAGED = "staged"        # Chờ cả stage xong mới sang stage sau
+EXECUTION_PIPELINED = "pipelined"  # Mỗi bản nháp Stage 1 được refine ngay khi xong
+
+
+def _refined_ok(result: Optional[Dict[str, Any]]) -> bool:
+    """Bản refine thành công (không phải bản gốc giữ lại do refiner lỗi)."""
+    return result is not None and "error" not in result
+
+
+async def drain_until_done(queue: asyncio.Queue, task: asyncio.Task) -> AsyncIterator[Any]:
+    """
+    Yield các item được đẩy vào `queue` trong lúc `task` chạy, cho tới khi task
+    xong (kết quả/exception của task do caller tự lấy). Nếu caller dừng giữa
+    chừng (client ngắt SSE), task bị huỷ để không giữ connection và quota.
+    """
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+
+            getter.cancel()
+            while not queue.empty():
+                yield queue.get_nowait()
+            return
+    finally:
+        if not task.done():
+            task.cancel()
+
 class OutpaintingCouncil:
     """
     Council system for folk painting outpainting task.
@@ -21,19 +57,47 @@ class OutpaintingCouncil:
         self.stage1_models = COUNCIL_MEMBERS_STAGE1
         self.stage2_models = COUNCIL_MEMBERS_STAGE2
         self.chairman_model = CHAIRMAN_ID
+        self.stage_policies = STAGE_POLICIES
         self.task_type = "outpainting"
 
     async def run_task(
         self, user_query: str,
-        image_url: Optional[str] = None, image_data: Optional[bytes] = None,
-        image_mime_type: str = "image/jpeg") -> Dict[str, Any]:
+        image_url: Optional[str] = None, image_data: Union[bytes, ImageHandle, None] = None,
+        image_mime_type: str = "image/jpeg", cache_mode: str = CACHE_USE,
+        mode: str = COUNCIL_EXECUTION_MODE) -> Dict[str, Any]:
         """
         Run the complete 3-stage outpainting process.
+        `cache_mode`: "use" | "refresh" | "bypass" (xem response_cache).
+        `mode`: "staged" (barrier giữa các stage) | "pipelined" (dataflow).
         """
 
+        # Encode ảnh một lần, dùng chung cho mọi lần gọi của cả 3 stage
+        image_data = ImageHandle.of(image_data, image_mime_type)
+
+        if mode == EXECUTION_PIPELINED:
+            results = {}
+            async for event in self.stream_events(
+                user_query, image_url, image_data, image_mime_type, cache_mode, mode=mode
+            ):
+                if event["type"] in ("stage1_complete", "stage2_complete", "stage3_complete"):
+                    results[event["type"]] = event["data"]
+
+            if not results["stage1_complete"]:
+                return {
+                    "error": "All models failed to respond in stage 1",
+                    "stage1_results": [],
+                    "stage2_results": [],
+                    "final_result": None
+                }
+            return {
+                "stage1_results": results["stage1_complete"],
+                "stage2_results": results["stage2_complete"],
+                "final_result": results["stage3_complete"]
+            }
+
         # Stage 1: Collect initial outpainting responses
         stage1_results = await self._stage1_collect_responses(
-            user_query, image_url, image_data, image_mime_type
+            user_query, image_url, image_data, image_mime_type, cache_mode
         )
 
         if not stage1_results:
@@ -46,12 +110,12 @@ class OutpaintingCouncil:
 
         # Stage 2: Sequentially complete each response
         stage2_results = await self._stage2_complete_responses(
-            user_query, stage1_results, image_url, image_data, image_mime_type
+            user_query, stage1_results, image_url, image_data, image_mime_type, cache_mode
         )
 
         # Stage 3: Evaluate and select the best
         final_result = await self._stage3_evaluate_and_select(
-            user_query, stage2_results, image_url, image_data, image_mime_type
+            user_query, stage2_results, image_url, image_data, image_mime_type, cache_mode
         )
 
         return {
@@ -60,107 +124,327 @@ class OutpaintingCouncil:
             "final_result": final_result
         }
 
+    async def stream_events(
+        self, user_query: str, image_url: Optional[str],
+        image_data: Union[bytes, ImageHandle, None], image_mime_type: str,
+        cache_mode: str = CACHE_USE, stream_tokens: bool = False,
+        mode: str = COUNCIL_EXECUTION_MODE
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Chạy council và yield các event (dạng payload SSE) theo thứ tự xảy ra:
+        stage{1,2,3}_start, stage{1,2}_item, stage{1,2,3}_complete và
+        stage{1,2,3}_delta nếu `stream_tokens` (stage3_delta có "replace": True
+        khi bản hedge của chairman thắng: thay text đã stream thay vì nối thêm).
+        Data của stage3_complete là final_result đầy đủ.
+        """
+        image_data = ImageHandle.of(image_data, image_mime_type)
+        if mode == EXECUTION_PIPELINED:
+            events = self._stream_pipelined(user_query, image_url, image_data, image_mime_type,
+                                            cache_mode, stream_tokens)
+        else:
+            events = self._stream_staged(user_query, image_url, image_data, image_mime_type,
+                                         cache_mode, stream_tokens)
+        async for event in events:
+            yield event
+
+    async def _stream_staged(
+        self, user_query: str, image_url: Optional[str], image_data: Optional[ImageHandle],
+        image_mime_type: str, cache_mode: str, stream_tokens: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Staged mode: barrier sau mỗi stage, token delta vẫn được stream."""
+        results = {}
+
+        async def run_stage(stage: str, run: Callable[[Optional[Callable]], Awaitable[Any]]):
+            queue: asyncio.Queue = asyncio.Queue()
+            on_delta = (lambda data: queue.put_nowait({"type": f"{stage}_delta", "data": data})) \
+                if stream_tokens else None
+            task = asyncio.create_task(run(on_delta))
+            async for event in drain_until_done(queue, task):
+                yield event
+            results[stage] = task.result()
+
+        yield {"type": "stage1_start"}
+        async for event in run_stage("stage1", lambda on_delta: self._stage1_collect_responses(
+                user_query, image_url, image_data, image_mime_type, cache_mode, on_delta)):
+            yield event
+        yield {"type": "stage1_complete", "data": results["stage1"]}
+
+        yield {"type": "stage2_start"}
+        async for event in run_stage("stage2", lambda on_delta: self._stage2_complete_responses(
+                user_query, results["stage1"], image_url, image_data, image_mime_type, cache_mode, on_delta)):
+            yield event
+        yield {"type": "stage2_complete", "data": results["stage2"]}
+
+        yield {"type": "stage3_start"}
+        async for event in run_stage("stage3", lambda on_delta: self._stage3_evaluate_and_select(
+                user_query, results["stage2"], image_url, image_data, image_mime_type, cache_mode, on_delta)):
+            yield event
+        yield {"type": "stage3_complete", "data": results["stage3"]}
+
+    async def _stream_pipelined(
+        self, user_query: str, image_url: Optional[str], image_data: Optional[ImageHandle],
+        image_mime_type: str, cache_mode: str, stream_tokens: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Dataflow mode: mỗi bản nháp Stage 1 được gửi ngay cho các model Stage 2
+        khi vừa xong, không chờ model Stage 1 chậm nhất. Stage 3 bắt đầu khi mọi
+        bản refine đã xong. Độ trễ tổng ~ đường găng (critical path) thay vì tổng
+        thời gian chậm nhất của từng stage.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        emit = queue.put_nowait
+        stage1_results: List[Dict[str, Any]] = []
+        stage2_results: List[Dict[str, Any]] = []
+        refine_tasks: List[asyncio.Task] = []
+        refine_jobs: List[Tuple[Dict[str, Any], str]] = []  # (bản nháp, refiner) của từng refine_task
+        stage2_started = False
+
+        def delta_sink(event_type: str):
+            return (lambda data: emit({"type": event_type, "data": data})) if stream_tokens else None
+
+        def start_stage2():
+            nonlocal stage2_started
+            if not stage2_started:
+                stage2_started = True
+                emit({"type": "stage2_start"})
+
+        async def refine(s1_result: Dict[str, Any], refiner_model_id: str) -> Dict[str, Any]:
+            result = await self._refine_one(
+                s1_result, refiner_model_id, image_url, image_data, image_mime_type,
+                cache_mode, delta_sink("stage2_delta")
+            )
+            stage2_results.append(result)
+            emit({"type": "stage2_item", "data": result})
+            return result
+
+        async def draft_then_refine(model_id: str) -> Optional[Dict[str, Any]]:
+            s1_result = await self._draft_one(
+                model_id, image_url, image_data, image_mime_type,
+                cache_mode, delta_sink("stage1_delta")
+            )
+            if s1_result is not None:
+                stage1_results.append(s1_result)
+                emit({"type": "stage1_item", "data": s1_result})
+                start_stage2()
+                # Refine chạy ngay, không chờ các bản nháp còn lại
+                for mid in self.stage2_models:
+                    refine_jobs.append((s1_result, mid))
+                    refine_tasks.append(asyncio.create_task(refine(s1_result, mid)))
+            return s1_result
+
+        async def pipeline():
+            emit({"type": "stage1_start"})
+            stage1_policy = self.stage_policies["stage1"]
+            await gather_with_quorum(
+                [draft_then_refine(mid) for mid in self.stage1_models],
+                quorum=stage1_policy.get("quorum"), deadline=stage1_policy.get("deadline")
+            )
+            emit({"type": "stage1_complete", "data": self._in_council_order(stage1_results)})
+
+            # Deadline của Stage 2 tính từ lúc Stage 1 xong (như staged mode): bản
+            # nháp về muộn vẫn có đủ thời gian refine, bản về sớm được thêm thời gian
+            start_stage2()
+            stage2_policy = self.stage_policies["stage2"]
+            refined = await gather_with_quorum(
+                refine_tasks, quorum=stage2_policy.get("quorum"),
+                deadline=stage2_policy.get("deadline"),
+                is_success=_refined_ok
+            )
+            for (s1_result, mid), result in zip(refine_jobs, refined):
+                if result is None:
+                    fallback = self._refine_fallback(s1_result, mid, cancelled=True)
+                    stage2_results.append(fallback)
+                    emit({"type": "stage2_item", "data": fallback})
+            ordered = self._in_council_order(stage2_results)
+            emit({"type": "stage2_complete", "data": ordered})
+
+            emit({"type": "stage3_start"})
+            final_result = await self._stage3_evaluate_and_select(
+                user_query, ordered, image_url, image_data, image_mime_type,
+                cache_mode, delta_sink("stage3_delta")
+            )
+            emit({"type": "stage3_complete", "data": final_result})
+
+        task = asyncio.create_task(pipeline())
+        try:
+            async for event in drain_until_done(queue, task):
+                yield event
+            task.result()
+        finally:
+            for refine_task in refine_tasks:
+                refine_task.cancel()
+
+    def _in_council_order(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sắp kết quả (đến theo thứ tự hoàn thành) về thứ tự cố định của council,
+        để nhãn Response A, B... và prompt của chairman ổn định giữa các lần chạy.
+        """
+        def rank(result: Dict[str, Any]) -> Tuple[int, int]:
+            if "stage2_model" in result:
+                return (self.stage1_models.index(result["original_model"]),
+                        self.stage2_models.index(result["stage2_model"]))
+            return (self.stage1_models.index(result["model"]), 0)
+        return sorted(results, key=rank)
+
     async def _stage1_collect_responses(
         self, user_query: str, image_url: Optional[str],
-        image_data: Optional[bytes], image_mime_type: str
+        image_data: Union[bytes, ImageHandle, None], image_mime_type: str,
+        cache_mode: str = CACHE_USE,
+        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> List[Dict[str, Any]]:
+        """
+        Stage 1: mỗi model tạo một bản nháp JSON.
+        `on_delta({"model", "delta"})` nhận token streaming (nếu có).
+        """
         
-        prompt = outpainting_prompt_stage1()
-
-        messages = [{"role": "user", "content": prompt}]
+        policy = self.stage_policies["stage1"]
+        responses = await gather_with_quorum(
+            [
+                self._draft_one(model_id, image_url, image_data, image_mime_type, cache_mode, on_delta)
+                for model_id in self.stage1_models
+            ],
+            quorum=policy.get("quorum"), deadline=policy.get("deadline")
+        )
+        return [result for result in responses if result is not None]
 
-        responses = await query_models_parallel(
-            self.stage1_models, messages, 
-            image_data=image_data, 
+    async def _draft_one(
+        self, model_id: str, image_url: Optional[str],
+        image_data: Union[bytes, ImageHandle, None], image_mime_type: str,
+        cache_mode: str = CACHE_USE,
+        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Một bản nháp Stage 1 của `model_id` (None nếu model lỗi)."""
+        messages = [{"role": "user", "content": outpainting_prompt_stage1()}]
+        response = await query_model(
+            model_id, messages,
+            image_url=image_url,
+            image_data=image_data,
             image_mime_type=image_mime_type,
-            image_url=image_url
+            cache_mode=cache_mode,
+            on_delta=self._delta_forwarder(on_delta, {"model": model_id}),
+            # Thành viên khác đang tự viết bản nháp này: failover sang đó chỉ
+            # tạo bản trùng, thà bỏ ứng viên lỗi
+            exclude=self.stage1_models
         )
+        if response is None:
+            return None
+        return self._stage1_result(model_id, response)
 
-        stage1_results = []
-        for model_id, response in responses.items():
-            if response is not None:
-                stage1_results.append({
-                    "model": model_id,
-                    "response": response.get('content', ''),
-                    "task_type": self.task_type
-                })
-        return stage1_results
+    def _stage1_result(self, model_id: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        result = {
+            "model": model_id,
+            "response": response.get('content', ''),
+            "task_type": self.task_type
+        }
+        if response.get("failover_from"):
+            result["served_by"] = response["model_id"]
+        return result
 
     async def _stage2_complete_responses(
         self, user_query: str,
         stage1_results: List[Dict[str, Any]], image_url: Optional[str],
-        image_data: Optional[bytes], image_mime_type: str
+        image_data: Union[bytes, ImageHandle, None], image_mime_type: str,
+        cache_mode: str = CACHE_USE,
+        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> List[Dict[str, Any]]:
         """
         Stage 2 (CROSS-REFINEMENT): 
         EVERY Stage 2 model will refine EVERY Stage 1 response.
         If Stage 1 has M results and Stage 2 has N models, we get M*N refined results.
+        `on_delta({"original_model", "stage2_model", "delta"})` nhận token streaming.
         """
-        stage2_results = []
-        tasks = []
-        metadata_list = []
-
-        # 1. Tạo danh sách các task (công việc) cần làm
-        for s1_result in stage1_results:
-            original_model = s1_result['model']
-            original_response = s1_result['response']
-            
-            # Lặp qua TẤT CẢ các model ở Stage 2
-            for refiner_model_id in self.stage2_models:
-                
-                # Tạo prompt
-                completion_prompt = outpainting_prompt_stage2(original_model, original_response)
-                messages = [{"role": "user", "content": completion_prompt}]
-                
-                # Đóng gói metadata để đối chiếu sau khi chạy xong
-                metadata = {
-                    "original_model": original_model,
-                    "refiner_model": refiner_model_id,
-                    "original_response": original_response
-                }
-                metadata_list.append(metadata)
+        image_data = ImageHandle.of(image_data, image_mime_type)
 
-                # Tạo coroutine (task) nhưng chưa chạy ngay
-                tasks.append(query_model(
-                    refiner_model_id, messages, 
-                    image_url=image_url, 
-                    image_data=image_data, 
-                    image_mime_type=image_mime_type
-                ))
+        # 1. Tạo danh sách các task: mỗi bản nháp Stage 1 x TẤT CẢ các model Stage 2
+        jobs = [
+            (s1_result, refiner_model_id)
+            for s1_result in stage1_results
+            for refiner_model_id in self.stage2_models
+        ]
+        tasks = [
+            self._refine_one(
+                s1_result, refiner_model_id, image_url, image_data,
+                image_mime_type, cache_mode, on_delta
+            )
+            for s1_result, refiner_model_id in jobs
+        ]
 
         # 2. Chạy tất cả các task song song (tăng tốc độ xử lý)
+        # Đi tiếp khi đủ quorum hoặc hết deadline; bản refine bị huỷ thì giữ
+        # bản gốc (như khi refiner lỗi) để bản nháp vẫn vào Stage 3
         print(f"STAGE 2: Running {len(tasks)} refinement tasks in parallel...")
-        responses = await asyncio.gather(*tasks)
+        policy = self.stage_policies["stage2"]
+        results = await gather_with_quorum(
+            tasks, quorum=policy.get("quorum"), deadline=policy.get("deadline"),
+            is_success=_refined_ok
+        )
+        return [
+            result if result is not None
+            else self._refine_fallback(s1_result, refiner_model_id, cancelled=True)
+            for (s1_result, refiner_model_id), result in zip(jobs, results)
+        ]
 
-        # 3. Ghép kết quả vào danh sách trả về
-        for i, response in enumerate(responses):
-            meta = metadata_list[i]
-            
-            if response is not None:
-                stage2_results.append({
-                    "original_model": meta["original_model"],     
-                    "stage2_model": meta["refiner_model"],        
-                    "original_response": meta["original_response"],
-                    "perfected_response": response.get('content', ''),
-                    "task_type": self.task_type
-                })
-            else:
-                # Nếu lỗi, giữ nguyên bản gốc
-                stage2_results.append({
-                    "original_model": meta["original_model"],
-                    "stage2_model": meta["refiner_model"],
-                    "original_response": meta["original_response"],
-                    "perfected_response": meta["original_response"], 
-                    "task_type": self.task_type,
-                    "error": f"Stage 2 refinement failed by {meta['refiner_model']}"
-                })
+    async def _refine_one(
+        self, s1_result: Dict[str, Any], refiner_model_id: str,
+        image_url: Optional[str], image_data: Union[bytes, ImageHandle, None],
+        image_mime_type: str, cache_mode: str = CACHE_USE,
+        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Một lần refine của Stage 2: `refiner_model_id` hoàn thiện một bản nháp Stage 1."""
+        original_model = s1_result['model']
+        original_response = s1_result['response']
+
+        completion_prompt = outpainting_prompt_stage2(original_model, original_response)
+        messages = [{"role": "user", "content": completion_prompt}]
+
+        response = await query_model(
+            refiner_model_id, messages, 
+            image_url=image_url, 
+            image_data=image_data, 
+            image_mime_type=image_mime_type,
+            cache_mode=cache_mode,
+            on_delta=self._delta_forwarder(on_delta, {
+                "original_model": original_model,
+                "stage2_model": refiner_model_id,
+            }),
+            # Refiner còn lại đang refine cùng bản nháp này (xem _draft_one)
+            exclude=self.stage2_models
+        )
 
-        return stage2_results
+        if response is not None:
+            result = {
+                "original_model": original_model,     
+                "stage2_model": refiner_model_id,        
+                "original_response": original_response,
+                "perfected_response": response.get('content', ''),
+                "task_type": self.task_type
+            }
+            if response.get("failover_from"):
+                result["served_by"] = response["model_id"]
+            return result
+
+        # Nếu lỗi, giữ nguyên bản gốc
+        return self._refine_fallback(s1_result, refiner_model_id)
+
+    def _refine_fallback(self, s1_result: Dict[str, Any], refiner_model_id: str,
+                         cancelled: bool = False) -> Dict[str, Any]:
+        """Bản gốc Stage 1 giữ lại khi refine lỗi hoặc bị huỷ (quorum/deadline)."""
+        reason = "cancelled (straggler)" if cancelled else "failed"
+        return {
+            "original_model": s1_result['model'],
+            "stage2_model": refiner_model_id,
+            "original_response": s1_result['response'],
+            "perfected_response": s1_result['response'],
+            "task_type": self.task_type,
+            "error": f"Stage 2 refinement {reason} by {refiner_model_id}"
+        }
 
     async def _stage3_evaluate_and_select(
         self, user_query: str,
         stage2_results: List[Dict[str, Any]], image_url: Optional[str],
-        image_data: Optional[bytes], image_mime_type: str
+        image_data: Union[bytes, ImageHandle, None], image_mime_type: str,
+        cache_mode: str = CACHE_USE,
+        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[str, Any]:
         """
         Stage 3: Evaluate candidates. 
@@ -190,6 +474,9 @@ class OutpaintingCouncil:
                 seen_originals.add(orig_model)
             
             # 2. Thêm bản đã sửa (Stage 2)
+            # Refine lỗi/bị huỷ chỉ giữ lại bản gốc, đã có ở trên: không chấm trùng
+            if result.get('error'):
+                continue
             # Label ví dụ: "Stage 2 (GPT -> Gemini)"
             refiner = result['stage2_model']
             candidates.append({
@@ -212,13 +499,19 @@ class OutpaintingCouncil:
         evaluation_prompt = outpainting_prompt_stage3(responses_text)
         
         # --- Gọi Chairman ---
+        # Hết deadline thì huỷ lời gọi và dùng fallback bên dưới.
+        # Chairman là lời gọi đơn lẻ nên được hedge nếu HEDGING bật.
         messages = [{"role": "user", "content": evaluation_prompt}]
-        response = await query_model(
+        response, = await gather_with_quorum([hedged_query(
             self.chairman_model, messages, 
             image_url=image_url, 
             image_data=image_data, 
-            image_mime_type=image_mime_type
-        )
+            image_mime_type=image_mime_type,
+            cache_mode=cache_mode,
+            on_delta=self._delta_forwarder(on_delta, {"model": self.chairman_model}),
+            # Bản hedge thắng: client thay text đã stream bằng kết quả của nó
+            on_replace=self._delta_forwarder(on_delta, {"model": self.chairman_model, "replace": True})
+        )], deadline=self.stage_policies["stage3"].get("deadline"))
 
         # --- Xử lý kết quả ---
         if response is None:
@@ -239,24 +532,42 @@ class OutpaintingCouncil:
             index = ord(best_response_label.upper()) - ord('A')
             if 0 <= index < len(candidates):
                 selected = candidates[index]
-                return {
+                return self._with_chairman({
                     "selected_response": selected['response_text'],
                     "selected_model": selected['source_model'],
                     "selected_stage": selected['stage'],
                     "evaluation": evaluation_text,
                     "task_type": self.task_type
-                }
+                }, response)
 
         # Fallback parsing error
         fallback = stage2_results[0]
-        return {
+        return self._with_chairman({
             "selected_response": fallback['perfected_response'],
             "selected_model": fallback['stage2_model'],
             "selected_stage": "Stage 2 (Fallback - Parse Error)",
             "evaluation": evaluation_text,
             "task_type": self.task_type,
             "error": "Could not parse best response selection"
-        }
+        }, response)
+
+    @staticmethod
+    def _with_chairman(final_result: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+        """Ghi lại chairman thực sự trả lời nếu chairman chính bị failover/hedge."""
+        if response.get("failover_from") or response.get("hedged"):
+            final_result["evaluated_by"] = response["model_id"]
+        if response.get("hedged"):
+            final_result["hedged"] = True
+        return final_result
+
+    @staticmethod
+    def _delta_forwarder(
+        on_delta: Optional[Callable[[Dict[str, Any]], None]],
+        labels: Dict[str, Any]) -> Optional[Callable[[str], None]]:
+        """Gắn nhãn (model...) cho từng token stream trước khi chuyển cho `on_delta`."""
+        if on_delta is None:
+            return None
+        return lambda text: on_delta({**labels, "delta": text})
 
     def _parse_best_response_selection(self, evaluation_text: str) -> str:
         """
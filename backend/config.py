@@ -19,6 +19,14 @@ MODEL_REGISTRY = {
         "base_url": "https://generativelanguage.googleapis.com/v1beta/models" 
     },
 
+    # Chairman dự phòng (dùng khi gemini_chairman bị ngắt mạch)
+    "gpt_chairman": {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "api_key": os.getenv("CHAIRMAN_OPENAI_API_KEY") or OPENAI_API_KEY_S1,
+        "base_url": "https://api.openai.com/v1/chat/completions"
+    },
+
     # --- STAGE 1 ---
     "gpt_stage1": {
         "provider": "openai",
@@ -48,12 +56,263 @@ MODEL_REGISTRY = {
     },
 }
 
+# --- Model dự phòng cho cùng vai trò trong council (theo thứ tự ưu tiên) ---
+# Dự phòng đang là thành viên khác của cùng stage thì bị bỏ qua (nó đã chạy
+# cùng prompt song song), nên với council mặc định model Stage 1/2 lỗi sẽ bị bỏ.
+MODEL_FALLBACKS = {
+    "gemini_chairman": ["gpt_chairman"],
+    "gpt_chairman": ["gemini_chairman"],
+    "gpt_stage1": ["gemini_stage1"],
+    "gemini_stage1": ["gpt_stage1"],
+    "gpt_stage2": ["gemini_stage2"],
+    "gemini_stage2": ["gpt_stage2"],
+}
+
+# --- Circuit breaker cho từng model_id ---
+CIRCUIT_BREAKER = {
+    "window_size": 20,               # Số lần gọi gần nhất dùng để tính tỉ lệ lỗi
+    "min_calls": 4,                  # Cần tối thiểu bấy nhiêu lần gọi mới xét ngắt mạch
+    "failure_rate_threshold": float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+    "slow_call_seconds": float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "45")),
+    "open_seconds": float(os.getenv("BREAKER_OPEN_SECONDS", "30")),
+    "half_open_probes": 1,
+    "latency_window": 100,           # Số latency gần nhất giữ lại (p50/p95, hedging)
+}
+
+# --- Rate limit theo provider, áp dụng riêng cho từng API key ---
+# Các model_id dùng chung một API key thì dùng chung một bucket.
+# Có thể ghi đè cho từng model bằng khóa "rate_limit" trong MODEL_REGISTRY,
+# ví dụ: "rate_limit": {"requests_per_minute": 15, "max_in_flight": 2}
+RATE_LIMITS = {
+    "default": {"requests_per_minute": 60, "burst": 5, "max_in_flight": 4},
+    "openai": {
+        "requests_per_minute": float(os.getenv("OPENAI_RPM", "500")),
+        "burst": 20,
+        "max_in_flight": int(os.getenv("OPENAI_MAX_IN_FLIGHT", "16")),
+    },
+    "google": {
+        "requests_per_minute": float(os.getenv("GOOGLE_RPM", "15")),
+        "burst": 5,
+        "max_in_flight": int(os.getenv("GOOGLE_MAX_IN_FLIGHT", "4")),
+    },
+}
+
 COUNCIL_MEMBERS_STAGE1 = ["gpt_stage1", "gemini_stage1"]
 COUNCIL_MEMBERS_STAGE2 = ["gpt_stage2", "gemini_stage2"]
 
 CHAIRMAN_ID = "gemini_chairman" 
 
+# --- Quorum / deadline cho từng stage của council ---
+# quorum: đủ bấy nhiêu kết quả thành công thì đi tiếp (None = chờ tất cả)
+# deadline: số giây tối đa của stage; hết giờ thì huỷ các lời gọi còn treo (None = không giới hạn)
+def _optional_number(name, default, cast=float):
+    value = os.getenv(name, default)
+    return cast(value) if value not in (None, "", "none") else None
+
+STAGE_POLICIES = {
+    "stage1": {
+        "quorum": _optional_number("STAGE1_QUORUM", None, int),
+        "deadline": _optional_number("STAGE1_DEADLINE", "45"),
+    },
+    "stage2": {
+        "quorum": _optional_number("STAGE2_QUORUM", None, int),  # ví dụ 3 (trên 4 bản refine)
+        "deadline": _optional_number("STAGE2_DEADLINE", "30"),
+    },
+    "stage3": {
+        "quorum": None,
+        "deadline": _optional_number("STAGE3_DEADLINE", "60"),
+    },
+}
+
+# --- Hedging cho các lời gọi đơn lẻ (chairman) ---
+# Nếu model chính chưa trả lời sau p95 latency gần đây, gửi thêm một bản sao tới
+# model hedge và lấy kết quả về trước; lời gọi còn lại bị huỷ.
+HEDGING = {
+    "enabled": os.getenv("LLM_HEDGING", "false").lower() == "true",
+    "percentile": float(os.getenv("HEDGING_PERCENTILE", "0.95")),
+    "min_samples": 10,        # Chưa đủ mẫu latency thì dùng default_delay
+    "default_delay": float(os.getenv("HEDGING_DEFAULT_DELAY", "20")),
+    "min_delay": 1.0,
+    # Model nhận bản sao; không có trong map thì hedge chính model đó
+    "targets": {
+        "gemini_chairman": "gpt_chairman",
+        "gpt_chairman": "gemini_chairman",
+    },
+}
+
+# "pipelined": refine mỗi bản nháp Stage 1 ngay khi có; "staged": chờ hết từng stage
+COUNCIL_EXECUTION_MODE = os.getenv("COUNCIL_EXECUTION_MODE", "pipelined")
+
+# --- Tiền xử lý ảnh trước khi gửi tới model ---
+# Độ phân giải tối đa mà mỗi provider thực sự dùng; lớn hơn chỉ tốn băng thông và token.
+# OpenAI (detail=auto/high): ảnh được đưa về khung 2048 rồi cạnh ngắn 768.
+# Gemini: ảnh lớn bị chia tile 768px, 1536px đủ chi tiết cho tranh dân gian.
+PROVIDER_IMAGE_LIMITS = {
+    "openai": {"max_side": 2048, "max_short_side": 768},
+    "google": {"max_side": 1536},
+}
+
+IMAGE_PREPROCESS = {
+    "enabled": os.getenv("IMAGE_PREPROCESS", "true").lower() == "true",
+    "format": os.getenv("IMAGE_PREPROCESS_FORMAT", "JPEG"),  # JPEG hoặc WEBP
+    "quality": int(os.getenv("IMAGE_PREPROCESS_QUALITY", "85")),
+    "cache_size": 64,
+}
+
 DATA_DIR = "data/conversations"
+LOCAL_IMG_DIR = "local_storage/images"
+
+# Upload ảnh được stream xuống đĩa theo chunk; vượt max_bytes thì trả về 413
+UPLOAD = {
+    "max_bytes": int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024))),
+    "chunk_size": 1024 * 1024,
+}
+
+# Ảnh upload lưu theo sha256 (backend/image_store.py): ảnh trùng chỉ lưu một lần,
+# không upload Cloudinary lại, bản tiền xử lý cho provider được cache trên đĩa.
+# Chuyển ảnh kiểu cũ {uuid}_{tên file}: python -m backend.image_store --ingest-legacy
+IMAGE_STORE = {
+    "dir": os.path.join(LOCAL_IMG_DIR, "objects"),
+    "derived_dir": os.path.join(LOCAL_IMG_DIR, "derived"),
+    "db": os.getenv("IMAGE_STORE_DB", "local_storage/image_store.db"),
+    # Lúc khởi động: đưa ảnh kiểu cũ {uuid}_{tên file} chưa ingest vào store
+    "ingest_legacy_on_startup": os.getenv("IMAGE_STORE_INGEST_LEGACY", "true").lower() == "true",
+}
+
+# Publish ảnh upload lên remote (URL public cho frontend) chạy nền song song với
+# council, không chặn SSE stream; message được gắn image_url khi upload xong.
+# backend: "cloudinary", "local" (stub trả URL nội bộ, dùng cho test/dev) hoặc "none"
+IMAGE_PUBLISHER = {
+    "backend": os.getenv("IMAGE_PUBLISHER", "cloudinary").lower(),
+    "folder": os.getenv("CLOUDINARY_FOLDER", "outpainting_tasks"),
+    "local_base_url": os.getenv("IMAGE_PUBLISHER_LOCAL_BASE_URL", "/api/images"),
+    "retries": int(os.getenv("IMAGE_PUBLISHER_RETRIES", "2")),
+    "retry_delay": float(os.getenv("IMAGE_PUBLISHER_RETRY_DELAY", "2")),
+    "shutdown_timeout": float(os.getenv("IMAGE_PUBLISHER_SHUTDOWN_TIMEOUT", "30")),
+}
+
+# Phục vụ ảnh local qua /api/images/{sha256}[/thumb|/webp]: URL theo content hash
+# nên cache vĩnh viễn (immutable). Thumbnail/WebP được tạo lần đầu rồi lưu như
+# derivative trong image_store.
+IMAGE_SERVING = {
+    "thumb_size": int(os.getenv("IMAGE_THUMB_SIZE", "320")),
+    "webp_quality": int(os.getenv("IMAGE_WEBP_QUALITY", "80")),
+    "max_age": int(os.getenv("IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600))),
+}
+
+# Sau stage 3: dựng canvas mở rộng + mask (nhị phân và feather) + preview tô
+# viền từ expansion_settings của response được chọn (backend/outpaint_canvas.py).
+# fill: "edge" | "reflect" | "symmetric" cho preview; max_expand giới hạn số pixel
+# mỗi cạnh để JSON của model không làm nổ bộ nhớ.
+OUTPAINT_CANVAS = {
+    "enabled": os.getenv("OUTPAINT_CANVAS_ENABLED", "true").lower() == "true",
+    "fill": os.getenv("OUTPAINT_CANVAS_FILL", "edge").lower(),
+    "canvas_value": 127,  # Màu xám trung tính cho vùng cần vẽ trên canvas
+    "default_mask_blur": 8,
+    "max_mask_blur": 128,
+    "max_expand": int(os.getenv("OUTPAINT_MAX_EXPAND", "2048")),
+    "max_pixels": int(os.getenv("OUTPAINT_MAX_PIXELS", str(40_000_000))),
+}
+
+# --- Storage backend cho hội thoại ---
+# "sqlite" (mặc định, WAL), "json" (mỗi hội thoại một file trong DATA_DIR) hoặc
+# "jsonl" (log append-only, mỗi message một dòng).
+# Chuyển dữ liệu JSON cũ sang SQLite: python -m backend.storage.migrate. Với
+# STORAGE_AUTO_MIGRATE (mặc định bật), lần khởi động đầu tiên với DB SQLite rỗng
+# tự migrate các hội thoại trong DATA_DIR để lịch sử cũ không biến mất sau khi nâng cấp.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/council.db")
+STORAGE_AUTO_MIGRATE = os.getenv("STORAGE_AUTO_MIGRATE", "true").lower() == "true"
+JSONL_LOG = {
+    "dir": os.getenv("JSONL_LOG_DIR", "data/conversation_logs"),
+    "fsync": os.getenv("JSONL_LOG_FSYNC", "true").lower() == "true",
+    "compact_after": 16,   # Số lần đổi title trước khi gộp log
+}
+
+# Cache write-behind cho các hội thoại đang hoạt động (backend/storage/cached.py).
+# STORAGE_CACHE_WRITE_THROUGH=true: ghi xuống đĩa ngay, cache chỉ phục vụ đọc.
+STORAGE_CACHE = {
+    "enabled": os.getenv("STORAGE_CACHE", "true").lower() == "true",
+    "max_bytes": int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    "flush_interval": float(os.getenv("STORAGE_CACHE_FLUSH_INTERVAL", "1.0")),
+    "write_through": os.getenv("STORAGE_CACHE_WRITE_THROUGH", "false").lower() == "true",
+}
+
+# Kết quả council lưu dạng blob nén (zlib), chuỗi dài lặp lại chỉ lưu một lần
+# Blob không còn message nào trỏ tới bị xoá khi xoá hội thoại / compact / retention,
+# trừ blob vừa được ghi trong gc_grace_seconds (message của nó có thể chưa flush).
+COUNCIL_BLOBS = {
+    "compress_level": 6,
+    "min_dedupe_length": 64,
+    "gc_grace_seconds": 3600,
+}
+
+# Full-text search (SQLite FTS5) trên tin nhắn, prompt được chọn và đánh giá của chairman
+SEARCH_INDEX = {
+    "enabled": os.getenv("SEARCH_INDEX", "true").lower() == "true",
+    "path": os.getenv("SEARCH_INDEX_PATH", "data/search.db"),
+}
+
+# Retention: hội thoại không hoạt động quá max_age_days được chuyển vào segment
+# zip nén trong archive_dir (vẫn đọc được qua storage.get_conversation), ảnh
+# trong LOCAL_IMG_DIR không còn message nào tham chiếu thì bị xoá.
+# Chạy tay: python -m backend.storage.retention --dry-run
+RETENTION = {
+    "enabled": os.getenv("RETENTION_ENABLED", "false").lower() == "true",
+    "max_age_days": float(os.getenv("RETENTION_MAX_AGE_DAYS", "90")),
+    "interval_hours": float(os.getenv("RETENTION_INTERVAL_HOURS", "24")),
+    "archive_dir": os.getenv("RETENTION_ARCHIVE_DIR", "data/archive"),
+    "segment_size": 500,        # Số hội thoại tối đa mỗi segment
+    "image_min_age_hours": 24,  # Ảnh mới upload có thể chưa kịp được message tham chiếu
+}
+
+# Thread pool cho storage I/O trong các endpoint async (không chặn event loop)
+STORAGE_IO = {
+    "workers": int(os.getenv("STORAGE_IO_WORKERS", "4")),
+}
+
+# Đo độ trễ event loop, xem /api/metrics -> loop_lag
+LOOP_LAG_MONITOR = {
+    "enabled": os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true",
+    "interval": 0.05,
+    "stall_threshold": 0.1,   # Lag >= 100ms tính là một lần stall
+}
+
+# --- Streaming token từ provider qua SSE (stage1_delta / stage2_delta / stage3_delta) ---
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+
+# --- Cache kết quả LLM (memory LRU + TTL, disk tier tùy chọn để giữ qua restart) ---
+LLM_CACHE = {
+    "enabled": os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true",
+    "ttl": float(os.getenv("LLM_CACHE_TTL", str(24 * 3600))),
+    "max_entries": int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512")),
+    # Để trống để tắt disk tier, ví dụ: LLM_CACHE_DIR=data/llm_cache
+    "disk_dir": os.getenv("LLM_CACHE_DIR") or None,
+}
+
+# --- HTTP connection pool (mỗi provider một pool keep-alive dùng chung) ---
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+HTTP_POOL_LIMITS = {
+    "default": {
+        "max_connections": 20,
+        "max_keepalive_connections": 10,
+        "keepalive_expiry": 60.0,
+        "pool_timeout": 30.0,
+    },
+    "openai": {
+        "max_connections": int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "32")),
+        "max_keepalive_connections": int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "16")),
+        "keepalive_expiry": 60.0,
+        "pool_timeout": 30.0,
+    },
+    "google": {
+        "max_connections": int(os.getenv("GOOGLE_POOL_MAX_CONNECTIONS", "32")),
+        "max_keepalive_connections": int(os.getenv("GOOGLE_POOL_MAX_KEEPALIVE", "16")),
+        "keepalive_expiry": 60.0,
+        "pool_timeout": 30.0,
+    },
+}
 
 # Cấu hình Cloudinary để lưu trữ ảnh
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
@@ -0,0 +1,109 @@
+"""Hedged requests cho các lời gọi đơn lẻ nằm trên đường găng (chairman).
+
+Lời gọi chính chạy bình thường. Nếu sau `delay` giây nó chưa trả lời, một bản
+sao được gửi tới model hedge (HEDGING["targets"]) và kết quả nào về trước thì
+dùng; lời gọi còn lại bị huỷ. `delay` là percentile latency gần đây của model
+chính (model_health), nên chỉ khoảng (1 - percentile) số lời gọi bị hedge.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, Optional
+
+from . import model_health
+from .config import HEDGING
+from .llm_client import query_model
+
+_stats = {
+    "calls": 0,
+    "hedges_fired": 0,
+    "hedge_wins": 0,
+    "primary_wins": 0,
+    "both_failed": 0,
+    "last_delay": {},
+}
+
+
+def hedge_delay(model_id: str) -> float:
+    """Số giây chờ trước khi gửi bản sao, học từ latency gần đây của model."""
+    health = model_health.get_health(model_id)
+    if len(health.latencies) < HEDGING["min_samples"]:
+        return HEDGING["default_delay"]
+    delay = health.latency_percentile(HEDGING["percentile"])
+    return max(HEDGING["min_delay"], delay)
+
+
+def hedge_target(model_id: str) -> str:
+    """Model nhận bản sao; quay về chính model nếu model hedge đang bị ngắt mạch."""
+    target = HEDGING["targets"].get(model_id, model_id)
+    if target != model_id and model_health.get_health(target).state == model_health.OPEN:
+        return model_id
+    return target
+
+
+async def hedged_query(
+    model_id: str, messages, on_delta: Optional[Callable[[str], None]] = None,
+    on_replace: Optional[Callable[[str], None]] = None,
+    **kwargs) -> Optional[Dict[str, Any]]:
+    """
+    Như `query_model` nhưng có hedging khi HEDGING["enabled"]. Response của bản
+    sao thắng có thêm "hedged": True. Chỉ lời gọi chính stream token qua
+    `on_delta`; bản sao chạy không stream. Khi bản sao thắng, text đã stream của
+    lời gọi chính bị thay bằng `on_replace(content của bản sao)`.
+    """
+    if not HEDGING["enabled"]:
+        return await query_model(model_id, messages, on_delta=on_delta, **kwargs)
+
+    _stats["calls"] += 1
+    delay = hedge_delay(model_id)
+    _stats["last_delay"][model_id] = round(delay, 3)
+
+    primary = asyncio.ensure_future(query_model(model_id, messages, on_delta=on_delta, **kwargs))
+    hedge: Optional[asyncio.Future] = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            _stats["primary_wins"] += 1
+            return primary.result()
+
+        target = hedge_target(model_id)
+        print(f"🪁 {model_id} chưa trả lời sau {delay:.1f}s, hedge sang {target}.")
+        _stats["hedges_fired"] += 1
+        # Bản sao không failover: lời gọi chính đã tự failover nếu cần
+        hedge = asyncio.ensure_future(query_model(target, messages, failover=False, **kwargs))
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                response = task.result() if task.exception() is None else None
+                if response is None:
+                    continue
+                if task is hedge:
+                    _stats["hedge_wins"] += 1
+                    # Gọi trước khi huỷ lời gọi chính (finally), nên sau đó
+                    # không còn delta nào của nó tới client
+                    if on_replace is not None:
+                        on_replace(response.get("content", ""))
+                    return {**response, "hedged": True}
+                _stats["primary_wins"] += 1
+                return response
+
+        _stats["both_failed"] += 1
+        return None
+    finally:
+        # Huỷ lời gọi thua (hoặc cả hai nếu chính caller bị huỷ)
+        losers = [task for task in (primary, hedge) if task is not None and not task.done()]
+        for task in losers:
+            task.cancel()
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
+
+
+def stats() -> Dict[str, Any]:
+    fired = _stats["hedges_fired"]
+    return {
+        **_stats,
+        "last_delay": dict(_stats["last_delay"]),
+        "hedge_rate": round(fired / _stats["calls"], 4) if _stats["calls"] else 0.0,
+        "hedge_win_rate": round(_stats["hedge_wins"] / fired, 4) if fired else 0.0,
+    }
@@ -0,0 +1,172 @@
+"""Long-lived httpx connection pools, one per provider.
+
+FastAPI tạo/đóng các pool qua lifespan (`startup` / `shutdown`). Các script
+chạy ngoài server (test_outpainting.py...) vẫn dùng được vì pool được tạo
+lazily ở lần gọi đầu tiên.
+"""
+
+import time
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, AsyncIterator
+
+import httpx
+
+from .config import MODEL_REGISTRY, HTTP_POOL_LIMITS, HTTP2_ENABLED
+
+
+class PoolStats:
+    """Counters used to size the pool under load."""
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0          # Dùng lại một connection keep-alive có sẵn
+        self.misses = 0        # Phải mở TCP/TLS mới
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record(self, reused: bool, wait_time: float):
+        self.requests += 1
+        if reused:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / self.requests, 4) if self.requests else 0.0,
+            "wait_time_total": round(self.wait_time_total, 4),
+            "wait_time_avg": round(self.wait_time_total / self.requests, 4) if self.requests else 0.0,
+            "wait_time_max": round(self.wait_time_max, 4),
+        }
+
+
+class _RequestTrace:
+    """
+    httpcore trace hook: sự kiện đầu tiên sau khi lấy được connection cho biết
+    connection là mới (connect_tcp) hay được tái sử dụng (send_request_headers).
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.acquired_at: Optional[float] = None
+        self.reused = True
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]):
+        if self.acquired_at is not None:
+            return
+        if event_name == "connection.connect_tcp.started":
+            self.reused = False
+            self.acquired_at = time.perf_counter()
+        elif event_name.endswith("send_request_headers.started"):
+            self.acquired_at = time.perf_counter()
+
+    @property
+    def wait_time(self) -> float:
+        end = self.acquired_at if self.acquired_at is not None else time.perf_counter()
+        return end - self.started_at
+
+
+class ProviderPool:
+    """Một `httpx.AsyncClient` dùng chung (keep-alive) cho một provider."""
+
+    def __init__(self, name: str, limits: Dict[str, Any], http2: bool = False):
+        self.name = name
+        self.limits = limits
+        self.http2 = http2
+        self.stats = PoolStats()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.limits.get("max_connections"),
+                    max_keepalive_connections=self.limits.get("max_keepalive_connections"),
+                    keepalive_expiry=self.limits.get("keepalive_expiry"),
+                ),
+                timeout=httpx.Timeout(60.0, pool=self.limits.get("pool_timeout")),
+            )
+        return self._client
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        trace = _RequestTrace()
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+        try:
+            return await self.client.request(method, url, extensions=extensions, **kwargs)
+        finally:
+            self.stats.record(trace.reused, trace.wait_time)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Như `request` nhưng giữ response mở để đọc dần (SSE streaming)."""
+        trace = _RequestTrace()
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+        recorded = False
+        try:
+            async with self.client.stream(method, url, extensions=extensions, **kwargs) as response:
+                self.stats.record(trace.reused, trace.wait_time)
+                recorded = True
+                yield response
+        finally:
+            if not recorded:
+                self.stats.record(trace.reused, trace.wait_time)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_pools: Dict[str, ProviderPool] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print("⚠️ HTTP2_ENABLED=true nhưng chưa cài 'h2' (pip install httpx[http2]). Dùng HTTP/1.1.")
+        return False
+    return True
+
+
+def get_pool(provider: str = "default") -> ProviderPool:
+    """Trả về pool của provider, tạo mới nếu chưa có."""
+    pool = _pools.get(provider)
+    if pool is None:
+        limits = HTTP_POOL_LIMITS.get(provider, HTTP_POOL_LIMITS["default"])
+        pool = ProviderPool(provider, limits, http2=_http2_available())
+        _pools[provider] = pool
+    return pool
+
+
+async def startup():
+    """Tạo sẵn pool cho mọi provider trong MODEL_REGISTRY."""
+    get_pool("default")
+    for config in MODEL_REGISTRY.values():
+        get_pool(config["provider"])
+
+
+async def shutdown():
+    for pool in list(_pools.values()):
+        await pool.aclose()
+    _pools.clear()
+
+
+def stats() -> Dict[str, Any]:
+    return {name: pool.stats.as_dict() for name, pool in _pools.items()}
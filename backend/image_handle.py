@@ -0,0 +1,132 @@
+"""Shared image buffer for one council run.
+
+Ảnh được hash, base64-encode và serialize thành JSON part đúng MỘT lần, sau đó
+mọi lần gọi provider (stage 1, M×N lần refine ở stage 2, chairman ở stage 3)
+dùng lại cùng một buffer thay vì encode lại và giữ bản copy riêng trong payload.
+
+Ảnh upload nằm sẵn trên đĩa (image_store) được bọc bằng `ImageHandle.from_file`:
+bytes chỉ được mmap khi thực sự cần, nên một SSE stream đang chạy không giữ
+bản copy của ảnh gốc trong heap.
+"""
+
+import os
+import json
+import mmap
+import base64
+import hashlib
+from typing import Any, Dict, List, Optional, Union, AsyncIterator
+
+# Placeholder được thay bằng image part đã serialize sẵn khi build request body
+IMAGE_PART_PLACEHOLDER = "__IMAGE_PART__"
+_PLACEHOLDER_JSON = json.dumps(IMAGE_PART_PLACEHOLDER)
+
+
+class ImageHandle:
+    """Ảnh upload + các dạng encode được cache lại (lazy)."""
+
+    def __init__(self, data: Optional[bytes] = None, mime_type: str = "image/jpeg",
+                 sha256: Optional[str] = None, path: Optional[str] = None):
+        if data is None and path is None:
+            raise ValueError("ImageHandle needs data or path")
+        self._data = data
+        self.path = path  # Có path: bytes được mmap lazily từ file
+        self.mime_type = mime_type
+        self._sha256 = sha256  # Biết trước (ảnh từ image_store) thì không hash lại
+        self._b64: Optional[bytes] = None
+        self._parts: Dict[str, List[bytes]] = {}
+
+    @classmethod
+    def from_file(cls, path: str, mime_type: str = "image/jpeg", sha256: Optional[str] = None) -> "ImageHandle":
+        return cls(None, mime_type, sha256=sha256, path=path)
+
+    def with_mime(self, mime_type: str) -> "ImageHandle":
+        """Cùng nguồn dữ liệu, MIME type khác (không copy bytes)."""
+        if self.path is not None and self._data is None:
+            return ImageHandle(None, mime_type, sha256=self._sha256, path=self.path)
+        return ImageHandle(self.data, mime_type, sha256=self._sha256)
+
+    @property
+    def data(self):
+        """bytes, hoặc mmap read-only khi handle trỏ tới file (trang nhớ do OS quản lý)."""
+        if self._data is None:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._data = b""
+                else:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    @classmethod
+    def of(
+        cls, image_data: Union[bytes, "ImageHandle", None],
+        mime_type: str = "image/jpeg") -> Optional["ImageHandle"]:
+        """Bọc bytes thành handle; trả lại nguyên handle nếu đã là ImageHandle."""
+        if image_data is None or isinstance(image_data, ImageHandle):
+            return image_data
+        return cls(image_data, mime_type)
+
+    @property
+    def size(self) -> int:
+        if self._data is None:
+            return os.path.getsize(self.path)
+        return len(self._data)
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    @property
+    def b64(self) -> bytes:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data)
+        return self._b64
+
+    def json_part(self, provider: str) -> List[bytes]:
+        """
+        Image part của provider, đã serialize thành các chunk JSON bytes.
+        Chunk base64 là cùng một buffer cho mọi provider.
+        """
+        part = self._parts.get(provider)
+        if part is None:
+            mime = self.mime_type.encode("ascii")
+            if provider == "openai":
+                part = [
+                    b'{"type": "image_url", "image_url": {"url": "data:' + mime + b';base64,',
+                    self.b64,
+                    b'", "detail": "auto"}}',
+                ]
+            elif provider == "google":
+                part = [
+                    b'{"inline_data": {"mime_type": "' + mime + b'", "data": "',
+                    self.b64,
+                    b'"}}',
+                ]
+            else:
+                raise ValueError(f"Unsupported provider for image part: {provider}")
+            self._parts[provider] = part
+        return part
+
+
+def build_json_body(payload: Dict[str, Any], image_part: Optional[List[bytes]] = None) -> List[bytes]:
+    """
+    Serialize `payload` thành các chunk bytes. Nếu payload chứa
+    IMAGE_PART_PLACEHOLDER, chunk ảnh dùng chung được chèn vào đúng vị trí
+    mà không copy lại.
+    """
+    body = json.dumps(payload, ensure_ascii=False)
+    if image_part is None:
+        return [body.encode("utf-8")]
+
+    prefix, _, suffix = body.partition(_PLACEHOLDER_JSON)
+    return [prefix.encode("utf-8"), *image_part, suffix.encode("utf-8")]
+
+
+def body_length(chunks: List[bytes]) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+
+async def iter_body(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
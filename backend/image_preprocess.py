@@ -0,0 +1,152 @@
+"""Provider-aware image preprocessing.
+
+Trước khi ảnh tới model: nhận diện MIME từ magic bytes, thu nhỏ về độ phân giải
+tối đa mà provider thực sự dùng, rồi encode lại thành JPEG/WebP gọn hơn.
+Kết quả được cache theo content hash nên upload lặp lại không phải xử lý lại:
+trong RAM (LRU) và trên đĩa qua image_store (derivative), giữ được qua restart.
+"""
+
+import io
+import json
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .config import IMAGE_PREPROCESS, PROVIDER_IMAGE_LIMITS
+from .image_handle import ImageHandle
+from . import image_store
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow là optional: thiếu thì gửi ảnh gốc
+    Image = ImageOps = None
+
+EXIF_ORIENTATION = 0x0112
+
+_MAGIC_NUMBERS = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+_cache: "OrderedDict[Tuple[str, str], ImageHandle]" = OrderedDict()
+_in_flight: Dict[Tuple[str, str], "asyncio.Task[ImageHandle]"] = {}
+
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    """Xác định MIME type từ magic bytes (không tin vào tên file); chỉ cần 12 byte đầu."""
+    head = bytes(data[:12])
+    for magic, mime in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _target_size(width: int, height: int, limits: Dict[str, int]) -> Tuple[int, int]:
+    scale = 1.0
+    max_side = limits.get("max_side")
+    if max_side and max(width, height) > max_side:
+        scale = min(scale, max_side / max(width, height))
+    max_short_side = limits.get("max_short_side")
+    if max_short_side and min(width, height) > max_short_side:
+        scale = min(scale, max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess_image(image: ImageHandle, provider: str) -> ImageHandle:
+    """Resize + re-encode đồng bộ (CPU-bound, chạy trong thread pool)."""
+    mime = sniff_mime(image.data) or image.mime_type
+    if Image is None or not IMAGE_PREPROCESS["enabled"]:
+        return image if mime == image.mime_type else image.with_mime(mime)
+
+    limits = PROVIDER_IMAGE_LIMITS.get(provider, {})
+    # Ảnh trên đĩa: Pillow đọc thẳng từ file, không copy cả ảnh vào BytesIO
+    with Image.open(image.path if image.path else io.BytesIO(image.data)) as img:
+        img.load()
+        # Ảnh chụp điện thoại: xoay theo EXIF Orientation trước khi encode lại (tag bị mất khi save)
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        img = ImageOps.exif_transpose(img)
+        size = _target_size(img.width, img.height, limits)
+        resized = size != img.size
+        if resized:
+            img = img.resize(size, Image.LANCZOS)
+
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        fmt = IMAGE_PREPROCESS["format"].upper()
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt, quality=IMAGE_PREPROCESS["quality"], optimize=True)
+        encoded = buffer.getvalue()
+
+    # Không resize/xoay mà encode lại còn nặng hơn thì giữ nguyên ảnh gốc
+    if not resized and not rotated and len(encoded) >= image.size:
+        return image if mime == image.mime_type else image.with_mime(mime)
+    return ImageHandle(encoded, f"image/{fmt.lower()}")
+
+
+def _derivative_kind(provider: str) -> str:
+    # Đổi giới hạn/format/quality thì derivative cũ không còn khớp
+    limits = json.dumps(PROVIDER_IMAGE_LIMITS.get(provider, {}), sort_keys=True)
+    # "upright": derivative tạo trước khi xoay theo EXIF không được dùng lại
+    return (f"preprocess:{provider}:{limits}:{IMAGE_PREPROCESS['format'].upper()}:"
+            f"{IMAGE_PREPROCESS['quality']}:upright")
+
+
+def preprocess_cached(image: ImageHandle, provider: str) -> ImageHandle:
+    """preprocess_image + cache derivative trên đĩa (chỉ với ảnh đã có trong image_store)."""
+    if Image is None or not IMAGE_PREPROCESS["enabled"]:
+        return preprocess_image(image, provider)
+    store = image_store.get_store()
+    kind = _derivative_kind(provider)
+    cached = store.get_derivative(image.sha256, kind)
+    if cached is not None:
+        data, mime = cached
+        return ImageHandle(data, mime)
+    result = preprocess_image(image, provider)
+    store.put_derivative(image.sha256, kind, result.data, result.mime_type)
+    return result
+
+
+async def prepare_for_provider(image: ImageHandle, provider: str) -> ImageHandle:
+    """
+    Trả về bản ảnh đã tối ưu cho provider. Cache theo (sha256, provider); các
+    lần gọi song song cho cùng một ảnh chờ chung một lần xử lý.
+    """
+    key = (image.sha256, provider)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    # Xử lý chạy trong task riêng, mọi caller (kể cả caller đầu tiên) chờ qua
+    # shield: một caller bị huỷ (straggler, deadline, hedging) không kéo theo
+    # các caller khác đang chờ cùng ảnh
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(_preprocess(image, provider, key))
+        _in_flight[key] = task
+    return await asyncio.shield(task)
+
+
+async def _preprocess(image: ImageHandle, provider: str, key: Tuple[str, str]) -> ImageHandle:
+    try:
+        result = await asyncio.to_thread(preprocess_cached, image, provider)
+    except Exception as e:
+        print(f"⚠️ Image preprocessing failed ({provider}): {e}. Dùng ảnh gốc.")
+        result = image
+    finally:
+        _in_flight.pop(key, None)
+
+    _cache[key] = result
+    while len(_cache) > IMAGE_PREPROCESS["cache_size"]:
+        _cache.popitem(last=False)
+    return result
@@ -0,0 +1,181 @@
+"""Publish ảnh upload lên remote (Cloudinary) ở nền.
+
+Upload Cloudinary là lời gọi HTTP đồng bộ, chậm (vài trăm ms tới vài giây) và
+council không cần nó: stage 1/2/3 đọc ảnh từ image_store qua ImageHandle. Vì vậy
+endpoint chỉ `schedule(...)` rồi stream ngay; upload chạy trong thread song song
+với stage 1, xong thì URL được lưu vào image_store (ảnh trùng không upload lại)
+và gắn vào message qua callback.
+
+Backend remote đổi được qua IMAGE_PUBLISHER["backend"] hoặc `set_publisher`
+(test dùng LocalPublisher, không cần mạng).
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from .config import IMAGE_PUBLISHER
+from . import image_store
+
+
+class CloudinaryPublisher:
+    name = "cloudinary"
+
+    def __init__(self, folder: str = IMAGE_PUBLISHER["folder"]):
+        self.folder = folder
+
+    def publish(self, path: str, sha256: str) -> str:
+        import cloudinary.uploader
+
+        # Upload từ file local (không cần giữ bytes trong RAM)
+        result = cloudinary.uploader.upload(path, folder=self.folder)
+        return result["secure_url"]
+
+
+class LocalPublisher:
+    """Stub không gọi mạng: URL nội bộ theo sha256, có thể giả lập độ trễ/lỗi."""
+
+    name = "local"
+
+    def __init__(self, base_url: str = IMAGE_PUBLISHER["local_base_url"], delay: float = 0.0,
+                 fail: bool = False):
+        self.base_url = base_url.rstrip("/")
+        self.delay = delay
+        self.fail = fail
+        self.published = []
+
+    def publish(self, path: str, sha256: str) -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("LocalPublisher configured to fail")
+        self.published.append(sha256)
+        return f"{self.base_url}/{sha256}"
+
+
+def make_publisher(name: str = IMAGE_PUBLISHER["backend"]):
+    if name == "cloudinary":
+        return CloudinaryPublisher()
+    if name == "local":
+        return LocalPublisher()
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown image publisher: {name}")
+
+
+_publisher = None
+_publisher_ready = False
+_inflight: Dict[str, asyncio.Task] = {}  # sha256 -> task upload (ảnh trùng gửi cùng lúc chỉ upload một lần)
+_tasks: Set[asyncio.Task] = set()
+_stats = {"published": 0, "reused": 0, "failed": 0, "total_ms": 0.0}
+
+
+def get_publisher():
+    global _publisher, _publisher_ready
+    if not _publisher_ready:
+        _publisher = make_publisher()
+        _publisher_ready = True
+    return _publisher
+
+
+def set_publisher(publisher):
+    """Đổi publisher đang dùng (test/script); None để tắt publish."""
+    global _publisher, _publisher_ready
+    _publisher = publisher
+    _publisher_ready = True
+
+
+def cached_url(sha256: str) -> Optional[str]:
+    """URL đã publish trước đó cho ảnh này (không upload)."""
+    publisher = get_publisher()
+    if publisher is None:
+        return None
+    return image_store.get_store().get_remote_url(sha256, provider=publisher.name)
+
+
+async def _publish(publisher, sha256: str, path: str) -> Optional[str]:
+    store = image_store.get_store()
+    url = await asyncio.to_thread(store.get_remote_url, sha256, publisher.name)
+    if url is not None:
+        _stats["reused"] += 1
+        return url
+
+    started_at = time.perf_counter()
+    for attempt in range(IMAGE_PUBLISHER["retries"] + 1):
+        try:
+            url = await asyncio.to_thread(publisher.publish, path, sha256)
+            break
+        except Exception as e:
+            print(f"⚠️ Publish ảnh {sha256[:12]} lên {publisher.name} lỗi (lần {attempt + 1}): {e}")
+            if attempt < IMAGE_PUBLISHER["retries"]:
+                await asyncio.sleep(IMAGE_PUBLISHER["retry_delay"] * (attempt + 1))
+    if url is None:
+        _stats["failed"] += 1
+        return None
+
+    _stats["published"] += 1
+    _stats["total_ms"] += (time.perf_counter() - started_at) * 1000
+    await asyncio.to_thread(store.set_remote_url, sha256, url, publisher.name)
+    return url
+
+
+async def _publish_shared(publisher, sha256: str, path: str) -> Optional[str]:
+    task = _inflight.get(sha256)
+    if task is None:
+        task = asyncio.create_task(_publish(publisher, sha256, path))
+        _inflight[sha256] = task
+        task.add_done_callback(lambda _: _inflight.pop(sha256, None))
+    return await asyncio.shield(task)
+
+
+async def _run(publisher, sha256: str, path: str, on_published):
+    url = await _publish_shared(publisher, sha256, path)
+    if url is not None and on_published is not None:
+        try:
+            await on_published(url)
+        except Exception as e:
+            print(f"⚠️ Không lưu được URL ảnh {sha256[:12]}: {e}")
+
+
+def schedule(
+    sha256: str,
+    path: str,
+    on_published: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> Optional[asyncio.Task]:
+    """
+    Publish ảnh ở nền (không chờ); `on_published(url)` được gọi khi có URL.
+    None nếu publish đang tắt.
+    """
+    publisher = get_publisher()
+    if publisher is None:
+        return None
+    task = asyncio.create_task(_run(publisher, sha256, path, on_published))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def shutdown(timeout: float = IMAGE_PUBLISHER["shutdown_timeout"]):
+    """Chờ các upload đang chạy (tối đa `timeout` giây) trước khi đóng storage."""
+    if not _tasks:
+        return
+    pending = list(_tasks)
+    _, not_done = await asyncio.wait(pending, timeout=timeout)
+    for task in not_done:
+        task.cancel()
+    if not_done:
+        print(f"⚠️ Huỷ {len(not_done)} lượt publish ảnh chưa xong khi tắt server")
+        await asyncio.gather(*not_done, return_exceptions=True)
+
+
+def stats() -> Dict[str, Any]:
+    publisher = get_publisher()
+    published = _stats["published"]
+    return {
+        "backend": publisher.name if publisher is not None else None,
+        "pending": len(_tasks),
+        "published": published,
+        "reused": _stats["reused"],
+        "failed": _stats["failed"],
+        "avg_ms": round(_stats["total_ms"] / published, 1) if published else None,
+    }
@@ -0,0 +1,133 @@
+"""Phục vụ ảnh trong image_store trực tiếp từ backend.
+
+URL theo content hash (`/api/images/<sha256>`, `/api/images/<sha256>/thumb`,
+`/api/images/<sha256>/webp`) nên nội dung không bao giờ đổi: ETag mạnh lấy từ
+sha256, Cache-Control immutable, trình duyệt chỉ còn hỏi lại bằng
+If-None-Match (304). File được trả bằng FileResponse (Range, sendfile/pathsend
+nếu server hỗ trợ), không đọc vào RAM.
+
+Thumbnail và WebP được tạo lần đầu có request rồi lưu thành derivative trong
+image_store (xoá cùng ảnh gốc khi GC).
+"""
+
+import hashlib
+import io
+import re
+from typing import Any, Dict, Optional
+
+from .config import IMAGE_SERVING
+from . import image_store
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow là optional: thiếu thì chỉ phục vụ được ảnh gốc
+    Image = ImageOps = None
+
+VARIANT_ORIGINAL = "original"
+VARIANT_THUMB = "thumb"
+VARIANT_WEBP = "webp"
+VARIANTS = (VARIANT_ORIGINAL, VARIANT_THUMB, VARIANT_WEBP)
+
+URL_PREFIX = "/api/images"
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_sha256(value: str) -> bool:
+    return bool(_SHA256_RE.match(value))
+
+
+def derivative_kind(variant: str) -> str:
+    # Đổi kích thước/quality thì derivative (và ETag) cũ không còn khớp;
+    # "upright": bản tạo trước khi xoay theo EXIF Orientation bị bỏ
+    quality = IMAGE_SERVING["webp_quality"]
+    if variant == VARIANT_THUMB:
+        return f"serve:thumb:{IMAGE_SERVING['thumb_size']}:webp:{quality}:upright"
+    return f"serve:webp:{quality}:upright"
+
+
+def _variant_tag(variant: str) -> str:
+    return hashlib.sha256(derivative_kind(variant).encode("utf-8")).hexdigest()[:8]
+
+
+def etag_for(sha256: str, variant: str) -> str:
+    if variant == VARIANT_ORIGINAL:
+        return f'"{sha256}"'
+    return f'"{sha256}-{variant}-{_variant_tag(variant)}"'
+
+
+def url_for(sha256: str, variant: str = VARIANT_ORIGINAL) -> str:
+    if variant == VARIANT_ORIGINAL:
+        return f"{URL_PREFIX}/{sha256}"
+    # Tag trong query: đổi cấu hình thumbnail thì URL đổi, cache immutable cũ không bị dùng lại
+    return f"{URL_PREFIX}/{sha256}/{variant}?v={_variant_tag(variant)}"
+
+
+def image_links(local_image_path: Optional[str]) -> Dict[str, str]:
+    """
+    URL local (ảnh gốc + thumbnail) cho ảnh nằm trong image_store, kể cả path
+    kiểu cũ đã ingest; {} nếu ảnh không có trong store.
+    """
+    sha256 = image_store.resolve_sha(local_image_path)
+    if sha256 is None:
+        return {}
+    links = {"local_image_url": url_for(sha256)}
+    if Image is not None:
+        links["thumbnail_url"] = url_for(sha256, VARIANT_THUMB)
+    return links
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """So khớp If-None-Match (so sánh yếu theo RFC 9110: bỏ qua tiền tố W/)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def _render(path: str, variant: str) -> bytes:
+    with Image.open(path) as img:
+        img.load()
+        img = ImageOps.exif_transpose(img)  # WebP không giữ EXIF: xoay sẵn
+        if variant == VARIANT_THUMB:
+            size = IMAGE_SERVING["thumb_size"]
+            img.thumbnail((size, size), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="WEBP", quality=IMAGE_SERVING["webp_quality"], method=4)
+        return buffer.getvalue()
+
+
+def resolve(sha256: str, variant: str = VARIANT_ORIGINAL) -> Optional[Dict[str, Any]]:
+    """
+    {path, mime, etag} của file cần trả; None nếu không có ảnh. Derivative chưa
+    có thì được tạo và lưu lại (đồng bộ, CPU-bound: gọi trong thread pool).
+    """
+    store = image_store.get_store()
+    record = store.get(sha256)
+    if record is None:
+        return None
+    if variant == VARIANT_ORIGINAL or Image is None:
+        variant = VARIANT_ORIGINAL
+        path, mime = record["path"], record["mime"]
+    else:
+        kind = derivative_kind(variant)
+        found = store.get_derivative_path(sha256, kind)
+        if found is None:
+            store.put_derivative(sha256, kind, _render(record["path"], variant), "image/webp")
+            found = store.get_derivative_path(sha256, kind)
+            if found is None:
+                return None
+        path, mime = found
+    return {"path": path, "mime": mime, "etag": etag_for(sha256, variant)}
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={IMAGE_SERVING['max_age']}, immutable",
+        "X-Content-Type-Options": "nosniff",
+    }
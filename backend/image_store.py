@@ -0,0 +1,487 @@
+"""Kho ảnh đánh địa chỉ theo nội dung (sha256) + đếm tham chiếu.
+
+- Ảnh gốc: `objects/<2 ký tự đầu>/<sha256>.<ext>`; upload trùng nội dung
+  không ghi thêm file nào.
+- refcount = số message đang trỏ tới ảnh. Ảnh được `put` lúc upload (refcount
+  0) và `incref` sau khi message đã lưu; ảnh có refcount 0 (upload lỗi giữa
+  chừng) bị retention dọn, refcount được đếm lại từ hội thoại ở mỗi lượt.
+- Derivative (bản tiền xử lý cho từng provider, thumbnail...) lưu dưới
+  `derived/` theo (sha256 nguồn, kind), xoá cùng ảnh gốc.
+- Remote URL (Cloudinary...) theo (sha256, provider): ảnh trùng không upload lại.
+- Ảnh kiểu cũ `{uuid}_{tên file}` đã ingest: path cũ -> sha256, để message còn
+  trỏ path cũ (archive, JSON chưa migrate) vẫn được phục vụ theo hash.
+
+Metadata nằm trong SQLite (IMAGE_STORE["db"]), mỗi thread một connection.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import IMAGE_STORE, LOCAL_IMG_DIR
+from .storage.base import atomic_open
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    sha256 TEXT PRIMARY KEY,
+    mime TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    original_name TEXT,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS derivatives (
+    sha256 TEXT NOT NULL REFERENCES images(sha256) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    mime TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (sha256, kind)
+);
+
+CREATE TABLE IF NOT EXISTS remote_urls (
+    sha256 TEXT NOT NULL REFERENCES images(sha256) ON DELETE CASCADE,
+    provider TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (sha256, provider)
+);
+
+CREATE TABLE IF NOT EXISTS legacy_files (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES images(sha256) ON DELETE CASCADE
+);
+"""
+
+SQL_GET_IMAGE = "SELECT sha256, mime, size, path, original_name, refcount, created_at FROM images WHERE sha256 = ?"
+SQL_INSERT_IMAGE = (
+    "INSERT OR IGNORE INTO images (sha256, mime, size, path, original_name, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_ADD_REF = "UPDATE images SET refcount = MAX(refcount + ?, 0) WHERE sha256 = ?"
+SQL_RESET_REFS = "UPDATE images SET refcount = 0"
+SQL_SET_REFS = "UPDATE images SET refcount = ? WHERE sha256 = ?"
+SQL_UNREFERENCED = "SELECT sha256, path, size, created_at FROM images WHERE refcount = 0 AND created_at < ?"
+SQL_DELETE_IMAGE = "DELETE FROM images WHERE sha256 = ?"
+SQL_GET_DERIVATIVE = "SELECT mime, path FROM derivatives WHERE sha256 = ? AND kind = ?"
+SQL_LIST_DERIVATIVES = "SELECT path, size FROM derivatives WHERE sha256 = ?"
+SQL_PUT_DERIVATIVE = (
+    "INSERT OR REPLACE INTO derivatives (sha256, kind, mime, size, path) VALUES (?, ?, ?, ?, ?)"
+)
+SQL_GET_REMOTE_URL = "SELECT url FROM remote_urls WHERE sha256 = ? AND provider = ?"
+SQL_PUT_REMOTE_URL = "INSERT OR REPLACE INTO remote_urls (sha256, provider, url) VALUES (?, ?, ?)"
+SQL_GET_LEGACY = "SELECT sha256 FROM legacy_files WHERE path = ?"
+SQL_PUT_LEGACY = "INSERT OR REPLACE INTO legacy_files (path, sha256) VALUES (?, ?)"
+SQL_LIST_LEGACY = "SELECT path, sha256 FROM legacy_files"
+SQL_STATS = "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0) FROM images"
+SQL_DERIVATIVE_STATS = "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM derivatives"
+
+_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+IMAGE_COLUMNS = ("sha256", "mime", "size", "path", "original_name", "refcount", "created_at")
+
+
+def sha256_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha_from_path(path: Optional[str]) -> Optional[str]:
+    """sha256 của ảnh nếu `path` nằm trong store (`objects/ab/<sha>.<ext>`), ngược lại None."""
+    if not path:
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    if len(name) == 64 and os.path.basename(os.path.dirname(path)) == name[:2]:
+        return name
+    return None
+
+
+class ImageStore:
+    def __init__(self, root: str, derived_dir: str, db_path: str):
+        self.root = root
+        self.derived_dir = derived_dir
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        for directory in (root, derived_dir, os.path.dirname(db_path)):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+        self.stats_counters = {"puts": 0, "dedup_hits": 0, "bytes_saved": 0,
+                               "derivative_hits": 0, "remote_url_hits": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def object_path(self, sha256: str, mime: str) -> str:
+        return os.path.join(self.root, sha256[:2], f"{sha256}.{_EXTENSIONS.get(mime, 'bin')}")
+
+    # --- Ảnh gốc ---
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(SQL_GET_IMAGE, (sha256,)).fetchone()
+        return dict(zip(IMAGE_COLUMNS, row)) if row is not None else None
+
+    def put(self, data: bytes, mime: str, original_name: Optional[str] = None,
+            sha256: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Lưu ảnh nếu chưa có. Trả về (record, created); created=False nghĩa là ảnh
+        trùng, không ghi gì thêm xuống đĩa.
+        """
+        sha256 = sha256 or sha256_of(data)
+        self.stats_counters["puts"] += 1
+        record = self.get(sha256)
+        if record is not None and os.path.exists(record["path"]):
+            self.stats_counters["dedup_hits"] += 1
+            self.stats_counters["bytes_saved"] += len(data)
+            return record, False
+
+        path = self.object_path(sha256, mime)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_open(path, fsync=True) as f:
+            f.write(data)
+        with self._conn() as conn:
+            conn.execute(SQL_INSERT_IMAGE, (sha256, mime, len(data), path, original_name,
+                                            datetime.utcnow().isoformat()))
+        return self.get(sha256), True
+
+    def temp_path(self) -> str:
+        """File tạm cho upload đang stream (cùng ổ đĩa với objects/ để os.replace)."""
+        directory = os.path.join(self.root, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{uuid.uuid4().hex}.part")
+
+    def put_file(self, temp_path: str, sha256: str, size: int, mime: str,
+                 original_name: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Như `put` nhưng dữ liệu đã nằm trong `temp_path` (đã fsync, hash sẵn):
+        file tạm được rename thành object, hoặc bị xoá nếu ảnh đã có.
+        """
+        self.stats_counters["puts"] += 1
+        record = self.get(sha256)
+        if record is not None and os.path.exists(record["path"]):
+            os.remove(temp_path)
+            self.stats_counters["dedup_hits"] += 1
+            self.stats_counters["bytes_saved"] += size
+            return record, False
+
+        path = self.object_path(sha256, mime)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        with self._conn() as conn:
+            conn.execute(SQL_INSERT_IMAGE, (sha256, mime, size, path, original_name,
+                                            datetime.utcnow().isoformat()))
+        return self.get(sha256), True
+
+    def read(self, sha256: str) -> Optional[bytes]:
+        record = self.get(sha256)
+        if record is None:
+            return None
+        try:
+            with open(record["path"], "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def incref(self, sha256: str, count: int = 1):
+        with self._conn() as conn:
+            conn.execute(SQL_ADD_REF, (count, sha256))
+
+    def decref(self, sha256: str, count: int = 1):
+        with self._conn() as conn:
+            conn.execute(SQL_ADD_REF, (-count, sha256))
+
+    def reconcile(self, counts: Dict[str, int]):
+        """Đặt lại refcount theo số message thực sự tham chiếu (đếm từ hội thoại)."""
+        with self._conn() as conn:
+            conn.execute(SQL_RESET_REFS)
+            conn.executemany(SQL_SET_REFS, [(count, sha) for sha, count in counts.items()])
+
+    def gc(self, min_age_seconds: float = 0.0, dry_run: bool = False) -> Dict[str, int]:
+        """Xoá ảnh refcount 0 cũ hơn `min_age_seconds` cùng derivative của chúng."""
+        cutoff = datetime.utcfromtimestamp(time.time() - min_age_seconds).isoformat()
+        report = {"deleted": 0, "bytes_reclaimed": 0}
+        self._gc_temp_files(min_age_seconds, dry_run, report)
+        conn = self._conn()
+        for sha256, path, size, _ in conn.execute(SQL_UNREFERENCED, (cutoff,)).fetchall():
+            derivatives = conn.execute(SQL_LIST_DERIVATIVES, (sha256,)).fetchall()
+            report["deleted"] += 1
+            derived = {d_path: d_size for d_path, d_size in derivatives if d_path != path}
+            report["bytes_reclaimed"] += size + sum(derived.values())
+            if dry_run:
+                continue
+            with conn:
+                conn.execute(SQL_DELETE_IMAGE, (sha256,))  # derivatives/remote_urls: ON DELETE CASCADE
+            for file_path in [path, *derived]:
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+        return report
+
+    def _gc_temp_files(self, min_age_seconds: float, dry_run: bool, report: Dict[str, int]):
+        # File .part còn sót lại khi upload bị ngắt giữa chừng (crash, mất kết nối)
+        directory = os.path.join(self.root, "tmp")
+        if not os.path.isdir(directory):
+            return
+        min_mtime = time.time() - min_age_seconds
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                    if stat.st_mtime > min_mtime:
+                        continue
+                    if not dry_run:
+                        os.remove(entry.path)
+                except OSError:
+                    continue
+                report["deleted"] += 1
+                report["bytes_reclaimed"] += stat.st_size
+
+    # --- Derivative ---
+
+    def get_derivative(self, sha256: str, kind: str) -> Optional[Tuple[bytes, str]]:
+        """(bytes, mime) của bản dẫn xuất đã cache, hoặc None."""
+        found = self.get_derivative_path(sha256, kind)
+        if found is None:
+            return None
+        path, mime = found
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return data, mime
+
+    def get_derivative_path(self, sha256: str, kind: str) -> Optional[Tuple[str, str]]:
+        """(path, mime) của bản dẫn xuất đã cache (để trả file trực tiếp), hoặc None."""
+        row = self._conn().execute(SQL_GET_DERIVATIVE, (sha256, kind)).fetchone()
+        if row is None or not os.path.exists(row[1]):
+            return None
+        self.stats_counters["derivative_hits"] += 1
+        return row[1], row[0]
+
+    def put_derivative(self, sha256: str, kind: str, data: bytes, mime: str) -> bool:
+        """Chỉ cache derivative của ảnh có trong store; False nếu ảnh nguồn không có."""
+        source = self.get(sha256)
+        if source is None:
+            return False
+        if len(data) == source["size"] and sha256_of(data) == sha256:
+            path = source["path"]  # Derivative giống hệt ảnh gốc: trỏ thẳng vào file gốc
+        else:
+            name = hashlib.sha256(kind.encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(self.derived_dir, sha256[:2], f"{sha256}_{name}.{_EXTENSIONS.get(mime, 'bin')}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_open(path, fsync=False) as f:
+                f.write(data)
+        with self._conn() as conn:
+            conn.execute(SQL_PUT_DERIVATIVE, (sha256, kind, mime, len(data), path))
+        return True
+
+    # --- Remote URL ---
+
+    def get_remote_url(self, sha256: str, provider: str = "cloudinary") -> Optional[str]:
+        row = self._conn().execute(SQL_GET_REMOTE_URL, (sha256, provider)).fetchone()
+        if row is not None:
+            self.stats_counters["remote_url_hits"] += 1
+        return row[0] if row is not None else None
+
+    def set_remote_url(self, sha256: str, url: str, provider: str = "cloudinary"):
+        with self._conn() as conn:
+            conn.execute(SQL_PUT_REMOTE_URL, (sha256, provider, url))
+
+    # --- Ảnh kiểu cũ đã ingest ---
+
+    def legacy_sha(self, path: Optional[str]) -> Optional[str]:
+        if not path:
+            return None
+        row = self._conn().execute(SQL_GET_LEGACY, (os.path.abspath(path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def record_legacy(self, path: str, sha256: str):
+        with self._conn() as conn:
+            conn.execute(SQL_PUT_LEGACY, (os.path.abspath(path), sha256))
+
+    def legacy_map(self) -> Dict[str, str]:
+        return dict(self._conn().execute(SQL_LIST_LEGACY).fetchall())
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        images, size, refs = conn.execute(SQL_STATS).fetchone()
+        derivatives, derivative_bytes = conn.execute(SQL_DERIVATIVE_STATS).fetchone()
+        return {**self.stats_counters, "images": images, "bytes": size, "references": refs,
+                "derivatives": derivatives, "derivative_bytes": derivative_bytes}
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_store: Optional[ImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ImageStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageStore(IMAGE_STORE["dir"], IMAGE_STORE["derived_dir"], IMAGE_STORE["db"])
+    return _store
+
+
+def close():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def resolve_sha(path: Optional[str]) -> Optional[str]:
+    """sha256 của ảnh mà `path` trỏ tới: path trong store hoặc path kiểu cũ đã ingest."""
+    return sha_from_path(path) or get_store().legacy_sha(path)
+
+
+def count_references(paths: Iterable[str]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    legacy: Optional[Dict[str, str]] = None
+    for path in paths:
+        sha256 = sha_from_path(path)
+        if sha256 is None and path:
+            # Path kiểu cũ (archive, JSON chưa migrate) vẫn giữ bản trong store
+            if legacy is None:
+                legacy = get_store().legacy_map()
+            sha256 = legacy.get(os.path.abspath(path))
+        if sha256 is not None:
+            counts[sha256] = counts.get(sha256, 0) + 1
+    return counts
+
+
+def legacy_files(image_dir: str = LOCAL_IMG_DIR, only_new: bool = False) -> List[os.DirEntry]:
+    """File kiểu cũ ở gốc `image_dir`; `only_new`: bỏ các file đã ingest."""
+    if not os.path.isdir(image_dir):
+        return []
+    with os.scandir(image_dir) as entries:
+        files = [entry for entry in entries if entry.is_file()]
+    if only_new and files:
+        known = get_store().legacy_map()
+        files = [entry for entry in files if os.path.abspath(entry.path) not in known]
+    return files
+
+
+def ingest_legacy(image_dir: str = LOCAL_IMG_DIR, keep_originals: bool = False,
+                  only_new: bool = False) -> Dict[str, Any]:
+    """
+    Đưa ảnh kiểu cũ `{uuid}_{tên file}` trong `image_dir` vào store, sửa
+    local_image_path của các message đang trỏ tới chúng, rồi xoá file cũ.
+    Ảnh được hội thoại trong archive hoặc hội thoại JSON cũ chưa migrate
+    (không được sửa path) tham chiếu vẫn được giữ lại; path cũ của mọi file
+    được ghi nhớ (legacy_files) để vẫn phục vụ được theo hash.
+    """
+    from . import storage
+    from .image_preprocess import sniff_mime
+    from .storage.archive import image_paths
+
+    store = get_store()
+    report = {"files": 0, "duplicates": 0, "bytes_before": 0, "bytes_after": 0,
+              "conversations_updated": 0, "originals_removed": 0}
+    moved: Dict[str, str] = {}  # abspath cũ -> path trong store
+    for entry in legacy_files(image_dir, only_new):
+        with open(entry.path, "rb") as f:
+            data = f.read()
+        original_name = entry.name.split("_", 1)[1] if "_" in entry.name else entry.name
+        record, created = store.put(data, sniff_mime(data) or "application/octet-stream", original_name)
+        moved[os.path.abspath(entry.path)] = record["path"]
+        store.record_legacy(entry.path, record["sha256"])
+        report["files"] += 1
+        report["bytes_before"] += len(data)
+        report["bytes_after"] += len(data) if created else 0
+        report["duplicates"] += 0 if created else 1
+
+    backend = storage.get_backend()
+    for conversation in list(backend.iter_conversations()):
+        changed = False
+        for message in conversation["messages"]:
+            new_path = moved.get(os.path.abspath(message.get("local_image_path") or ""))
+            if new_path is not None:
+                message["local_image_path"] = new_path
+                changed = True
+        if changed:
+            backend.save_conversation(conversation)
+            report["conversations_updated"] += 1
+
+    legacy_refs = []
+    for conversation in storage.iter_unmigrated_legacy():
+        legacy_refs.extend(image_paths(conversation))
+    report["legacy_conversations_refs"] = len(legacy_refs)
+    kept = {os.path.abspath(path) for path in storage.get_archive().image_paths()}
+    kept.update(os.path.abspath(path) for path in legacy_refs)
+    if not keep_originals:
+        for old_path in moved:
+            if old_path not in kept:
+                os.remove(old_path)
+                report["originals_removed"] += 1
+
+    refs = legacy_refs + list(storage.get_archive().image_paths())
+    for conversation in backend.iter_conversations():
+        refs.extend(image_paths(conversation))
+    store.reconcile(count_references(refs))
+    return report
+
+
+def ingest_on_startup() -> Optional[Dict[str, Any]]:
+    """
+    Ingest các ảnh kiểu cũ chưa có trong store trước khi server nhận request
+    (IMAGE_STORE["ingest_legacy_on_startup"]), để lịch sử cũ cũng được phục vụ
+    local kèm thumbnail thay vì ảnh full-size từ Cloudinary. None nếu không có gì.
+    """
+    if not IMAGE_STORE["ingest_legacy_on_startup"] or not legacy_files(only_new=True):
+        return None
+    started_at = time.perf_counter()
+    report = ingest_legacy(only_new=True)
+    print(f"🖼️ Ingested {report['files']} legacy images into image_store "
+          f"({report['conversations_updated']} conversations updated) in "
+          f"{time.perf_counter() - started_at:.1f}s")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed image store")
+    parser.add_argument("--ingest-legacy", action="store_true",
+                        help="Chuyển ảnh {uuid}_{tên file} trong LOCAL_IMG_DIR vào store")
+    parser.add_argument("--keep-originals", action="store_true", help="Không xoá file cũ sau khi chuyển")
+    args = parser.parse_args()
+
+    if args.ingest_legacy:
+        print(json.dumps(ingest_legacy(keep_originals=args.keep_originals), indent=2))
+    print(json.dumps(get_store().stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
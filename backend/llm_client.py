@@ -1,41 +1,148 @@
 import httpx
-import random
+import time
 import asyncio
-import base64
-from typing import List, Dict, Any, Optional
-from .config import MODEL_REGISTRY
+import json
+from typing import List, Dict, Any, Iterable, Optional, Union, Callable
+from .config import MODEL_REGISTRY, LLM_CACHE
+from . import http_pool
+from . import response_cache
+from . import rate_limiter
+from . import model_health
+from .image_preprocess import prepare_for_provider
+from .image_handle import (ImageHandle, IMAGE_PART_PLACEHOLDER,
+                           build_json_body, body_length, iter_body)
+
+DEFAULT_TEMPERATURE = 0.7
 
 async def query_model(
     model_id: str, messages: List[Dict[str, str]],
     timeout: float = 60.0, retries: int = 3,
-    image_data: Optional[bytes] = None, image_mime_type: str = "image/jpeg",
-    image_url: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    image_data: Union[bytes, ImageHandle, None] = None, image_mime_type: str = "image/jpeg",
+    image_url: Optional[str] = None, temperature: float = DEFAULT_TEMPERATURE,
+    cache_mode: str = response_cache.CACHE_USE,
+    on_delta: Optional[Callable[[str], None]] = None,
+    failover: bool = True, exclude: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Gọi một model. Nếu có `on_delta`, provider được gọi ở chế độ streaming và
+    mỗi đoạn text mới được truyền vào `on_delta(text)` ngay khi tới.
+
+    Nếu circuit breaker của `model_id` đang mở hoặc lời gọi thất bại, các model
+    dự phòng cùng vai trò (MODEL_FALLBACKS) được thử lần lượt; response khi đó
+    có thêm "failover_from". "model_id" trong response là model thực sự trả lời.
+    Model trong `exclude` không được dùng làm dự phòng.
+    """
+
+    if model_id not in MODEL_REGISTRY:
+        print(f"Error: Model ID '{model_id}' not found.")
+        return None
+
+    image = ImageHandle.of(image_data, image_mime_type)
+    chain = model_health.failover_chain(model_id, exclude) if failover else [model_id]
+
+    for candidate_id in chain:
+        response = await _query_model_once(
+            candidate_id, messages, timeout, retries, image, image_url,
+            temperature, cache_mode, on_delta
+        )
+        if response is None:
+            continue
+
+        response = {**response, "model_id": candidate_id}
+        if candidate_id != model_id:
+            model_health.get_health(model_id).failovers += 1
+            response["failover_from"] = model_id
+            print(f"↪️ {model_id} không khả dụng, dùng {candidate_id} thay thế.")
+        return response
+
+    return None
+
+async def _query_model_once(
+    model_id: str, messages: List[Dict[str, str]], timeout: float, retries: int,
+    image: Optional[ImageHandle], image_url: Optional[str], temperature: float,
+    cache_mode: str, on_delta: Optional[Callable[[str], None]]) -> Optional[Dict[str, Any]]:
+    """Một model_id: cache -> circuit breaker -> provider. None nếu lỗi hoặc bị ngắt mạch."""
 
     config = MODEL_REGISTRY.get(model_id)
     if not config:
         print(f"Error: Model ID '{model_id}' not found.")
         return None
 
+    # Cache: tra trước khi tải/tiền xử lý ảnh để cache hit không tốn gì thêm
+    cache = response_cache.get_cache()
+    cache_key = None
+    if LLM_CACHE["enabled"]:
+        if cache_mode == response_cache.CACHE_BYPASS:
+            cache.stats.bypasses += 1
+        else:
+            cache_key = response_cache.make_key(
+                model_id, config, messages, temperature,
+                image_hash=image.sha256 if image else None, image_url=image_url
+            )
+            if cache_mode == response_cache.CACHE_REFRESH:
+                cache.stats.refreshes += 1
+            else:
+                cached = await cache.get(cache_key)
+                if cached is not None:
+                    if on_delta is not None:
+                        on_delta(cached["content"])
+                    return cached
+
+    # Circuit breaker: model đang lỗi thì fail ngay thay vì chờ timeout
+    health = model_health.get_health(model_id)
+    if not health.allow():
+        print(f"🔌 {model_id}: circuit {health.state}, bỏ qua.")
+        return None
+
+    started_at = time.monotonic()
+    try:
+        response = await _query_provider(
+            model_id, config, messages, timeout, retries, image, image_url, temperature, on_delta
+        )
+    except asyncio.CancelledError:
+        health.release()
+        raise
+    health.record(response is not None and "error" not in response, time.monotonic() - started_at)
+
+    if cache_key and response_cache.is_cacheable(response):
+        await cache.put(cache_key, response)
+    return response
+
+async def _query_provider(
+    model_id: str, config: Dict[str, Any], messages: List[Dict[str, str]],
+    timeout: float, retries: int, image: Optional[ImageHandle],
+    image_url: Optional[str], temperature: float,
+    on_delta: Optional[Callable[[str], None]] = None) -> Optional[Dict[str, Any]]:
+
     provider = config["provider"]
 
     # Xử lý Logic Image: Nếu có URL mà chưa có Data, thử tải ảnh về
     # Điều này giúp Google Gemini (REST) có thể xử lý được ảnh từ URL
-    if image_url and not image_data and provider == "google":
-        image_data, image_mime_type = await _download_image_from_url(image_url)
+    if image_url and image is None and provider == "google":
+        downloaded, downloaded_mime = await _download_image_from_url(image_url)
+        image = ImageHandle.of(downloaded, downloaded_mime)
+
+    # Thu nhỏ + encode lại theo giới hạn của provider (cache theo content hash)
+    if image is not None:
+        image = await prepare_for_provider(image, provider)
 
     # Vòng lặp thử lại (Retry Loop)
+    # Mỗi lần thử phải lấy lượt từ limiter của (provider, API key) trước khi gọi
+    limiter = rate_limiter.get_limiter(config)
     for attempt in range(retries):
         try:
-            if provider == "openai":
-                return await _call_openai_style(config, messages, timeout, image_url=image_url, image_data=image_data)
-            elif provider == "google":
-                # Ưu tiên dùng REST API cho mọi trường hợp để giảm phụ thuộc thư viện
-                return await _call_google_rest(config, messages, timeout, image_data, image_mime_type)
+            async with limiter.slot():
+                if provider == "openai":
+                    return await _call_openai_style(config, messages, timeout, image_url=image_url, image=image,
+                                                    temperature=temperature, on_delta=on_delta)
+                elif provider == "google":
+                    # Ưu tiên dùng REST API cho mọi trường hợp để giảm phụ thuộc thư viện
+                    return await _call_google_rest(config, messages, timeout, image=image, temperature=temperature,
+                                                   on_delta=on_delta)
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 429:
-                wait_time = (2 ** attempt) + random.uniform(0, 1)
-                print(f"⚠️ {model_id} bị 429. Đợi {wait_time:.1f}s rồi thử lại...")
-                await asyncio.sleep(wait_time)
+                # Chặn cả bucket theo Retry-After; lần thử sau tự xếp hàng chờ trong limiter
+                wait_time = limiter.on_throttled(rate_limiter.retry_after_seconds(e.response), attempt)
+                print(f"⚠️ {model_id} bị 429. Tạm dừng {limiter.name} {wait_time:.1f}s rồi thử lại...")
                 continue
             else:
                 print(f"Error querying {model_id}: {e}")
@@ -49,24 +156,83 @@ async def query_model(
 async def _download_image_from_url(url: str) -> tuple[Optional[bytes], str]:
     """Helper: Tải ảnh từ URL để chuyển cho các model không hỗ trợ URL trực tiếp"""
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, timeout=10.0)
-            resp.raise_for_status()
-            content_type = resp.headers.get("content-type", "image/jpeg")
-            return resp.content, content_type
+        resp = await http_pool.get_pool().get(url, timeout=10.0)
+        resp.raise_for_status()
+        content_type = resp.headers.get("content-type", "image/jpeg")
+        return resp.content, content_type
     except Exception as e:
         print(f"Warning: Failed to download image from {url}: {e}")
         return None, "image/jpeg"
 
-async def _call_openai_style(config, messages, timeout, image_url: str = None, image_data: bytes = None): 
+async def _post_json(config, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                     timeout: float, image_part: Optional[List[bytes]] = None) -> httpx.Response:
+    """
+    POST payload JSON qua pool của provider. Image part (nếu có) là buffer dùng
+    chung của ImageHandle, được stream thẳng vào body thay vì copy vào payload.
+    """
+    chunks = build_json_body(payload, image_part)
+    headers = {**headers, "Content-Length": str(body_length(chunks))}
+    response = await http_pool.get_pool(config["provider"]).post(
+        url, headers=headers, content=iter_body(chunks), timeout=timeout
+    )
+    rate_limiter.get_limiter(config).observe(response.headers)
+    return response
+
+async def _stream_json(config, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                       timeout: float, image_part: Optional[List[bytes]],
+                       extract_text: Callable[[Dict[str, Any]], str],
+                       on_delta: Callable[[str], None]) -> str:
+    """
+    Giống _post_json nhưng đọc response dạng SSE: mỗi đoạn text mới được đẩy
+    ngay qua `on_delta`, trả về toàn bộ nội dung khi stream kết thúc.
+    """
+    chunks = build_json_body(payload, image_part)
+    headers = {**headers, "Content-Length": str(body_length(chunks))}
+    pieces = []
+    async with http_pool.get_pool(config["provider"]).stream(
+        "POST", url, headers=headers, content=iter_body(chunks), timeout=timeout
+    ) as response:
+        rate_limiter.get_limiter(config).observe(response.headers)
+        if response.is_error:
+            # Đọc body để xử lý 429 (Retry-After / RetryInfo) như lúc không stream
+            await response.aread()
+            response.raise_for_status()
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                text = extract_text(json.loads(data))
+            except (ValueError, KeyError, IndexError):
+                continue
+            if text:
+                pieces.append(text)
+                on_delta(text)
+    return "".join(pieces)
+
+def _openai_delta_text(chunk: Dict[str, Any]) -> str:
+    choices = chunk.get("choices") or []
+    return (choices[0].get("delta", {}).get("content") or "") if choices else ""
+
+def _google_delta_text(chunk: Dict[str, Any]) -> str:
+    parts = chunk["candidates"][0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+async def _call_openai_style(config, messages, timeout, image_url: str = None, image: ImageHandle = None,
+                             temperature: float = DEFAULT_TEMPERATURE,
+                             on_delta: Optional[Callable[[str], None]] = None): 
     headers = {
         "Authorization": f"Bearer {config['api_key']}",
         "Content-Type": "application/json",
     }
     
-    final_messages = []
+    final_messages = list(messages)
+    image_part = None
     
-    if image_url or image_data:
+    if image_url or image:
             # Lấy message cuối cùng của user
             # Lưu ý: Cần copy messages để tránh sửa đổi list gốc
             final_messages = [msg for msg in messages[:-1]] 
@@ -80,16 +246,10 @@ async def _call_openai_style(config, messages, timeout, image_url: str = None, i
                     "type": "image_url",
                     "image_url": {"url": image_url, "detail": "auto"}
                 })
-            elif image_data:
-                # Nếu là file local, dùng Base64
-                b64_image = base64.b64encode(image_data).decode('utf-8')
-                content_payload.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{b64_image}", # Format chuẩn cho OpenAI
-                        "detail": "auto"
-                    }
-                })
+            elif image:
+                # Nếu là file local, dùng Base64 đã encode sẵn trong ImageHandle
+                content_payload.append(IMAGE_PART_PLACEHOLDER)
+                image_part = image.json_part("openai")
 
             final_messages.append({
                 "role": "user",
@@ -98,24 +258,32 @@ async def _call_openai_style(config, messages, timeout, image_url: str = None, i
     payload = {
         "model": config["model"],
         "messages": final_messages,
-        "temperature": 0.7
+        "temperature": temperature
     }
 
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(
-            config["base_url"],
-            headers=headers,
-            json=payload
+    if on_delta is not None:
+        # Streaming: OpenAI trả về SSE với choices[0].delta.content
+        payload["stream"] = True
+        content = await _stream_json(
+            config, config["base_url"], headers, payload, timeout, image_part,
+            _openai_delta_text, on_delta
         )
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            'content': data['choices'][0]['message']['content'],
-            'model_used': config['model']
-        }
+        return {'content': content, 'model_used': config['model']}
 
-async def _call_google_rest(config, messages, timeout, image_data: bytes = None, image_mime_type: str = "image/jpeg"):
+    response = await _post_json(
+        config, config["base_url"], headers, payload, timeout, image_part=image_part
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    return {
+        'content': data['choices'][0]['message']['content'],
+        'model_used': config['model']
+    }
+
+async def _call_google_rest(config, messages, timeout, image: ImageHandle = None,
+                            temperature: float = DEFAULT_TEMPERATURE,
+                            on_delta: Optional[Callable[[str], None]] = None):
     """
     Xử lý gọi Google Gemini qua REST API.
     Hỗ trợ cả Text và Image (dưới dạng Inline Data base64).
@@ -124,16 +292,12 @@ async def _call_google_rest(config, messages, timeout, image_data: bytes = None,
     # Chuẩn bị nội dung cho Google
     # Lưu ý: Google REST API cấu trúc content là danh sách các parts
     parts = []
+    image_part = None
     
     # 1. Thêm hình ảnh nếu có (phải đưa lên trước text theo khuyến nghị)
-    if image_data:
-        b64_image = base64.b64encode(image_data).decode('utf-8')
-        parts.append({
-            "inline_data": {
-                "mime_type": image_mime_type,
-                "data": b64_image
-            }
-        })
+    if image:
+        parts.append(IMAGE_PART_PLACEHOLDER)
+        image_part = image.json_part("google")
 
     # 2. Thêm text từ message cuối cùng của user
     # (Google thường xử lý tốt nhất khi gộp prompt lại, nhưng ở đây ta lấy msg cuối)
@@ -157,39 +321,62 @@ async def _call_google_rest(config, messages, timeout, image_data: bytes = None,
     headers = {"Content-Type": "application/json"}
     payload = {
         "contents": google_contents,
-        "generationConfig": {"temperature": 0.7}
+        "generationConfig": {"temperature": temperature}
     }
 
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        try:
-            content = data['candidates'][0]['content']['parts'][0]['text']
-            return {
-                'content': content,
-                'model_used': config['model']
-            }
-        except (KeyError, IndexError):
-            # print(f"Debug Google Resp: {data}")
-            return {'content': "Error: Empty response from Gemini", 'model_used': config['model']}
+    if on_delta is not None:
+        # Streaming: streamGenerateContent với alt=sse trả về từng candidate chunk
+        stream_url = f"{config['base_url']}/{config['model']}:streamGenerateContent?alt=sse&key={config['api_key']}"
+        content = await _stream_json(
+            config, stream_url, headers, payload, timeout, image_part,
+            _google_delta_text, on_delta
+        )
+        if not content:
+            return {'content': "Error: Empty response from Gemini", 'model_used': config['model'],
+                    'error': "empty_response"}
+        return {'content': content, 'model_used': config['model']}
+
+    response = await _post_json(config, url, headers, payload, timeout, image_part=image_part)
+    response.raise_for_status()
+    data = response.json()
+
+    try:
+        content = data['candidates'][0]['content']['parts'][0]['text']
+        return {
+            'content': content,
+            'model_used': config['model']
+        }
+    except (KeyError, IndexError):
+        # print(f"Debug Google Resp: {data}")
+        return {'content': "Error: Empty response from Gemini", 'model_used': config['model'],
+                'error': "empty_response"}
 
 async def query_models_parallel(
     model_ids: List[str], messages: List[Dict[str, str]],
-    image_data: Optional[bytes] = None, image_mime_type: str = "image/jpeg",
-    image_url: Optional[str] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+    image_data: Union[bytes, ImageHandle, None] = None, image_mime_type: str = "image/jpeg",
+    image_url: Optional[str] = None,
+    cache_mode: str = response_cache.CACHE_USE,
+    on_delta: Optional[Callable[[str, str], None]] = None) -> Dict[str, Optional[Dict[str, Any]]]:
     """
     Gọi song song nhiều model ID khác nhau.
+    `on_delta(model_id, text)` nhận token streaming của từng model (nếu có).
     """
+    image_data = ImageHandle.of(image_data, image_mime_type)
     tasks = [
         query_model(
             mid, messages, 
             image_data=image_data, 
             image_mime_type=image_mime_type, 
-            image_url=image_url
+            image_url=image_url,
+            cache_mode=cache_mode,
+            on_delta=_bind_model(on_delta, mid)
         ) 
         for mid in model_ids
     ]
     responses = await asyncio.gather(*tasks)
-    return {mid: resp for mid, resp in zip(model_ids, responses)}
\ No newline at end of file
+    return {mid: resp for mid, resp in zip(model_ids, responses)}
+
+def _bind_model(on_delta: Optional[Callable[[str, str], None]], model_id: str) -> Optional[Callable[[str], None]]:
+    if on_delta is None:
+        return None
+    return lambda text: on_delta(model_id, text)
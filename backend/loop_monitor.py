@@ -0,0 +1,71 @@
+"""Đo độ trễ của event loop (loop lag).
+
+Một task nền ngủ `interval` giây rồi đo xem thực tế bị trễ bao lâu so với dự
+kiến. Lag cao nghĩa là có code đồng bộ (file I/O, json.dumps lớn...) đang chặn
+event loop, làm mọi SSE stream khác bị đứng theo.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from .config import LOOP_LAG_MONITOR
+from .model_health import percentile
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float, window: int = 600):
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.stalls = 0  # Số lần lag vượt stall_threshold
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started_at - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= LOOP_LAG_MONITOR["stall_threshold"]:
+                self.stalls += 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        samples = list(self.samples)
+        p99 = percentile(samples, 0.99)
+        return {
+            "interval": self.interval,
+            "samples": len(samples),
+            "lag_avg_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+            "lag_p99_ms": round(p99 * 1000, 3) if p99 is not None else 0.0,
+            "lag_max_ms": round(self.max_lag * 1000, 3),
+            "stalls": self.stalls,
+        }
+
+
+monitor = LoopLagMonitor(LOOP_LAG_MONITOR["interval"])
+
+
+def start():
+    if LOOP_LAG_MONITOR["enabled"]:
+        monitor.start()
+
+
+async def stop():
+    await monitor.stop()
+
+
+def stats() -> Dict[str, Any]:
+    return monitor.as_dict()
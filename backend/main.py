@@ -1,25 +1,59 @@
 """FastAPI backend for LLM Council (Outpainting)."""
 
-from fastapi import FastAPI, HTTPException, Form, File, UploadFile
+from fastapi import FastAPI, HTTPException, Form, File, UploadFile, Query, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
 import uuid
+import asyncio
 import os
 import shutil
-import cloudinary
-import cloudinary.uploader
 import json
 
 from . import storage
+from .storage import aio as async_storage
+from .storage import retention
+from .storage import export as storage_export
+from . import loop_monitor
+from . import http_pool
+from . import response_cache
+from . import rate_limiter
+from . import stage_policy
+from . import model_health
+from . import hedging
+from . import image_store
+from . import upload
+from . import image_publisher
+from . import image_serving
+from . import outpaint_canvas
 from .OutpaintingCouncil import OutpaintingCouncil
+from .image_handle import ImageHandle
+from .config import LLM_STREAMING, LOCAL_IMG_DIR, UPLOAD, OUTPAINT_CANVAS
 
 # --- Cấu hình thư mục lưu ảnh Local ---
-LOCAL_IMG_DIR = "local_storage/images"
 os.makedirs(LOCAL_IMG_DIR, exist_ok=True)
 
-app = FastAPI(title="Outpainting Council API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mở connection pool dùng chung cho các provider, đóng khi tắt server
+    await http_pool.startup()
+    # Chạy xong trước khi nhận request: ingest sửa path trong hội thoại
+    await asyncio.to_thread(image_store.ingest_on_startup)
+    loop_monitor.start()
+    retention.start()
+    yield
+    await retention.stop()
+    await loop_monitor.stop()
+    await http_pool.shutdown()
+    await image_publisher.shutdown()  # Upload ảnh đang chạy còn cần ghi URL vào message
+    await async_storage.shutdown()  # Ghi nốt các batch đang chờ
+    storage.set_backend(None)  # Flush write-behind cache, đóng connection SQLite
+    storage.search_index.close()
+    image_store.close()
+
+app = FastAPI(title="Outpainting Council API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,10 +61,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 council = OutpaintingCouncil()
 
+# Dư cho các field form khác (content, cache_mode) và boundary của multipart
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Từ chối trước khi nhận body nếu Content-Length đã vượt giới hạn;
+    # upload không có Content-Length (chunked) vẫn bị chặn trong upload.save_upload
+    if request.method == "POST" and request.url.path.endswith("/message/stream"):
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > UPLOAD["max_bytes"] + UPLOAD_FORM_OVERHEAD:
+            return JSONResponse(status_code=413, content={
+                "detail": f"Image exceeds the {UPLOAD['max_bytes']} byte upload limit"
+            })
+    return await call_next(request)
+
 # --- Pydantic Models ---
 class CreateConversationRequest(BaseModel):
     title: Optional[str] = "New Outpainting Task"
@@ -40,12 +90,14 @@ class ConversationMetadata(BaseModel):
     created_at: str
     title: str
     message_count: int
+    thumbnail_url: Optional[str] = None
 
 class Conversation(BaseModel):
     id: str
     created_at: str
     title: str
     messages: List[Dict[str, Any]]
+    archived: bool = False
 
 # --- Endpoints ---
 
@@ -53,42 +105,222 @@ class Conversation(BaseModel):
 async def root():
     return {"status": "ok", "service": "Outpainting Council API"}
 
+@app.get("/api/metrics")
+async def metrics():
+    return {
+        "http_pool": http_pool.stats(),
+        "llm_cache": response_cache.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "stage_policy": stage_policy.stats(),
+        "model_health": model_health.stats(),
+        "hedging": hedging.stats(),
+        "storage": storage.stats(),
+        "storage_io": async_storage.stats(),
+        "loop_lag": loop_monitor.stats(),
+        "retention": retention.stats(),
+        "image_store": image_store.get_store().stats(),
+        "image_publisher": image_publisher.stats(),
+    }
+
 @app.get("/api/conversations", response_model=List[ConversationMetadata])
-async def list_conversations():
-    return storage.list_conversations()
+async def list_conversations(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None
+):
+    """Mới nhất trước. Nếu còn trang sau, cursor của nó nằm ở header X-Next-Cursor."""
+    try:
+        items, next_cursor = await async_storage.list_conversations_page(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    for item in items:
+        # Ảnh đầu tiên của hội thoại -> thumbnail cho danh sách
+        item["thumbnail_url"] = image_serving.image_links(item.pop("cover_image", None)).get("thumbnail_url")
+    return items
+
+@app.get("/api/search")
+async def search(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    kind: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
+    """
+    Tìm trong tin nhắn người dùng, prompt được chọn, đánh giá của chairman và
+    tiêu đề hội thoại (lọc bằng kind). Xếp theo độ liên quan; trang kế tiếp qua
+    header X-Next-Cursor.
+    """
+    if kind is not None and kind not in storage.search_index.KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {storage.search_index.KINDS}")
+    try:
+        results, next_cursor = await async_storage.search(q, limit, cursor, kind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
+
+@app.get("/api/export")
+async def export_conversations(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    task_type: Optional[str] = None,
+    unit: str = storage_export.UNIT_CONVERSATION,
+    detail: str = storage.DETAIL_FULL,
+    archived: bool = True
+):
+    """
+    Stream NDJSON, mỗi dòng một hội thoại (unit=conversation) hoặc một message
+    (unit=message). Lọc theo khoảng [since, until) và task_type.
+    """
+    try:
+        lines = storage_export.iter_export(since, until, task_type, unit, detail, archived)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Generator đồng bộ được Starlette chạy trên threadpool, không chặn event loop
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'}
+    )
+
+IMPORT_BATCH_LINES = 200
+
+@app.post("/api/import")
+async def import_conversations(request: Request, overwrite: bool = False):
+    """Nhận NDJSON (định dạng của /api/export) theo từng chunk, ghi dần từng nhóm dòng."""
+    importer = storage_export.Importer(overwrite)
+    buffer = b""
+    lines: List[str] = []
+    async for chunk in request.stream():
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        lines.extend(line.decode("utf-8", errors="replace") for line in complete)
+        if len(lines) >= IMPORT_BATCH_LINES:
+            await async_storage.import_lines(importer, lines)
+            lines = []
+    if buffer:
+        lines.append(buffer.decode("utf-8", errors="replace"))
+    await async_storage.import_lines(importer, lines)
+    return importer.result()
 
 @app.post("/api/conversations", response_model=Conversation)
 async def create_conversation(request: CreateConversationRequest):
     conversation_id = str(uuid.uuid4())
-    conversation = storage.create_conversation(conversation_id)
+    conversation = await async_storage.create_conversation(conversation_id)
     if request.title:
-        storage.update_conversation_title(conversation_id, request.title)
+        await async_storage.update_conversation_title(conversation_id, request.title)
     return conversation
 
 @app.get("/api/conversations/{conversation_id}", response_model=Conversation)
-async def get_conversation(conversation_id: str):
-    conversation = storage.get_conversation(conversation_id)
+async def get_conversation(conversation_id: str, detail: str = storage.DETAIL_COMPACT):
+    """
+    Mặc định (detail=compact) mỗi assistant message chỉ kèm council_summary;
+    detail=full trả về council_response đầy đủ như trước.
+    """
+    if detail not in storage.DETAIL_LEVELS:
+        raise HTTPException(status_code=400, detail=f"detail must be one of {storage.DETAIL_LEVELS}")
+    conversation = await async_storage.get_conversation(conversation_id, detail)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    # Ảnh trong image_store được phục vụ local (thumbnail cho lịch sử chat)
+    conversation["messages"] = [
+        {**message, **image_serving.image_links(message.get("local_image_path"))}
+        for message in conversation["messages"]
+    ]
     return conversation
 
+@app.api_route("/api/images/{sha256}", methods=["GET", "HEAD"])
+@app.api_route("/api/images/{sha256}/{variant}", methods=["GET", "HEAD"])
+async def get_image(sha256: str, request: Request, variant: str = image_serving.VARIANT_ORIGINAL):
+    """
+    Ảnh gốc hoặc derivative (thumb / webp) theo sha256. ETag mạnh + cache
+    immutable; If-None-Match khớp -> 304, Range -> 206 (FileResponse).
+    """
+    if not image_serving.is_sha256(sha256) or variant not in image_serving.VARIANTS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # ETag biết trước từ URL: 304 mà không cần chạm tới store hay đĩa
+    etag = image_serving.etag_for(sha256, variant)
+    if image_serving.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=image_serving.cache_headers(etag))
+
+    try:
+        found = await asyncio.to_thread(image_serving.resolve, sha256, variant)
+    except FileNotFoundError:  # File gốc vừa bị GC khi đang tạo thumbnail
+        found = None
+    return await _image_file_response(found)
+
+@app.api_route("/api/images/{sha256}/outpaint/{tag}/{artifact}", methods=["GET", "HEAD"])
+async def get_outpaint_artifact(sha256: str, tag: str, artifact: str, request: Request):
+    """Canvas / mask / feathered_mask / preview (PNG) đã dựng sau stage 3, cache như ảnh gốc."""
+    if (not image_serving.is_sha256(sha256) or not outpaint_canvas.is_tag(tag)
+            or artifact not in outpaint_canvas.ARTIFACTS):
+        raise HTTPException(status_code=404, detail="Image not found")
+    found = await asyncio.to_thread(outpaint_canvas.resolve, sha256, tag, artifact)
+    if found is not None and image_serving.etag_matches(request.headers.get("if-none-match"), found["etag"]):
+        return Response(status_code=304, headers=image_serving.cache_headers(found["etag"]))
+    return await _image_file_response(found)
+
+async def _image_file_response(found: Optional[Dict[str, Any]]):
+    try:
+        if found is not None:
+            stat_result = await asyncio.to_thread(os.stat, found["path"])
+    except FileNotFoundError:  # Ảnh vừa bị GC
+        found = None
+    if found is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(found["path"], media_type=found["mime"], stat_result=stat_result,
+                        headers=image_serving.cache_headers(found["etag"]))
+
+COUNCIL_SECTIONS = (("stage1", "stage1_results"), ("stage2", "stage2_results"))
+
+@app.get("/api/conversations/{conversation_id}/messages/{message_index}/council")
+async def get_council_detail(conversation_id: str, message_index: int, stage: Optional[str] = None):
+    """
+    Chi tiết đầy đủ các stage của một assistant message, dạng NDJSON: mỗi dòng
+    {"stage": "stage1" | "stage2" | "final", "data": ...}. Lọc bằng ?stage=.
+    """
+    council_result = await async_storage.get_council_result(conversation_id, message_index)
+    if council_result is None:
+        raise HTTPException(status_code=404, detail="Council result not found")
+
+    def lines():
+        for name, key in COUNCIL_SECTIONS:
+            if stage in (None, name):
+                for item in council_result.get(key) or []:
+                    yield json.dumps({"stage": name, "data": item}, ensure_ascii=False) + "\n"
+        if stage in (None, "final") and council_result.get("final_result") is not None:
+            yield json.dumps({"stage": "final", "data": council_result["final_result"]}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/api/conversations/{conversation_id}/message/stream")
 async def send_message_and_process(
     conversation_id: str,
     content: str = Form(...), # User Prompt
-    image: UploadFile | None = File(None)
+    image: UploadFile | None = File(None),
+    cache_mode: str = Form(response_cache.CACHE_USE) # "use" | "refresh" | "bypass"
 ):
     """
     Main Endpoint xử lý:
     1. Kiểm tra keyword ("scale", "expand", "outpainting"...).
-    2. Nếu có keyword + ảnh -> Lưu Local -> Upload Cloudinary -> Gọi Council.
+    2. Nếu có keyword + ảnh -> Lưu Local -> Gọi Council (upload Cloudinary chạy nền song song).
     3. Nếu không -> Trả về thông báo bình thường (hoặc chat logic khác).
     """
     
     # 1. Validate Conversation
-    conversation = storage.get_conversation(conversation_id)
+    conversation = await async_storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.get("archived"):
+        # Hội thoại đã lưu trữ: đưa về backend trước khi ghi tiếp
+        await async_storage.restore_conversation(conversation_id)
+
+    if cache_mode not in response_cache.CACHE_MODES:
+        raise HTTPException(status_code=400, detail=f"cache_mode must be one of {response_cache.CACHE_MODES}")
 
     # 2. Kiểm tra Keywords (Điều kiện kích hoạt Task)
     trigger_keywords = ["scale", "expand", "extend", "outpainting", "mở rộng"]
@@ -96,99 +328,105 @@ async def send_message_and_process(
 
     image_url = None
     local_image_path = None
-    image_data = None
+    image_handle = None
+    image_sha256 = None
     image_mime_type = "image/jpeg"
 
     # 3. Xử lý ảnh (Chỉ xử lý nếu User có gửi ảnh)
     if image:
-        # a. Đọc bytes
-        image_data = await image.read()
-        
-        # Xác định mime type
+        # Xác định mime type từ nội dung file, tên file chỉ là fallback
         filename = image.filename.lower() if image.filename else "image.jpg"
         if filename.endswith('.png'): image_mime_type = "image/png"
         elif filename.endswith('.webp'): image_mime_type = "image/webp"
 
-        # b. LƯU LOCAL
-        # Tạo tên file unique để tránh trùng đè
-        local_filename = f"{uuid.uuid4()}_{filename}"
-        local_image_path = os.path.join(LOCAL_IMG_DIR, local_filename)
-        
-        with open(local_image_path, "wb") as f:
-            f.write(image_data)
-        print(f"💾 Đã lưu ảnh local tại: {local_image_path}")
-
-        # c. UPLOAD CLOUDINARY (Để lấy URL public hiển thị trên Web Frontend)
+        # a+b. Stream xuống đĩa theo chunk (hash + nhận diện MIME trong lúc ghi),
+        # lưu theo sha256: ảnh đã từng upload không ghi thêm file
         try:
-            # Upload từ bytes data
-            upload_result = cloudinary.uploader.upload(
-                image_data, 
-                folder="outpainting_tasks"
-            )
-            image_url = upload_result["secure_url"]
-        except Exception as e:
-            print(f"⚠️ Cloudinary upload failed: {e}")
-            # Nếu lỗi upload, ta vẫn chạy tiếp được vì đã có image_data và local path
+            image_record, created = await upload.save_upload(image, image_mime_type, filename)
+        except upload.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except upload.EmptyUpload as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        image_sha256 = image_record["sha256"]
+        image_mime_type = image_record["mime"]
+        local_image_path = image_record["path"]
+        print(f"💾 {'Đã lưu ảnh local tại' if created else 'Ảnh đã có sẵn'}: {local_image_path}")
+
+        # c. URL public (hiển thị trên Web Frontend): ảnh trùng dùng lại URL của lần
+        # upload trước; ảnh mới được upload nền ở bước 4, không chặn council
+        image_url = await asyncio.to_thread(image_publisher.cached_url, image_sha256)
 
     # 4. Lưu User Message vào DB
-    storage.add_user_message(conversation_id, content, image_url, local_image_path)
-    
+    # Message + title được gửi cùng lúc nên được ghi chung một batch
+    writes = [async_storage.add_user_message(conversation_id, content, image_url, local_image_path)]
+
     # Cập nhật title hội thoại
     if len(conversation["messages"]) == 0:
         short_title = (content[:30] + '...') if len(content) > 30 else content
-        storage.update_conversation_title(conversation_id, short_title)
+        writes.append(async_storage.update_conversation_title(conversation_id, short_title))
+    await asyncio.gather(*writes)
+    if image_sha256 is not None:
+        await asyncio.to_thread(image_store.get_store().incref, image_sha256)
+        if image_url is None:
+            # Upload chạy song song với stage 1; xong thì gắn URL vào user message.
+            # Lỗi upload không ảnh hưởng council vì đã có ảnh local
+            async def attach_url(url: str, path: str = local_image_path):
+                await async_storage.set_message_image_url(conversation_id, path, url)
+
+            image_publisher.schedule(image_sha256, local_image_path, attach_url)
 
     # 5. QUYẾT ĐỊNH LOGIC XỬ LÝ
-    if is_outpainting_task and image_data:
+    if is_outpainting_task and local_image_path:
         print(f"🚀 Detected Outpainting Task for {conversation_id}...")
 
+        # Encode ảnh một lần cho cả lượt chạy council (stage 1, 2, 3 dùng chung);
+        # handle trỏ tới file trong image_store, bytes chỉ được mmap khi cần
+        image_handle = ImageHandle.from_file(local_image_path, image_mime_type, sha256=image_sha256)
+
         async def event_generator():
             try:
                 yield f"data: {json.dumps({'type': 'start'})}\n\n"
 
                 # GỌI COUNCIL XỬ LÝ (STREAM KẾT QUẢ)
-                # ==== STAGE 1 ====
-                yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-
-                stage1_results = await council._stage1_collect_responses(
-                    content, image_url, image_data, image_mime_type
-                )
-
-                yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
-
-                # ==== STAGE 2 ====
-                yield f"data: {json.dumps({'type': 'stage2_start'})}\n\n"
-
-                stage2_results = await council._stage2_complete_responses(
-                    content, stage1_results, image_url, image_data, image_mime_type
-                )
-
-                stage2_payload = {
-                    "type": "stage2_complete",
-                    "data": stage2_results
-                }
-
-                yield f"data: {json.dumps(stage2_payload)}\n\n"
-                # ==== STAGE 3 ====
-                yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
-
-                final_result = await council._stage3_evaluate_and_select(
-                    content, stage2_results, image_url, image_data, image_mime_type
-                )
-
-                final_payload = {
-                    "type": "stage3_complete",
-                    "data": {
-                        "model": final_result.get("selected_model"),
-                        "response": final_result.get("selected_response"),
-                        "evaluation": final_result.get("evaluation"),
-                    }
-                }
-
-                yield f"data: {json.dumps(final_payload)}\n\n"
+                # Council yield event theo thứ tự hoàn thành (staged hoặc pipelined)
+                stage1_results, stage2_results, final_result = [], [], {}
+                async for event in council.stream_events(
+                    content, image_url, image_handle, image_mime_type, cache_mode,
+                    stream_tokens=LLM_STREAMING
+                ):
+                    if event["type"] == "stage1_complete":
+                        stage1_results = event["data"]
+                    elif event["type"] == "stage2_complete":
+                        stage2_results = event["data"]
+                    elif event["type"] == "stage3_complete":
+                        final_result = event["data"]
+                        event = {
+                            "type": "stage3_complete",
+                            "data": {
+                                "model": final_result.get("selected_model"),
+                                "response": final_result.get("selected_response"),
+                                "evaluation": final_result.get("evaluation"),
+                            }
+                        }
+
+                    yield f"data: {json.dumps(event)}\n\n"
+
+                # Dựng canvas + mask từ expansion_settings được chọn cho công cụ inpainting
+                # Lỗi ở bước này chỉ bỏ qua canvas, kết quả council vẫn được lưu
+                if OUTPAINT_CANVAS["enabled"] and final_result.get("selected_response"):
+                    try:
+                        canvas = await asyncio.to_thread(
+                            outpaint_canvas.prepare, image_sha256, final_result["selected_response"]
+                        )
+                    except Exception as e:
+                        print(f"⚠️ Dựng canvas outpainting thất bại: {e}")
+                        canvas = None
+                    if canvas is not None:
+                        final_result["canvas"] = canvas
+                        yield f"data: {json.dumps({'type': 'canvas_complete', 'data': canvas})}\n\n"
 
                 # ==== SAVE RESULT ====
-                storage.add_assistant_message(
+                await async_storage.add_assistant_message(
                     conversation_id,
                     {
                         "stage1_results": stage1_results,
@@ -233,7 +471,7 @@ async def send_message_and_process(
             }
         }
         
-        storage.add_assistant_message(conversation_id, fallback_response, task_type="chat")
+        await async_storage.add_assistant_message(conversation_id, fallback_response, task_type="chat")
         return fallback_response
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+"""Health tracker + circuit breaker cho từng model_id trong MODEL_REGISTRY.
+
+Ghi nhận tỉ lệ lỗi và latency của các lần gọi gần nhất. Khi tỉ lệ lỗi vượt
+ngưỡng, breaker chuyển sang OPEN: mọi lời gọi tới model đó fail ngay (và được
+chuyển cho model dự phòng cùng vai trò) thay vì chờ hết timeout 60s. Sau
+`open_seconds`, breaker cho một vài lời gọi thăm dò (HALF_OPEN) để quyết định
+đóng lại hay mở tiếp.
+"""
+
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from .config import CIRCUIT_BREAKER, MODEL_FALLBACKS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentile (0..1) theo nearest-rank; None nếu chưa có dữ liệu."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ModelHealth:
+    def __init__(self, model_id: str, settings: Dict[str, Any]):
+        self.model_id = model_id
+        self.settings = settings
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        # (ok, latency) của các lần gọi gần nhất
+        self.outcomes: Deque[Tuple[bool, float]] = deque(maxlen=settings["window_size"])
+        # Latency của các lần gọi thành công, dùng cho hedging
+        self.latencies: Deque[float] = deque(maxlen=settings["latency_window"])
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+        self.failovers = 0
+
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok, _ in self.outcomes if not ok) / len(self.outcomes)
+
+    def allow(self) -> bool:
+        """Có được phép gọi model này lúc này không."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.settings["open_seconds"]:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.settings["half_open_probes"]:
+                self.rejected += 1
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def record(self, ok: bool, latency: float):
+        self.calls += 1
+        if latency >= self.settings["slow_call_seconds"]:
+            ok = False  # Chậm quá ngưỡng cũng tính là lỗi
+        if not ok:
+            self.failures += 1
+        else:
+            self.latencies.append(latency)
+
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if ok:
+                self.state = CLOSED
+                self.outcomes.clear()
+            else:
+                self._trip()
+            return
+
+        self.outcomes.append((ok, latency))
+        if (not ok and len(self.outcomes) >= self.settings["min_calls"]
+                and self.failure_rate() >= self.settings["failure_rate_threshold"]):
+            self._trip()
+
+    def release(self):
+        """Lời gọi bị huỷ (quorum/deadline): không tính là thành công hay lỗi."""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        print(f"🔌 Circuit OPEN cho {self.model_id} (failure rate {self.failure_rate():.0%})")
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        return percentile(list(self.latencies), q)
+
+    def as_dict(self) -> Dict[str, Any]:
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate(), 4),
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "trips": self.trips,
+            "failovers": self.failovers,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+
+_health: Dict[str, ModelHealth] = {}
+
+
+def get_health(model_id: str) -> ModelHealth:
+    health = _health.get(model_id)
+    if health is None:
+        health = ModelHealth(model_id, CIRCUIT_BREAKER)
+        _health[model_id] = health
+    return health
+
+
+def failover_chain(model_id: str, exclude: Iterable[str] = ()) -> List[str]:
+    """
+    model_id chính rồi tới các model dự phòng cùng vai trò trong council, bỏ qua
+    các model trong `exclude` (các thành viên khác của cùng stage: chúng đang
+    chạy cùng prompt, failover sang đó chỉ tạo ra một bản trùng).
+    """
+    chain = [model_id]
+    skip = set(exclude)
+    for fallback_id in MODEL_FALLBACKS.get(model_id, []):
+        if fallback_id not in chain and fallback_id not in skip:
+            chain.append(fallback_id)
+    return chain
+
+
+def stats() -> Dict[str, Any]:
+    return {model_id: health.as_dict() for model_id, health in _health.items()}
@@ -0,0 +1,364 @@
+"""Canvas + mask cho outpainting, dựng từ expansion_settings mà council chọn.
+
+Response cuối của council là JSON có block `expansion_settings`, ví dụ
+`{"direction": "left, right", "pixel_amount": 256, "mask_blur": 8}` (prompt hiện
+tại) hoặc `{"directions": [...], "expansion_amount": {"top": .., "unit": ..}}`
+(template chi tiết trong format.json). Module này đổi nó thành padding từng cạnh
+rồi dựng bằng NumPy (không vòng lặp theo pixel):
+
+- canvas: ảnh gốc ở giữa, vùng mới tô xám trung tính
+- mask: 255 ở vùng cần vẽ, 0 ở ảnh gốc (nhị phân)
+- feathered_mask: mask làm mờ bằng box blur tách trục (cumsum, 3 lượt ~ Gaussian);
+  mask là phần bù của một hình chữ nhật = tích ngoài của 2 profile 1D, nên chỉ
+  cần blur 2 vector (H' + W' phần tử) rồi nhân ngoài
+- preview: vùng mới tô bằng np.pad mode edge / reflect / symmetric
+
+Kết quả lưu thành derivative PNG của ảnh gốc trong image_store (xoá cùng ảnh
+gốc) và được phục vụ qua /api/images/<sha256>/outpaint/<tag>/<artifact>, nên
+công cụ inpainting phía sau lấy thẳng canvas + mask.
+
+    python -m backend.outpaint_canvas img/dongho_0075_nong-nhan.jpg '{"direction": "all", "pixel_amount": 128}' -o out/
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import re
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .config import OUTPAINT_CANVAS
+from . import image_store
+from .image_serving import URL_PREFIX
+
+try:
+    import numpy as np
+except ImportError:  # NumPy là optional: thiếu thì bỏ qua bước dựng canvas
+    np = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+SIDES = ("top", "bottom", "left", "right")
+ARTIFACTS = ("canvas", "mask", "feathered_mask", "preview")
+FILL_MODES = ("edge", "reflect", "symmetric")
+
+# Từ khoá hướng mở rộng (tiếng Anh + tiếng Việt) -> các cạnh
+_DIRECTION_ALIASES = {
+    "all": SIDES, "all sides": SIDES, "around": SIDES, "every": SIDES, "outward": SIDES,
+    "xung quanh": SIDES, "tất cả": SIDES, "mọi phía": SIDES,
+    "horizontal": ("left", "right"), "horizontally": ("left", "right"), "sides": ("left", "right"),
+    "width": ("left", "right"), "ngang": ("left", "right"), "hai bên": ("left", "right"),
+    "vertical": ("top", "bottom"), "vertically": ("top", "bottom"), "height": ("top", "bottom"),
+    "dọc": ("top", "bottom"),
+    "top": ("top",), "up": ("top",), "upward": ("top",), "above": ("top",), "trên": ("top",),
+    "bottom": ("bottom",), "down": ("bottom",), "downward": ("bottom",), "below": ("bottom",),
+    "dưới": ("bottom",),
+    "left": ("left",), "trái": ("left",),
+    "right": ("right",), "phải": ("right",),
+}
+_DIRECTION_RE = re.compile(
+    r"(?<!\w)(" + "|".join(re.escape(k) for k in sorted(_DIRECTION_ALIASES, key=len, reverse=True)) + r")(?!\w)"
+)
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_TAG_RE = re.compile(r"^[0-9a-f]{12}$")
+
+
+# --- Đọc expansion_settings ---
+
+def extract_json(response: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """JSON object trong response của model (bỏ ```json fence / text thừa); ValueError nếu không có."""
+    if isinstance(response, dict):
+        return response
+    text = (response or "").strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            raise ValueError("Response does not contain a JSON object")
+        data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("Response JSON is not an object")
+    return data
+
+
+def parse_directions(value: Any) -> Tuple[str, ...]:
+    """'left, right' / ['top', 'bottom'] / 'all sides' / 'hai bên' -> các cạnh (theo thứ tự SIDES)."""
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(v) for v in value)
+    sides = set()
+    for match in _DIRECTION_RE.findall(str(value or "").lower()):
+        sides.update(_DIRECTION_ALIASES[match])
+    return tuple(side for side in SIDES if side in sides)
+
+
+def _amount(value: Any, extent: int, percent: bool = False) -> int:
+    """
+    256 / '256px' / '25%' -> số pixel (phần trăm tính theo chiều tương ứng của ảnh).
+    Giá trị do model viết nên không tin kiểu: list/dict/bool, NaN, vô cực -> ValueError.
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid expansion amount: {value!r}")
+    if isinstance(value, str):
+        percent = percent or "%" in value
+        match = _NUMBER_RE.search(value)
+        if match is None:
+            raise ValueError(f"Invalid expansion amount: {value!r}")
+        value = match.group()
+    try:
+        number = float(value)
+    except OverflowError:  # Số nguyên JSON quá lớn
+        raise ValueError(f"Invalid expansion amount: {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid expansion amount: {value!r}")
+    return max(0, round(number * extent / 100 if percent else number))
+
+
+def _extent(side: str, width: int, height: int) -> int:
+    return height if side in ("top", "bottom") else width
+
+
+def parse_expansion(response: Union[str, Dict[str, Any]], width: int, height: int) -> Dict[str, int]:
+    """
+    Padding từng cạnh + mask_blur từ response (chuỗi JSON hoặc dict, có hoặc
+    không bọc trong expansion_settings). ValueError nếu không mở rộng cạnh nào
+    hoặc vượt giới hạn trong OUTPAINT_CANVAS.
+    """
+    data = extract_json(response)
+    settings = data.get("expansion_settings", data)
+    if not isinstance(settings, dict):
+        raise ValueError("expansion_settings must be an object")
+    directions = parse_directions(settings.get("directions", settings.get("direction")))
+    padding = dict.fromkeys(SIDES, 0)
+
+    amounts = settings.get("expansion_amount")
+    if isinstance(amounts, dict):
+        # Template chi tiết: số pixel (hoặc %) riêng cho từng cạnh
+        percent = str(amounts.get("unit", "pixels")).lower() in ("percent", "percentage", "%")
+        for side in SIDES:
+            padding[side] = _amount(amounts.get(side), _extent(side, width, height), percent)
+    elif "pixel_amount" in settings:
+        for side in directions or SIDES:
+            padding[side] = _amount(settings["pixel_amount"], _extent(side, width, height))
+
+    new_dimensions = settings.get("new_dimensions")
+    if not any(padding.values()) and isinstance(new_dimensions, dict):
+        # Chỉ có kích thước đích: chia phần dư cho các cạnh được chọn
+        for axis, (low, high), current in (("width", ("left", "right"), width),
+                                          ("height", ("top", "bottom"), height)):
+            extra = _amount(new_dimensions.get(axis), 1) - current
+            chosen = [side for side in (low, high) if not directions or side in directions]
+            if extra > 0 and chosen:
+                for i, side in enumerate(chosen):
+                    padding[side] = extra // len(chosen) + (1 if i < extra % len(chosen) else 0)
+
+    if directions:
+        padding = {side: (amount if side in directions else 0) for side, amount in padding.items()}
+    if not any(padding.values()):
+        raise ValueError("expansion_settings does not expand any side")
+    for side, amount in padding.items():
+        if amount > OUTPAINT_CANVAS["max_expand"]:
+            raise ValueError(f"Expansion of {amount}px on {side} exceeds {OUTPAINT_CANVAS['max_expand']}px")
+    total = (width + padding["left"] + padding["right"]) * (height + padding["top"] + padding["bottom"])
+    if total > OUTPAINT_CANVAS["max_pixels"]:
+        raise ValueError(f"Expanded canvas of {total} pixels exceeds {OUTPAINT_CANVAS['max_pixels']}")
+
+    blur = settings.get("mask_blur", settings.get("feathering"))
+    blur = OUTPAINT_CANVAS["default_mask_blur"] if blur in (None, "") else _amount(blur, 1)
+    return {**padding, "mask_blur": min(blur, OUTPAINT_CANVAS["max_mask_blur"])}
+
+
+# --- Dựng canvas / mask (NumPy) ---
+
+def _pad_width(plan: Dict[str, int], channels: bool):
+    pad = ((plan["top"], plan["bottom"]), (plan["left"], plan["right"]))
+    return pad + ((0, 0),) if channels else pad
+
+
+def make_mask(height: int, width: int, plan: Dict[str, int]) -> "np.ndarray":
+    """Mask nhị phân uint8 (H', W'): 255 ở vùng mở rộng, 0 ở ảnh gốc."""
+    mask = np.full((height + plan["top"] + plan["bottom"], width + plan["left"] + plan["right"]),
+                   255, dtype=np.uint8)
+    mask[plan["top"]:plan["top"] + height, plan["left"]:plan["left"] + width] = 0
+    return mask
+
+
+def _box_blur_axis(values: "np.ndarray", radius: int, axis: int) -> "np.ndarray":
+    # Trung bình trượt cửa sổ 2r+1 qua tổng tích luỹ: O(N) bất kể bán kính
+    size = 2 * radius + 1
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (radius + 1, radius)
+    summed = np.cumsum(np.pad(values, pad, mode="edge"), axis=axis)
+    n = values.shape[axis]
+    upper = [slice(None)] * values.ndim
+    lower = [slice(None)] * values.ndim
+    upper[axis] = slice(size, size + n)
+    lower[axis] = slice(0, n)
+    return (summed[tuple(upper)] - summed[tuple(lower)]) / size
+
+
+def blur_mask(mask: "np.ndarray", sigma: float, passes: int = 3) -> "np.ndarray":
+    """
+    Làm mờ mask bất kỳ bằng box blur tách trục (mỗi lượt chạy theo hàng rồi theo
+    cột); 3 lượt xấp xỉ Gaussian với độ lệch chuẩn ~ sigma.
+    """
+    if sigma <= 0:
+        return mask.copy()
+    radius = _box_radius(sigma, passes)
+    values = mask.astype(np.float64)
+    for _ in range(passes):
+        values = _box_blur_axis(values, radius, axis=0)
+        values = _box_blur_axis(values, radius, axis=1)
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def _box_radius(sigma: float, passes: int) -> int:
+    # Bề rộng box để `passes` lượt có phương sai sigma^2: w^2 = 12 sigma^2 / passes + 1
+    return max(1, round(((12 * sigma * sigma / passes + 1) ** 0.5 - 1) / 2))
+
+
+def feathered_mask(height: int, width: int, plan: Dict[str, int], passes: int = 3) -> "np.ndarray":
+    """
+    Bằng blur_mask(make_mask(...)) nhưng O(H' + W') cho phần blur: mask =
+    255 * (1 - rows ⊗ cols) với rows/cols là chỉ báo 1D của ảnh gốc, và blur tách
+    trục của tích ngoài là tích ngoài của hai profile đã blur.
+    """
+    rows = np.zeros(height + plan["top"] + plan["bottom"])
+    cols = np.zeros(width + plan["left"] + plan["right"])
+    rows[plan["top"]:plan["top"] + height] = 1.0
+    cols[plan["left"]:plan["left"] + width] = 1.0
+    if plan["mask_blur"] > 0:
+        radius = _box_radius(plan["mask_blur"], passes)
+        for _ in range(passes):
+            rows = _box_blur_axis(rows, radius, axis=0)
+            cols = _box_blur_axis(cols, radius, axis=0)
+    inside = np.outer((rows * 255).astype(np.float32), cols.astype(np.float32))
+    return np.rint(255 - inside, out=inside).astype(np.uint8)
+
+
+def generate(pixels: "np.ndarray", plan: Dict[str, int], fill: str = "edge") -> Dict[str, "np.ndarray"]:
+    """Ảnh RGB uint8 (H, W, 3) + padding -> canvas, mask, feathered_mask, preview."""
+    if fill not in FILL_MODES:
+        raise ValueError(f"fill must be one of {FILL_MODES}")
+    height, width = pixels.shape[:2]
+    pad_width = _pad_width(plan, channels=pixels.ndim == 3)
+    mask = make_mask(height, width, plan)
+    return {
+        "canvas": np.pad(pixels, pad_width, mode="constant", constant_values=OUTPAINT_CANVAS["canvas_value"]),
+        "mask": mask,
+        "feathered_mask": feathered_mask(height, width, plan),
+        "preview": np.pad(pixels, pad_width, mode=fill),
+    }
+
+
+# --- Lưu / phục vụ qua image_store ---
+
+def kind_for(tag: str, artifact: str) -> str:
+    return f"outpaint:{tag}:{artifact}"
+
+
+def url_for(sha256: str, tag: str, artifact: str) -> str:
+    return f"{URL_PREFIX}/{sha256}/outpaint/{tag}/{artifact}"
+
+
+def is_tag(value: str) -> bool:
+    return bool(_TAG_RE.match(value))
+
+
+def _plan_tag(plan: Dict[str, int], fill: str) -> str:
+    # "upright": artifact dựng trước khi xoay theo EXIF không được dùng lại
+    key = json.dumps({**plan, "fill": fill, "canvas_value": OUTPAINT_CANVAS["canvas_value"], "upright": True},
+                     sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def load_pixels(path: str) -> "np.ndarray":
+    # Canvas theo hướng người dùng thấy (EXIF Orientation), khớp ảnh gửi cho model
+    with Image.open(path) as img:
+        return np.asarray(ImageOps.exif_transpose(img).convert("RGB"))
+
+
+def _encode_png(array: "np.ndarray") -> bytes:
+    buffer = io.BytesIO()
+    # compress_level thấp: PNG lớn, encode mức mặc định chậm hơn cả bước dựng canvas
+    Image.fromarray(array).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def prepare(sha256: Optional[str], response: Union[str, Dict[str, Any], None],
+            fill: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Dựng (hoặc lấy từ cache) canvas + mask cho ảnh `sha256` trong image_store theo
+    expansion_settings trong `response`. Trả về {padding, width, height, fill, urls};
+    None nếu thiếu NumPy/Pillow, ảnh không có trong store hoặc response không có
+    expansion_settings hợp lệ. Đồng bộ, CPU-bound: gọi trong thread pool.
+    """
+    if np is None or Image is None or not sha256 or not response:
+        return None
+    fill = fill or OUTPAINT_CANVAS["fill"]
+    store = image_store.get_store()
+    record = store.get(sha256)
+    if record is None:
+        return None
+    try:
+        pixels = load_pixels(record["path"])
+        height, width = pixels.shape[:2]
+        plan = parse_expansion(response, width, height)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Bỏ qua canvas outpainting cho {sha256[:12]}: {e}")
+        return None
+
+    tag = _plan_tag(plan, fill)
+    if any(store.get_derivative_path(sha256, kind_for(tag, artifact)) is None for artifact in ARTIFACTS):
+        for artifact, array in generate(pixels, plan, fill).items():
+            store.put_derivative(sha256, kind_for(tag, artifact), _encode_png(array), "image/png")
+    return {
+        "padding": plan,
+        "width": width + plan["left"] + plan["right"],
+        "height": height + plan["top"] + plan["bottom"],
+        "fill": fill,
+        "urls": {artifact: url_for(sha256, tag, artifact) for artifact in ARTIFACTS},
+    }
+
+
+def resolve(sha256: str, tag: str, artifact: str) -> Optional[Dict[str, Any]]:
+    """{path, mime, etag} của artifact đã dựng (không dựng lại); None nếu không có."""
+    found = image_store.get_store().get_derivative_path(sha256, kind_for(tag, artifact))
+    if found is None:
+        return None
+    path, mime = found
+    return {"path": path, "mime": mime, "etag": f'"{sha256}-outpaint-{tag}-{artifact}"'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build outpainting canvas + masks from expansion_settings")
+    parser.add_argument("image", help="Ảnh nguồn")
+    parser.add_argument("settings", help="JSON expansion_settings / response của council, hoặc đường dẫn file JSON")
+    parser.add_argument("--fill", choices=FILL_MODES, default=OUTPAINT_CANVAS["fill"])
+    parser.add_argument("--output", "-o", default=".", help="Thư mục ghi <tên ảnh>_<artifact>.png")
+    args = parser.parse_args()
+
+    settings = args.settings
+    if os.path.isfile(settings):
+        with open(settings, "r", encoding="utf-8") as f:
+            settings = f.read()
+    pixels = load_pixels(args.image)
+    plan = parse_expansion(settings, pixels.shape[1], pixels.shape[0])
+    os.makedirs(args.output, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(args.image))[0]
+    for artifact, array in generate(pixels, plan, args.fill).items():
+        path = os.path.join(args.output, f"{stem}_{artifact}.png")
+        Image.fromarray(array).save(path)
+        print(f"✅ {path} {array.shape[1]}x{array.shape[0]}")
+    print(json.dumps(plan))
+
+
+if __name__ == "__main__":
+    main()
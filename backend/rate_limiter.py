@@ -0,0 +1,196 @@
+"""Rate limiter + concurrency governor theo (provider, API key).
+
+Mỗi API key có một token bucket (requests/phút + burst) và giới hạn số request
+in-flight. Các lần gọi xếp hàng FIFO thay vì cùng lao vào quota rồi cùng ngủ
+khi bị 429. Header Retry-After / x-ratelimit-* của provider được dùng để chặn
+cả bucket tới khi quota hồi lại.
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import httpx
+
+from .config import RATE_LIMITS
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse "1s", "6m0s", "20ms", "13.5s" hoặc số giây trần."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Thời gian chờ provider yêu cầu sau một 429, nếu có."""
+    retry_after = response.headers.get("retry-after")
+    if retry_after:
+        seconds = _parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    # Gemini không gửi Retry-After mà để RetryInfo.retryDelay trong body
+    try:
+        details = response.json().get("error", {}).get("details", [])
+    except (ValueError, json.JSONDecodeError, AttributeError):
+        return None
+    for detail in details:
+        delay = _parse_duration(detail.get("retryDelay")) if isinstance(detail, dict) else None
+        if delay is not None:
+            return delay
+    return None
+
+
+class LimiterStats:
+    def __init__(self):
+        self.acquired = 0
+        self.throttled = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.blocked_by_headers = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            **{k: round(v, 4) if isinstance(v, float) else v for k, v in vars(self).items()},
+            "queue_wait_avg": round(self.queue_wait_total / self.acquired, 4) if self.acquired else 0.0,
+        }
+
+
+class RateLimiter:
+    """Token bucket + semaphore in-flight cho một (provider, API key)."""
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int, max_in_flight: int):
+        self.name = name
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(burst)
+        self.max_in_flight = max_in_flight
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.stats = LimiterStats()
+        self._token_lock = asyncio.Lock()  # asyncio.Lock đánh thức theo thứ tự FIFO
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def _take_token(self):
+        async with self._token_lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Chờ tới lượt (token + slot in-flight) rồi giữ slot trong lúc gọi."""
+        start = time.monotonic()
+        await self._take_token()
+        await self._slots.acquire()
+        waited = time.monotonic() - start
+        self.stats.acquired += 1
+        self.stats.queue_wait_total += waited
+        self.stats.queue_wait_max = max(self.stats.queue_wait_max, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def _block_for(self, seconds: float):
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self._refill(now)
+        self.tokens = 0.0
+
+    def observe(self, headers: httpx.Headers):
+        """Đọc header x-ratelimit-* (OpenAI) để dừng trước khi bị 429."""
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return
+        if remaining <= 0:
+            reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self.stats.blocked_by_headers += 1
+                self._block_for(reset)
+
+    def on_throttled(self, retry_after: Optional[float], attempt: int) -> float:
+        """Ghi nhận 429; chặn cả bucket tới khi hết Retry-After (hoặc backoff)."""
+        self.stats.throttled += 1
+        wait = retry_after if retry_after is not None else (2 ** attempt) + random.uniform(0, 1)
+        self._block_for(wait)
+        return wait
+
+    def as_dict(self) -> Dict[str, Any]:
+        self._refill(time.monotonic())
+        return {
+            **self.stats.as_dict(),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "tokens": round(self.tokens, 2),
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def _limiter_name(config: Dict[str, Any]) -> str:
+    # Không đưa API key thật vào metrics, chỉ dùng hash ngắn
+    key_hash = hashlib.sha256((config.get("api_key") or "").encode("utf-8")).hexdigest()[:8]
+    return f"{config['provider']}:{key_hash}"
+
+
+def get_limiter(config: Dict[str, Any]) -> RateLimiter:
+    """Limiter dùng chung cho mọi model_id có cùng provider + API key."""
+    name = _limiter_name(config)
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limits = {**RATE_LIMITS.get(config["provider"], RATE_LIMITS["default"]), **config.get("rate_limit", {})}
+        limiter = RateLimiter(
+            name,
+            requests_per_minute=limits["requests_per_minute"],
+            burst=limits["burst"],
+            max_in_flight=limits["max_in_flight"],
+        )
+        _limiters[name] = limiter
+    return limiter
+
+
+def stats() -> Dict[str, Any]:
+    return {name: limiter.as_dict() for name, limiter in _limiters.items()}
@@ -0,0 +1,165 @@
+"""Two-tier cache cho kết quả LLM (memory LRU + TTL, disk tùy chọn).
+
+Key gồm model_id, tên model của provider, messages, temperature và hash nội
+dung ảnh, nên chạy lại cùng một bức tranh + cùng query sẽ trả về ngay mà không
+tốn quota của provider.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import LLM_CACHE
+
+# cache_mode cho từng lần gọi
+CACHE_USE = "use"          # đọc + ghi cache
+CACHE_REFRESH = "refresh"  # bỏ qua khi đọc, ghi đè kết quả mới
+CACHE_BYPASS = "bypass"    # không đọc, không ghi
+CACHE_MODES = (CACHE_USE, CACHE_REFRESH, CACHE_BYPASS)
+
+
+class CacheStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.refreshes = 0
+        self.bypasses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            **vars(self),
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl: float, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    # --- Memory tier ---
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            self.stats.expired += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    # --- Disk tier ---
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.stats.expired += 1
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def _disk_put(self, key: str, value: Dict[str, Any], expires_at: float):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi ra file tạm rồi rename để không bao giờ đọc phải entry ghi dở
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # --- Public API ---
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._memory_get(key)
+        if value is not None:
+            self.stats.memory_hits += 1
+            return {**value, "cache": "memory"}
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                expires_at, value = entry
+                self._memory_put(key, value, expires_at)
+                self.stats.disk_hits += 1
+                return {**value, "cache": "disk"}
+
+        self.stats.misses += 1
+        return None
+
+    async def put(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, value, expires_at)
+        self.stats.stores += 1
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._disk_put, key, value, expires_at)
+            except OSError as e:
+                print(f"⚠️ LLM cache: không ghi được disk tier: {e}")
+
+    def clear(self):
+        self._memory.clear()
+
+
+def make_key(
+    model_id: str, config: Dict[str, Any], messages: List[Dict[str, Any]],
+    temperature: float, image_hash: Optional[str] = None,
+    image_url: Optional[str] = None) -> str:
+    material = json.dumps({
+        "model_id": model_id,
+        "model": config["model"],
+        "messages": messages,
+        "temperature": temperature,
+        "image": image_hash,
+        "image_url": image_url if image_hash is None else None,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(response: Optional[Dict[str, Any]]) -> bool:
+    return bool(response) and bool(response.get("content")) and "error" not in response
+
+
+_cache = ResponseCache(
+    max_entries=LLM_CACHE["max_entries"],
+    ttl=LLM_CACHE["ttl"],
+    disk_dir=LLM_CACHE["disk_dir"],
+)
+
+
+def get_cache() -> ResponseCache:
+    return _cache
+
+
+def stats() -> Dict[str, Any]:
+    return {"enabled": LLM_CACHE["enabled"], **_cache.stats.as_dict(), "memory_entries": len(_cache._memory)}
@@ -0,0 +1,88 @@
+"""Quorum + deadline cho các stage của council.
+
+Thay vì `asyncio.gather` chờ mọi lời gọi (kể cả lời gọi đang retry 429), một
+stage được đi tiếp khi đã đủ `quorum` kết quả thành công hoặc khi hết
+`deadline` giây. Các lời gọi còn treo (straggler) bị huỷ để trả lại connection
+và quota.
+"""
+
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+_stats = {
+    "stages": 0,
+    "completed_all": 0,
+    "quorum_exits": 0,
+    "deadline_exits": 0,
+    "cancelled_calls": 0,
+}
+
+
+def _default_success(result: Any) -> bool:
+    return result is not None
+
+
+async def gather_with_quorum(
+    aws: List[Awaitable[Any]], quorum: Optional[int] = None,
+    deadline: Optional[float] = None,
+    is_success: Callable[[Any], bool] = _default_success) -> List[Optional[Any]]:
+    """
+    Chạy song song `aws`, trả về kết quả theo đúng thứ tự đầu vào.
+    Dừng sớm khi có `quorum` kết quả thành công hoặc khi hết `deadline` giây;
+    vị trí của lời gọi bị huỷ hoặc lỗi là None.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    _stats["stages"] += 1
+    if not tasks:
+        return []
+
+    started_at = time.monotonic()
+    pending = set(tasks)
+    successes = 0
+    exit_reason = "completed_all"
+    try:
+        while pending:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - (time.monotonic() - started_at)
+                if timeout <= 0:
+                    exit_reason = "deadline_exits"
+                    break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                exit_reason = "deadline_exits"
+                break
+            successes += sum(
+                1 for task in done
+                if not task.cancelled() and task.exception() is None and is_success(task.result())
+            )
+            if quorum is not None and successes >= quorum and pending:
+                exit_reason = "quorum_exits"
+                break
+    finally:
+        # Huỷ straggler (cũng chạy khi chính stage bị huỷ từ bên ngoài). Task
+        # trong `pending` có thể đã xong sẵn (ví dụ deadline đã hết trước lượt
+        # wait đầu): giữ kết quả của nó, không tính là bị huỷ.
+        stragglers = [task for task in pending if not task.done()]
+        for task in stragglers:
+            task.cancel()
+        if stragglers:
+            await asyncio.gather(*stragglers, return_exceptions=True)
+
+    _stats[exit_reason] += 1
+    _stats["cancelled_calls"] += len(stragglers)
+    if stragglers:
+        print(f"⏱️ Stage exit ({exit_reason}): {successes} ok, cancelled {len(stragglers)} straggler(s)")
+
+    results = []
+    for task in tasks:
+        if task.cancelled() or task.exception() is not None:
+            results.append(None)
+        else:
+            results.append(task.result())
+    return results
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_stats)
@@ -0,0 +1,246 @@
+"""Storage cho hội thoại.
+
+Giữ nguyên API dạng hàm như bản JSON cũ (`create_conversation`,
+`add_user_message`...); backend thực sự được chọn qua STORAGE_BACKEND
+("sqlite", "json" hoặc "jsonl"). Hội thoại đã được retention chuyển vào archive
+vẫn đọc được qua get_conversation (kèm "archived": True).
+"""
+
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+import atexit
+
+from ..config import (DATA_DIR, STORAGE_BACKEND, SQLITE_PATH, STORAGE_AUTO_MIGRATE, JSONL_LOG,
+                      STORAGE_CACHE, RETENTION)
+from .base import StorageBackend, build_user_message, build_assistant_message
+from . import council_blob
+from . import search_index
+from .json_backend import JsonStorage
+from .jsonl_backend import JsonLogStorage
+from .sqlite_backend import SQLiteStorage
+from .cached import CachedStorage
+from .archive import ConversationArchive
+
+_backend: Optional[StorageBackend] = None
+_archive: Optional[ConversationArchive] = None
+
+# Mức chi tiết khi đọc hội thoại: "compact" chỉ kèm council_summary,
+# "full" kèm council_response đầy đủ như trước
+DETAIL_COMPACT = "compact"
+DETAIL_FULL = "full"
+DETAIL_LEVELS = (DETAIL_COMPACT, DETAIL_FULL)
+
+
+def make_backend(name: str = STORAGE_BACKEND, location: Optional[str] = None) -> StorageBackend:
+    if name == "json":
+        return JsonStorage(location or DATA_DIR)
+    if name == "jsonl":
+        return JsonLogStorage(location or JSONL_LOG["dir"], fsync=JSONL_LOG["fsync"],
+                              compact_after=JSONL_LOG["compact_after"])
+    if name == "sqlite":
+        return SQLiteStorage(location or SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        backend = make_backend()
+        if isinstance(backend, SQLiteStorage) and STORAGE_AUTO_MIGRATE:
+            # Nâng cấp từ bản JSON: lịch sử cũ không được biến mất khỏi UI
+            from .migrate import auto_migrate
+            from .reindex import index_conversation
+            auto_migrate(backend, on_migrated=index_conversation)
+        if STORAGE_CACHE["enabled"]:
+            backend = CachedStorage(
+                backend, STORAGE_CACHE["max_bytes"],
+                flush_interval=STORAGE_CACHE["flush_interval"],
+                write_through=STORAGE_CACHE["write_through"],
+            )
+        _backend = backend
+    return _backend
+
+
+def set_backend(backend: Optional[StorageBackend]):
+    """Đổi backend đang dùng (script/test); None để tạo lại theo config."""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+
+
+def get_archive() -> ConversationArchive:
+    global _archive
+    if _archive is None:
+        _archive = ConversationArchive(RETENTION["archive_dir"])
+    return _archive
+
+
+def iter_unmigrated_legacy() -> Iterator[Dict[str, Any]]:
+    """
+    Hội thoại JSON cũ trong DATA_DIR chưa có trong backend hiện tại (chưa
+    migrate). Ảnh chúng tham chiếu vẫn phải được giữ khi dọn/chuyển ảnh.
+    """
+    if STORAGE_BACKEND == "json":
+        return
+    backend = get_backend()
+    for conversation in JsonStorage(DATA_DIR).iter_conversations():
+        conversation_id = conversation.get("id")
+        if conversation_id and backend.get_conversation(conversation_id) is None:
+            yield conversation
+
+
+def stats() -> Dict[str, Any]:
+    backend = get_backend()
+    return {"backend": backend.name, **backend.stats(), "archive": get_archive().stats()}
+
+
+@atexit.register
+def _close_on_exit():
+    # Script dùng API đồng bộ không đi qua lifespan: vẫn flush cache khi thoát
+    if _backend is not None:
+        _backend.close()
+    search_index.close()
+
+
+def create_conversation(conversation_id: str) -> Dict[str, Any]:
+    conversation = get_backend().create_conversation(conversation_id)
+    search_index.index_title(conversation_id, conversation["title"])
+    return conversation
+
+def _load_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    conversation = get_backend().get_conversation(conversation_id)
+    if conversation is None:
+        conversation = get_archive().get_conversation(conversation_id)
+        if conversation is not None:
+            conversation["archived"] = True
+    return conversation
+
+def get_conversation(conversation_id: str, detail: str = DETAIL_COMPACT) -> Optional[Dict[str, Any]]:
+    conversation = _load_conversation(conversation_id)
+    if conversation is None:
+        return None
+    convert = hydrate_message if detail == DETAIL_FULL else compact_message
+    conversation["messages"] = [convert(message) for message in conversation["messages"]]
+    return conversation
+
+def get_council_result(conversation_id: str, message_index: int) -> Optional[Dict[str, Any]]:
+    """Kết quả council đầy đủ của một message; None nếu không có."""
+    conversation = _load_conversation(conversation_id)
+    if conversation is None or not 0 <= message_index < len(conversation["messages"]):
+        return None
+    return hydrate_message(conversation["messages"][message_index]).get("council_response")
+
+def save_conversation(conversation: Dict[str, Any]):
+    get_backend().save_conversation(conversation)
+
+def restore_conversation(conversation_id: str) -> bool:
+    """Đưa hội thoại từ archive về backend để ghi tiếp; False nếu không có trong archive."""
+    archive = get_archive()
+    conversation = archive.get_conversation(conversation_id)
+    if conversation is None:
+        return False
+    backend = get_backend()
+    # Archive lưu council inline: đưa lại vào blob store của backend
+    conversation["messages"] = [pack_message(backend, m) for m in conversation["messages"]]
+    backend.save_conversation(conversation)
+    archive.remove(conversation_id)
+    return True
+
+def list_conversations() -> List[Dict[str, Any]]:
+    return get_backend().list_conversations()
+
+def list_conversations_page(
+    limit: Optional[int] = None, cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Một trang metadata (mới nhất trước) + cursor của trang kế tiếp (None nếu hết)."""
+    return get_backend().list_page(limit, cursor)
+
+def add_user_message(
+    conversation_id: str,
+    content: str,
+    image_url: Optional[str] = None,
+    local_image_path: Optional[str] = None
+):
+    """
+    Lưu tin nhắn User kèm Cloudinary URL và đường dẫn file Local.
+    """
+    message = build_user_message(content, image_url, local_image_path)
+    get_backend().append_message(conversation_id, message)
+    search_index.index_user_message(conversation_id, message)
+
+def add_assistant_message(
+    conversation_id: str,
+    council_result: Dict[str, Any],
+    task_type: str = "outpainting"
+):
+    """
+    Lưu kết quả trả về từ Assistant (AI).
+    """
+    backend = get_backend()
+    message = prepare_assistant_message(backend, council_result, task_type)
+    backend.append_message(conversation_id, message)
+    search_index.index_assistant_message(conversation_id, message, council_result)
+
+def update_conversation_title(conversation_id: str, title: str):
+    get_backend().update_conversation_title(conversation_id, title)
+    search_index.index_title(conversation_id, title)
+
+def set_message_image_url(conversation_id: str, local_image_path: str, image_url: str):
+    """Gắn URL ảnh (publish nền xong) vào các message trỏ tới local_image_path."""
+    get_backend().set_message_image_url(conversation_id, local_image_path, image_url)
+
+
+# --- Kết quả council: lưu dạng blob nén, message chỉ giữ ref + tóm tắt ---
+
+def prepare_assistant_message(
+    backend: StorageBackend, council_result: Dict[str, Any], task_type: str
+) -> Dict[str, Any]:
+    """Dựng assistant message và lưu blob council (nén + khử trùng lặp) trước."""
+    return pack_message(backend, build_assistant_message(council_result, task_type))
+
+def pack_message(backend: StorageBackend, message: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển council_response inline thành blob + council_ref/council_summary."""
+    if "council_response" not in message:
+        return message
+    message = dict(message)
+    council_response = message.pop("council_response")
+    ref, blob = council_blob.pack(council_response)
+    backend.put_council_blob(ref, blob)
+    message["council_ref"] = ref
+    message["council_summary"] = council_blob.summarize(council_response)
+    return message
+
+def compact_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Message lưu kiểu cũ (council_response inline) được rút gọn như message mới."""
+    if "council_response" not in message:
+        return message
+    message = dict(message)
+    message["council_summary"] = council_blob.summarize(message.pop("council_response"))
+    return message
+
+def inline_conversation(conversation: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bản hội thoại tự đủ dữ liệu (archive): council_ref được thay bằng
+    council_response inline, không còn phụ thuộc blob store của backend.
+    """
+    messages = []
+    for message in conversation.get("messages", []):
+        message = hydrate_message(message)
+        if "council_response" in message:
+            message.pop("council_ref", None)
+        messages.append(message)
+    return {**conversation, "messages": messages}
+
+def hydrate_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Nạp lại council_response đầy đủ từ blob."""
+    ref = message.get("council_ref")
+    if ref is None:
+        return message
+    blob = get_backend().get_council_blob(ref)
+    if blob is None:
+        print(f"⚠️ Thiếu council blob {ref}")
+        return message
+    message = dict(message)
+    message["council_response"] = council_blob.unpack(blob)
+    return message
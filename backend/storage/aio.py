@@ -0,0 +1,179 @@
+"""Async API cho storage, dùng trong các endpoint FastAPI.
+
+Mọi thao tác I/O + encode/decode JSON chạy trên một thread pool giới hạn
+(STORAGE_IO["workers"]) thay vì chặn event loop. Các thao tác ghi vào cùng một
+hội thoại được xếp hàng và gộp thành batch: những thao tác tới trong lúc batch
+trước đang ghi sẽ được ghi chung ở lần sau (JSON backend: một lần đọc + một
+lần ghi file cho cả batch). Thứ tự ghi trong một hội thoại được giữ nguyên.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..config import STORAGE_IO
+from . import (get_backend, build_user_message, prepare_assistant_message,
+               create_conversation as _create_conversation,
+               restore_conversation as _restore_conversation,
+               get_conversation as _get_conversation, get_council_result as _get_council_result,
+               DETAIL_COMPACT)
+from . import search_index
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+_stats = {
+    "reads": 0,
+    "write_ops": 0,
+    "write_batches": 0,
+    "max_batch": 0,
+    "queued_ops": 0,
+}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=STORAGE_IO["workers"], thread_name_prefix="storage")
+    return _executor
+
+
+async def _run(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fn, *args))
+
+
+class _WriteBatcher:
+    """Hàng đợi ghi theo từng hội thoại; mỗi hội thoại có tối đa một batch đang ghi."""
+
+    def __init__(self):
+        self.pending: Dict[str, List[Tuple[Tuple[str, Any], asyncio.Future]]] = {}
+        self.running: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, conversation_id: str, op: Tuple[str, Any]):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(conversation_id, []).append((op, future))
+        _stats["queued_ops"] += 1
+        if conversation_id not in self.running:
+            self.running.add(conversation_id)
+            task = asyncio.create_task(self._drain(conversation_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        # shield: caller bị huỷ (client ngắt SSE) thì thao tác ghi vẫn hoàn tất
+        return await asyncio.shield(future)
+
+    async def _drain(self, conversation_id: str):
+        try:
+            while self.pending.get(conversation_id):
+                batch = self.pending.pop(conversation_id)
+                _stats["queued_ops"] -= len(batch)
+                _stats["write_ops"] += len(batch)
+                _stats["write_batches"] += 1
+                _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+                try:
+                    await _run(get_backend().apply_batch, conversation_id, [op for op, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self.running.discard(conversation_id)
+
+    async def flush(self):
+        """Chờ mọi thao tác ghi đang xếp hàng hoàn tất."""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+
+_batcher = _WriteBatcher()
+
+
+# --- Đọc ---
+
+async def create_conversation(conversation_id: str) -> Dict[str, Any]:
+    _stats["reads"] += 1
+    return await _run(_create_conversation, conversation_id)
+
+async def get_conversation(conversation_id: str, detail: str = DETAIL_COMPACT) -> Optional[Dict[str, Any]]:
+    _stats["reads"] += 1
+    return await _run(_get_conversation, conversation_id, detail)
+
+async def get_council_result(conversation_id: str, message_index: int) -> Optional[Dict[str, Any]]:
+    _stats["reads"] += 1
+    return await _run(_get_council_result, conversation_id, message_index)
+
+async def list_conversations_page(
+    limit: Optional[int] = None, cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    _stats["reads"] += 1
+    return await _run(get_backend().list_page, limit, cursor)
+
+
+# --- Ghi (batch theo hội thoại) ---
+
+async def restore_conversation(conversation_id: str) -> bool:
+    return await _run(_restore_conversation, conversation_id)
+
+async def add_user_message(
+    conversation_id: str,
+    content: str,
+    image_url: Optional[str] = None,
+    local_image_path: Optional[str] = None
+):
+    message = build_user_message(content, image_url, local_image_path)
+    await _batcher.submit(conversation_id, ("message", message))
+    await _run(search_index.index_user_message, conversation_id, message)
+
+async def add_assistant_message(
+    conversation_id: str,
+    council_result: Dict[str, Any],
+    task_type: str = "outpainting"
+):
+    # Nén + lưu blob council trong thread pool, message (nhỏ) đi qua batch như thường
+    backend = get_backend()
+    message = await _run(prepare_assistant_message, backend, council_result, task_type)
+    await _batcher.submit(conversation_id, ("message", message))
+    await _run(search_index.index_assistant_message, conversation_id, message, council_result)
+
+async def update_conversation_title(conversation_id: str, title: str):
+    await _batcher.submit(conversation_id, ("title", title))
+    await _run(search_index.index_title, conversation_id, title)
+
+async def set_message_image_url(conversation_id: str, local_image_path: str, image_url: str):
+    await _batcher.submit(conversation_id, ("image_url", (local_image_path, image_url)))
+
+
+async def search(
+    text: str, limit: int = 20, cursor: Optional[str] = None, kind: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    index = search_index.get_index()
+    if index is None:
+        return [], None
+    _stats["reads"] += 1
+    return await _run(index.search, text, limit, cursor, kind)
+
+
+async def import_lines(importer, lines: List[str]):
+    """Đưa một nhóm dòng NDJSON vào `export.Importer` trên thread pool."""
+    def feed():
+        for line in lines:
+            importer.feed(line)
+    await _run(feed)
+
+
+async def shutdown():
+    """Ghi nốt các batch còn trong hàng đợi rồi đóng thread pool."""
+    global _executor
+    await _batcher.flush()
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def stats() -> Dict[str, Any]:
+    return {**_stats, "workers": STORAGE_IO["workers"]}
@@ -0,0 +1,174 @@
+"""Kho lưu trữ (archive) cho hội thoại cũ, dạng segment zip nén.
+
+Mỗi lần chạy retention ghi các hội thoại hết hạn vào một segment mới
+(`segment-<thời điểm>.zip`, mỗi hội thoại một entry `<id>.json` nén deflate),
+rồi mới xoá khỏi backend đang dùng. Manifest (`_manifest.jsonl`, cùng định
+dạng MetadataIndex) ánh xạ id -> segment, nên đọc một hội thoại đã lưu trữ chỉ
+mở đúng một entry trong một file zip. Segment chỉ được ghi một lần, không sửa.
+
+Kết quả council được ghi inline (council_response) vào segment thay vì giữ
+council_ref trỏ vào blob store của backend: archive tự đủ dữ liệu, blob được
+giải phóng khi hội thoại bị xoá khỏi backend, và đổi backend không làm mất
+kết quả của hội thoại đã lưu trữ.
+"""
+
+import json
+import os
+import threading
+import zipfile
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .base import atomic_open, now_iso
+from .meta_index import MetadataIndex, META_FIELDS, conversation_meta
+
+MANIFEST_FILENAME = "_manifest.jsonl"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".zip"
+ARCHIVE_FIELDS = META_FIELDS + ("segment", "archived_at", "images", "council_refs")
+
+
+def image_paths(conversation: Dict[str, Any]) -> List[str]:
+    """Các ảnh local mà hội thoại tham chiếu (để GC ảnh không cần mở segment)."""
+    return [m["local_image_path"] for m in conversation.get("messages", []) if m.get("local_image_path")]
+
+
+def council_refs(conversation: Dict[str, Any]) -> List[str]:
+    """council_ref của các message chưa có council_response inline."""
+    return [m["council_ref"] for m in conversation.get("messages", [])
+            if m.get("council_ref") and "council_response" not in m]
+
+
+def _archive_meta(conversation: Dict[str, Any], segment: str, archived_at: Optional[str]) -> Dict[str, Any]:
+    return {**conversation_meta(conversation), "segment": segment, "archived_at": archived_at,
+            "images": image_paths(conversation), "council_refs": council_refs(conversation)}
+
+
+class ConversationArchive:
+    def __init__(self, archive_dir: str, compress_level: int = 9):
+        self.archive_dir = archive_dir
+        self.compress_level = compress_level
+        self._manifest: Optional[MetadataIndex] = None
+        self._lock = threading.Lock()
+
+    @property
+    def manifest(self) -> MetadataIndex:
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    os.makedirs(self.archive_dir, exist_ok=True)
+                    manifest = MetadataIndex(os.path.join(self.archive_dir, MANIFEST_FILENAME), ARCHIVE_FIELDS)
+                    manifest.load(self._scan_segments)
+                    self._manifest = manifest
+        return self._manifest
+
+    def _segment_names(self) -> List[str]:
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.archive_dir)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _scan_segments(self) -> Iterator[Dict[str, Any]]:
+        """Dựng lại manifest từ các segment (khi file manifest bị mất)."""
+        for segment in self._segment_names():
+            for conversation in self._read_segment(segment):
+                yield _archive_meta(conversation, segment, None)
+
+    def _read_segment(self, segment: str) -> Iterator[Dict[str, Any]]:
+        with zipfile.ZipFile(os.path.join(self.archive_dir, segment)) as zf:
+            for name in zf.namelist():
+                yield json.loads(zf.read(name))
+
+    def write_segment(self, conversations: Iterable[Dict[str, Any]]) -> Optional[str]:
+        """
+        Ghi một segment mới (file tạm + rename) và trả về tên của nó; None nếu
+        không có hội thoại nào. Manifest chưa được cập nhật: gọi `register`
+        sau khi chắc chắn đã xoá khỏi backend.
+        """
+        conversations = list(conversations)
+        if not conversations:
+            return None
+        os.makedirs(self.archive_dir, exist_ok=True)
+        segment = f"{SEGMENT_PREFIX}{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}{SEGMENT_SUFFIX}"
+        with atomic_open(os.path.join(self.archive_dir, segment)) as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED, compresslevel=self.compress_level) as zf:
+                for conversation in conversations:
+                    data = json.dumps(conversation, ensure_ascii=False, separators=(",", ":"))
+                    zf.writestr(f"{conversation['id']}.json", data)
+        return segment
+
+    def register(self, conversation: Dict[str, Any], segment: str):
+        self.manifest.upsert(_archive_meta(conversation, segment, now_iso()))
+
+    def remove(self, conversation_id: str):
+        """Bỏ khỏi manifest (hội thoại được khôi phục); dữ liệu cũ trong segment bị bỏ qua."""
+        self.manifest.remove(conversation_id)
+
+    def contains(self, conversation_id: str) -> bool:
+        return self.manifest.get(conversation_id) is not None
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        meta = self.manifest.get(conversation_id)
+        if meta is None:
+            return None
+        try:
+            with zipfile.ZipFile(os.path.join(self.archive_dir, meta["segment"])) as zf:
+                return json.loads(zf.read(f"{conversation_id}.json"))
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"⚠️ Không đọc được hội thoại lưu trữ {conversation_id}: {e}")
+            return None
+
+    def inline_council_results(
+        self, inline: Callable[[Dict[str, Any]], Dict[str, Any]], batch_size: int = 500
+    ) -> int:
+        """
+        Segment ghi trước khi archive lưu council inline còn council_ref trỏ vào
+        blob store của backend: ghi lại các hội thoại đó (đã qua `inline`) vào
+        segment mới. Mỗi hội thoại chỉ được thử một lần (manifest ghi
+        council_refs = []). Trả về số hội thoại đã ghi lại.
+        """
+        manifest = self.manifest
+        pending = [cid for cid, meta in list(manifest.entries.items()) if meta.get("council_refs") != []]
+        rewritten = 0
+        for start in range(0, len(pending), batch_size):
+            batch = []
+            for conversation_id in pending[start:start + batch_size]:
+                meta = manifest.get(conversation_id)
+                conversation = self.get_conversation(conversation_id) if meta else None
+                if conversation is None:
+                    continue
+                if council_refs(conversation):
+                    batch.append((inline(conversation), meta["archived_at"]))
+                else:
+                    manifest.upsert(_archive_meta(conversation, meta["segment"], meta["archived_at"]))
+            segment = self.write_segment(conversation for conversation, _ in batch)
+            for conversation, archived_at in batch:
+                manifest.upsert({**_archive_meta(conversation, segment, archived_at), "council_refs": []})
+                rewritten += 1
+        return rewritten
+
+    def image_paths(self) -> Iterator[str]:
+        for meta in list(self.manifest.entries.values()):
+            yield from meta.get("images") or []
+
+    def iter_conversations(self) -> Iterator[Dict[str, Any]]:
+        """Mọi hội thoại còn trong manifest, đọc lần lượt từng segment."""
+        manifest = self.manifest
+        for segment in self._segment_names():
+            for conversation in self._read_segment(segment):
+                meta = manifest.get(conversation["id"])
+                if meta is not None and meta["segment"] == segment:
+                    yield conversation
+
+    def list_page(self, limit: Optional[int] = None, cursor: Optional[str] = None):
+        return self.manifest.page(limit, cursor)
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self._segment_names()
+        return {
+            "conversations": len(self.manifest),
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(os.path.join(self.archive_dir, name)) for name in segments),
+        }
@@ -0,0 +1,228 @@
+"""Interface chung cho các storage backend + các hàm dựng message dùng chung."""
+
+import base64
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+
+def now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def encode_cursor(created_at: str, conversation_id: str) -> str:
+    """Cursor phân trang: vị trí (created_at, id) của phần tử cuối trang trước."""
+    raw = f"{created_at}|{conversation_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """ValueError nếu cursor không hợp lệ."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, conversation_id = raw.split("|", 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return created_at, conversation_id
+
+
+@contextmanager
+def atomic_open(path: str, fsync: bool = True):
+    """
+    Mở file tạm cạnh `path` để ghi; khi xong thì os.replace sang `path`.
+    Crash giữa chừng chỉ để lại file tạm, file cũ vẫn nguyên vẹn.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def iter_pages(list_page, page_size: int = 500):
+    """Duyệt metadata qua từng trang keyset của `list_page(limit, cursor)`."""
+    cursor = None
+    while True:
+        items, cursor = list_page(page_size, cursor)
+        yield from items
+        if cursor is None:
+            return
+
+
+class KeyedLocks:
+    """Một RLock cho mỗi khóa (conversation_id); lock được dọn khi không ai giữ."""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks: Dict[str, List[Any]] = {}  # key -> [RLock, số thread đang dùng]
+
+    @contextmanager
+    def hold(self, key: str):
+        with self._mutex:
+            entry = self._locks.setdefault(key, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._mutex:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+
+def build_user_message(
+    content: str,
+    image_url: Optional[str] = None,
+    local_image_path: Optional[str] = None
+) -> Dict[str, Any]:
+    message = {
+        "role": "user",
+        "content": content,
+        "timestamp": now_iso()
+    }
+    if image_url:
+        message["image_url"] = image_url
+    if local_image_path:
+        message["local_image_path"] = local_image_path
+    return message
+
+
+def build_assistant_message(council_result: Dict[str, Any], task_type: str) -> Dict[str, Any]:
+    # Lấy nội dung text hiển thị (fallback nếu UI chỉ hiển thị text đơn giản)
+    display_content = "Task completed."
+    if task_type == "chat":
+        display_content = council_result.get("final_result", {}).get("selected_response", "")
+    elif task_type == "outpainting":
+        final = council_result.get("final_result", {})
+        if final:
+            display_content = "Outpainting Prompt Generated Successfully."
+
+    return {
+        "role": "assistant",
+        "content": display_content,
+        "task_type": task_type,
+        "timestamp": now_iso(),
+        "council_response": council_result
+    }
+
+
+def set_image_url(messages: List[Dict[str, Any]], local_image_path: str, image_url: str) -> bool:
+    """
+    Gắn image_url cho các message trỏ tới `local_image_path` mà chưa có URL
+    (ảnh được publish nền sau khi message đã lưu). Thay dict mới, không sửa tại chỗ.
+    """
+    changed = False
+    for index, message in enumerate(messages):
+        if message.get("local_image_path") == local_image_path and not message.get("image_url"):
+            messages[index] = {**message, "image_url": image_url}
+            changed = True
+    return changed
+
+
+class StorageBackend:
+    """Các thao tác mà mọi backend phải hỗ trợ (xem backend/storage/__init__.py)."""
+
+    name = "base"
+
+    def create_conversation(self, conversation_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_conversation(self, conversation: Dict[str, Any]):
+        """Ghi đè toàn bộ hội thoại (dùng cho migrate/import)."""
+        raise NotImplementedError
+
+    def list_conversations(self) -> List[Dict[str, Any]]:
+        return self.list_page()[0]
+
+    def list_page(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Metadata hội thoại (id, created_at, title, message_count, cover_image) mới nhất trước,
+        bắt đầu sau `cursor`. Trả về (trang, cursor của trang kế tiếp hoặc None).
+        """
+        raise NotImplementedError
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]):
+        """Thêm một message; ValueError nếu hội thoại không tồn tại."""
+        raise NotImplementedError
+
+    def update_conversation_title(self, conversation_id: str, title: str):
+        raise NotImplementedError
+
+    def set_message_image_url(self, conversation_id: str, local_image_path: str, image_url: str):
+        """Gắn URL ảnh đã publish vào message (xem set_image_url); mặc định đọc-sửa-ghi cả hội thoại."""
+        conversation = self.get_conversation(conversation_id)
+        if conversation is not None and set_image_url(conversation["messages"], local_image_path, image_url):
+            self.save_conversation(conversation)
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """Xoá hội thoại (dùng khi lưu trữ/archive); False nếu không tồn tại."""
+        raise NotImplementedError
+
+    def put_council_blob(self, ref: str, data: bytes):
+        """
+        Lưu blob kết quả council (content-addressed, ghi lại cùng ref chỉ cập
+        nhật thời điểm ghi để GC không xoá blob vừa được dùng lại).
+        """
+        raise NotImplementedError
+
+    def get_council_blob(self, ref: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def gc_council_blobs(self, touched_before: Optional[float] = None,
+                         dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Xoá blob không còn message nào trỏ tới và không được ghi lại từ
+        `touched_before` (epoch; mặc định now - COUNCIL_BLOBS["gc_grace_seconds"]).
+        """
+        return {"deleted": 0, "bytes_reclaimed": 0}
+
+    def apply_batch(self, conversation_id: str, ops: List[Tuple[str, Any]]):
+        """
+        Áp dụng lần lượt các thao tác ghi ("message", dict) / ("title", str) /
+        ("image_url", (local_image_path, url)) của một hội thoại. Backend phải đọc-sửa-ghi cả hội thoại có thể override để
+        chỉ ghi một lần cho cả batch.
+        """
+        for kind, value in ops:
+            if kind == "message":
+                self.append_message(conversation_id, value)
+            elif kind == "title":
+                self.update_conversation_title(conversation_id, value)
+            elif kind == "image_url":
+                self.set_message_image_url(conversation_id, *value)
+            else:
+                raise ValueError(f"Unknown storage op: {kind}")
+
+    def iter_conversations(self):
+        """Duyệt lần lượt từng hội thoại đầy đủ (không nạp tất cả vào RAM)."""
+        for meta in iter_pages(self.list_page):
+            conversation = self.get_conversation(meta["id"])
+            if conversation is not None:
+                yield conversation
+
+    def compact_storage(self):
+        """Thu hồi dung lượng sau khi xoá nhiều hội thoại (VACUUM, gộp index...)."""
+
+    def disk_bytes(self) -> Optional[int]:
+        """Tổng dung lượng trên đĩa của backend; None nếu không đo được."""
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self):
+        pass
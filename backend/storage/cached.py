@@ -0,0 +1,275 @@
+"""Write-behind cache cho các hội thoại đang hoạt động.
+
+Bọc một backend bất kỳ. Hội thoại vừa dùng được giữ trong RAM (LRU, giới hạn
+theo số byte ước lượng), nên các lần đọc trong một lượt chạy council (kiểm
+tra hội thoại, thêm message, đổi title...) không chạm đĩa. Thao tác ghi được
+áp dụng vào bản trong RAM và xếp hàng (dirty); một thread nền flush xuống
+backend thật mỗi `flush_interval` giây, khi entry bị evict và khi đóng
+storage. `write_through=True` ghi xuống backend ngay (cache chỉ dùng để đọc).
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import StorageBackend, KeyedLocks, set_image_url
+from .meta_index import cover_image
+
+
+def _estimate_size(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+
+class _Entry:
+    __slots__ = ("conversation", "size", "pending")
+
+    def __init__(self, conversation: Dict[str, Any], size: int):
+        self.conversation = conversation
+        self.size = size
+        self.pending: List[Tuple[str, Any]] = []  # Thao tác chưa ghi xuống backend thật
+
+
+class CachedStorage(StorageBackend):
+    def __init__(self, inner: StorageBackend, max_bytes: int,
+                 flush_interval: float = 1.0, write_through: bool = False):
+        self.inner = inner
+        self.name = f"cached:{inner.name}"
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.write_through = write_through
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._flush_locks = KeyedLocks()  # Giữ thứ tự flush trong một hội thoại
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.stats_counters = {"hits": 0, "misses": 0, "evictions": 0, "flushes": 0,
+                               "flushed_ops": 0, "flush_errors": 0}
+
+    # --- Cache ---
+
+    def _load(self, conversation_id: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+                self.stats_counters["hits"] += 1
+                return entry
+            self.stats_counters["misses"] += 1
+
+        # Giữ flush lock khi đọc đĩa: không nạp lại bản cũ trong lúc
+        # save/delete_conversation đang ghi thẳng xuống backend
+        with self._flush_locks.hold(conversation_id):
+            conversation = self.inner.get_conversation(conversation_id)
+            if conversation is None:
+                return None
+            with self._lock:
+                # Thread khác có thể đã nạp trong lúc ta đọc đĩa
+                entry = self._entries.get(conversation_id)
+                if entry is None:
+                    entry = _Entry(conversation, _estimate_size(conversation))
+                    self._entries[conversation_id] = entry
+                    self._bytes += entry.size
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._bytes <= self.max_bytes or len(self._entries) <= 1:
+                    return
+                conversation_id = next(iter(self._entries))
+            # Entry còn dirty phải được ghi xuống trước khi bỏ khỏi RAM
+            self._flush_one(conversation_id)
+            with self._lock:
+                entry = self._entries.get(conversation_id)
+                if entry is not None and entry.pending:
+                    return  # Flush lỗi: giữ lại, thử evict ở lần sau
+                if entry is not None:
+                    del self._entries[conversation_id]
+                    self._bytes -= entry.size
+                    self.stats_counters["evictions"] += 1
+
+    def _flush_one(self, conversation_id: str):
+        with self._flush_locks.hold(conversation_id):
+            with self._lock:
+                entry = self._entries.get(conversation_id)
+                if entry is None or not entry.pending:
+                    return
+                ops, entry.pending = entry.pending, []
+            try:
+                self.inner.apply_batch(conversation_id, ops)
+            except Exception as e:
+                print(f"⚠️ Flush hội thoại {conversation_id} thất bại: {e}")
+                with self._lock:
+                    entry.pending[:0] = ops  # Giữ lại để thử ở lần flush sau
+                    self.stats_counters["flush_errors"] += 1
+                return
+            with self._lock:
+                self.stats_counters["flushes"] += 1
+                self.stats_counters["flushed_ops"] += len(ops)
+
+    def flush(self):
+        """Ghi mọi thao tác đang chờ xuống backend thật."""
+        with self._lock:
+            dirty = [cid for cid, entry in self._entries.items() if entry.pending]
+        for conversation_id in dirty:
+            self._flush_one(conversation_id)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="storage-flush", daemon=True)
+            self._flusher.start()
+
+    # --- StorageBackend ---
+
+    def create_conversation(self, conversation_id: str) -> Dict[str, Any]:
+        # Tạo mới luôn ghi thẳng để hội thoại xuất hiện ngay trong danh sách
+        conversation = self.inner.create_conversation(conversation_id)
+        with self._lock:
+            entry = _Entry({**conversation, "messages": list(conversation["messages"])},
+                           _estimate_size(conversation))
+            self._entries[conversation_id] = entry
+            self._bytes += entry.size
+        self._evict()
+        return conversation
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._load(conversation_id)
+        if entry is None:
+            return None
+        with self._lock:
+            conversation = entry.conversation
+            return {**conversation, "messages": list(conversation["messages"])}
+
+    def save_conversation(self, conversation: Dict[str, Any]):
+        conversation_id = conversation["id"]
+        # Giữ flush lock cả chuỗi flush -> ghi -> bỏ entry: apply_batch chen vào
+        # giữa chừng sẽ chờ rồi áp dụng lên bản mới, không bị pop mất
+        with self._flush_locks.hold(conversation_id):
+            self._flush_one(conversation_id)
+            self.inner.save_conversation(conversation)
+            self._drop(conversation_id)
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        with self._flush_locks.hold(conversation_id):
+            self._flush_one(conversation_id)
+            self._drop(conversation_id)
+            return self.inner.delete_conversation(conversation_id)
+
+    def _drop(self, conversation_id: str):
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def apply_batch(self, conversation_id: str, ops: List[Tuple[str, Any]]):
+        while True:
+            entry = self._load(conversation_id)
+            if entry is None:
+                if any(kind == "message" for kind, _ in ops):
+                    raise ValueError(f"Conversation {conversation_id} not found")
+                return
+            # Flush lock: không áp dụng vào entry mà save/delete_conversation sắp bỏ
+            with self._flush_locks.hold(conversation_id), self._lock:
+                # Entry có thể vừa bị evict/bỏ giữa lúc nạp và lúc ghi: nạp lại
+                if self._entries.get(conversation_id) is entry:
+                    self._apply_locked(entry, ops)
+                    break
+
+        if self.write_through:
+            self._flush_one(conversation_id)
+        else:
+            self._ensure_flusher()
+        self._evict()
+
+    def _apply_locked(self, entry: _Entry, ops: List[Tuple[str, Any]]):
+        conversation = entry.conversation
+        for kind, value in ops:
+            if kind == "message":
+                conversation["messages"].append(value)
+                added = _estimate_size(value)
+            elif kind == "title":
+                conversation["title"] = value
+                added = len(value)
+            elif kind == "image_url":
+                set_image_url(conversation["messages"], *value)
+                added = len(value[1])
+            else:
+                raise ValueError(f"Unknown storage op: {kind}")
+            entry.size += added
+            self._bytes += added
+        entry.pending.extend(ops)
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]):
+        self.apply_batch(conversation_id, [("message", message)])
+
+    def update_conversation_title(self, conversation_id: str, title: str):
+        self.apply_batch(conversation_id, [("title", title)])
+
+    def set_message_image_url(self, conversation_id: str, local_image_path: str, image_url: str):
+        self.apply_batch(conversation_id, [("image_url", (local_image_path, image_url))])
+
+    def list_page(self, limit: Optional[int] = None, cursor: Optional[str] = None):
+        items, next_cursor = self.inner.list_page(limit, cursor)
+        # Metadata của hội thoại chưa flush lấy từ bản trong RAM
+        with self._lock:
+            for item in items:
+                entry = self._entries.get(item["id"])
+                if entry is not None and entry.pending:
+                    item["title"] = entry.conversation["title"]
+                    item["message_count"] = len(entry.conversation["messages"])
+                    item["cover_image"] = cover_image(entry.conversation["messages"])
+        return items, next_cursor
+
+    def iter_conversations(self):
+        self.flush()
+        return self.inner.iter_conversations()
+
+    def put_council_blob(self, ref: str, data: bytes):
+        self.inner.put_council_blob(ref, data)
+
+    def get_council_blob(self, ref: str) -> Optional[bytes]:
+        return self.inner.get_council_blob(ref)
+
+    def gc_council_blobs(self, touched_before: Optional[float] = None,
+                         dry_run: bool = False) -> Dict[str, Any]:
+        # Message đang chờ flush cũng phải được tính là tham chiếu
+        self.flush()
+        return self.inner.gc_council_blobs(touched_before, dry_run)
+
+    def compact_storage(self):
+        self.flush()
+        self.inner.compact_storage()
+
+    def disk_bytes(self) -> Optional[int]:
+        return self.inner.disk_bytes()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 5)
+            self._flusher = None
+        self.flush()
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self.inner.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats_counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "dirty": sum(1 for entry in self._entries.values() if entry.pending),
+                "pending_ops": sum(len(entry.pending) for entry in self._entries.values()),
+                "write_through": self.write_through,
+            }
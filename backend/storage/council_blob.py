@@ -0,0 +1,81 @@
+"""Nén + khử trùng lặp kết quả council (stage1_results, stage2_results, final_result).
+
+Một kết quả council lặp lại rất nhiều text: mỗi bản refine Stage 2 chứa lại
+`original_response` của Stage 1, final_result chứa lại bản được chọn... Khi
+pack, mọi chuỗi dài được đưa vào một bảng chuỗi (mỗi chuỗi lưu một lần, chỗ
+dùng thay bằng {"$str": i}), sau đó cả khối được nén zlib. Blob được đánh địa
+chỉ theo sha256 nội dung nên hai kết quả giống hệt nhau (cache hit) chỉ lưu
+một lần.
+
+Message trong hội thoại chỉ giữ `council_ref` + `council_summary` nhỏ gọn.
+"""
+
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, List, Tuple
+
+from ..config import COUNCIL_BLOBS
+
+MAGIC = b"CB1"
+STRING_REF = "$str"
+
+
+def _dedupe(value: Any, table: List[str], positions: Dict[str, int]) -> Any:
+    if isinstance(value, str):
+        if len(value) < COUNCIL_BLOBS["min_dedupe_length"]:
+            return value
+        index = positions.get(value)
+        if index is None:
+            index = positions[value] = len(table)
+            table.append(value)
+        return {STRING_REF: index}
+    if isinstance(value, dict):
+        return {key: _dedupe(item, table, positions) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_dedupe(item, table, positions) for item in value]
+    return value
+
+
+def _restore(value: Any, table: List[str]) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and STRING_REF in value:
+            return table[value[STRING_REF]]
+        return {key: _restore(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore(item, table) for item in value]
+    return value
+
+
+def pack(council_result: Dict[str, Any]) -> Tuple[str, bytes]:
+    """Trả về (ref = sha256 nội dung, blob đã nén)."""
+    canonical = json.dumps(council_result, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    ref = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    table: List[str] = []
+    data = _dedupe(council_result, table, {})
+    raw = json.dumps({"strings": table, "data": data}, ensure_ascii=False, separators=(",", ":"))
+    return ref, MAGIC + zlib.compress(raw.encode("utf-8"), COUNCIL_BLOBS["compress_level"])
+
+
+def unpack(blob: bytes) -> Dict[str, Any]:
+    if not blob.startswith(MAGIC):
+        raise ValueError("Unknown council blob format")
+    payload = json.loads(zlib.decompress(blob[len(MAGIC):]))
+    return _restore(payload["data"], payload["strings"])
+
+
+def summarize(council_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Bản tóm tắt nhỏ gọn để trả về cùng hội thoại (không kèm text từng stage)."""
+    final = council_result.get("final_result") or {}
+    summary = {
+        "selected_model": final.get("selected_model"),
+        "selected_stage": final.get("selected_stage"),
+        "selected_response": final.get("selected_response"),
+        "stage1_count": len(council_result.get("stage1_results") or []),
+        "stage2_count": len(council_result.get("stage2_results") or []),
+    }
+    for key in ("evaluated_by", "hedged", "error", "canvas"):
+        if key in final:
+            summary[key] = final[key]
+    return summary
@@ -0,0 +1,236 @@
+"""Export / import hội thoại dạng NDJSON (mỗi dòng một JSON), bộ nhớ hằng số.
+
+Export duyệt metadata theo trang keyset rồi đọc từng hội thoại một, nên chạy
+được trên mọi backend (và archive) mà không nạp hết dữ liệu vào RAM. Mỗi dòng:
+
+    {"type": "conversation", "data": {...hội thoại...}}
+    {"type": "message", "conversation_id": "...", "index": 3, "data": {...}}
+
+Bộ lọc:
+- since / until (ISO 8601, until không bao gồm): theo created_at của hội thoại
+  với unit="conversation", theo timestamp của message với unit="message".
+- task_type: unit="conversation" chỉ lấy hội thoại có assistant message thuộc
+  task_type đó; unit="message" chỉ lấy các assistant message đó.
+
+Import đọc lại đúng định dạng trên (council_response inline được nén lại thành
+blob) và cập nhật search index.
+
+    python -m backend.storage.export export --since 2025-01-01 --task-type outpainting > runs.ndjson
+    python -m backend.storage.export import runs.ndjson [--overwrite]
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from .base import iter_pages
+from . import (get_backend, get_archive, pack_message, hydrate_message, compact_message,
+               DETAIL_FULL, DETAIL_LEVELS)
+from . import search_index
+
+UNIT_CONVERSATION = "conversation"
+UNIT_MESSAGE = "message"
+UNITS = (UNIT_CONVERSATION, UNIT_MESSAGE)
+
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    """'2025-01-01' hoặc datetime ISO -> chuỗi so sánh được với created_at/timestamp; ValueError nếu sai."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+
+def _in_range(value: Optional[str], since: Optional[str], until: Optional[str]) -> bool:
+    if value is None:
+        return since is None and until is None
+    return (since is None or value >= since) and (until is None or value < until)
+
+
+def _iter_metas(archived: bool) -> Iterator[Dict[str, Any]]:
+    for meta in iter_pages(get_backend().list_page):
+        yield meta
+    if archived:
+        for meta in iter_pages(get_archive().list_page):
+            yield {**meta, "archived": True}
+
+
+def _load(meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if meta.get("archived"):
+        conversation = get_archive().get_conversation(meta["id"])
+        if conversation is not None:
+            conversation["archived"] = True
+        return conversation
+    return get_backend().get_conversation(meta["id"])
+
+
+def iter_export(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    task_type: Optional[str] = None,
+    unit: str = UNIT_CONVERSATION,
+    detail: str = DETAIL_FULL,
+    archived: bool = True,
+) -> Iterator[str]:
+    """
+    Các dòng NDJSON (đã kèm '\\n'). Tham số được kiểm tra ngay khi gọi (ValueError),
+    trước khi bắt đầu stream.
+    """
+    if unit not in UNITS:
+        raise ValueError(f"unit must be one of {UNITS}")
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"detail must be one of {DETAIL_LEVELS}")
+    return _generate(normalize_date(since), normalize_date(until), task_type, unit, detail, archived)
+
+
+def _generate(since, until, task_type, unit, detail, archived) -> Iterator[str]:
+    convert = hydrate_message if detail == DETAIL_FULL else compact_message
+    for meta in _iter_metas(archived):
+        # Message luôn mới hơn hội thoại: created_at >= until thì không có gì để lấy
+        if until is not None and meta["created_at"] >= until:
+            continue
+        if unit == UNIT_CONVERSATION and not _in_range(meta["created_at"], since, until):
+            continue
+        conversation = _load(meta)
+        if conversation is None:
+            continue
+        messages = conversation["messages"]
+
+        if unit == UNIT_CONVERSATION:
+            if task_type and not any(m.get("task_type") == task_type for m in messages):
+                continue
+            conversation["messages"] = [convert(m) for m in messages]
+            yield json.dumps({"type": UNIT_CONVERSATION, "data": conversation}, ensure_ascii=False) + "\n"
+            continue
+
+        for index, message in enumerate(messages):
+            if task_type and message.get("task_type") != task_type:
+                continue
+            if not _in_range(message.get("timestamp"), since, until):
+                continue
+            yield json.dumps({
+                "type": UNIT_MESSAGE,
+                "conversation_id": conversation["id"],
+                "index": index,
+                "data": convert(message),
+            }, ensure_ascii=False) + "\n"
+
+
+# --- Import ---
+
+def _index_message(conversation_id: str, message: Dict[str, Any]):
+    if message.get("role") == "user":
+        search_index.index_user_message(conversation_id, message)
+    elif message.get("council_response"):
+        search_index.index_assistant_message(conversation_id, message, message["council_response"])
+
+
+class Importer:
+    """Nhận lần lượt từng dòng NDJSON; không giữ lại dữ liệu giữa các dòng."""
+
+    def __init__(self, overwrite: bool = False):
+        self.overwrite = overwrite
+        self.counts = {"conversations": 0, "messages": 0, "skipped": 0, "errors": 0}
+        self.errors = []  # Chỉ giữ 20 lỗi đầu tiên
+        self.line_number = 0
+
+    def feed(self, line: str):
+        self.line_number += 1
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            kind = record.get("type")
+            if kind == UNIT_CONVERSATION:
+                self._import_conversation(record["data"])
+            elif kind == UNIT_MESSAGE:
+                self._import_message(record["conversation_id"], record["data"])
+            else:
+                raise ValueError(f"Unknown record type: {kind}")
+        except (ValueError, KeyError, TypeError) as e:
+            self.counts["errors"] += 1
+            if len(self.errors) < 20:
+                self.errors.append({"line": self.line_number, "error": str(e)})
+
+    def _import_conversation(self, conversation: Dict[str, Any]):
+        backend = get_backend()
+        conversation_id = conversation["id"]
+        if not self.overwrite and backend.get_conversation(conversation_id) is not None:
+            self.counts["skipped"] += 1
+            return
+        messages = conversation.get("messages", [])
+        backend.save_conversation({
+            "id": conversation_id,
+            "created_at": conversation["created_at"],
+            "title": conversation.get("title", "New Conversation"),
+            "messages": [pack_message(backend, m) for m in messages],
+        })
+        search_index.remove_conversation(conversation_id)
+        search_index.index_title(conversation_id, conversation.get("title", "New Conversation"))
+        for message in messages:
+            _index_message(conversation_id, message)
+        self.counts["conversations"] += 1
+
+    def _import_message(self, conversation_id: str, message: Dict[str, Any]):
+        backend = get_backend()
+        if backend.get_conversation(conversation_id) is None:
+            backend.create_conversation(conversation_id)
+        backend.append_message(conversation_id, pack_message(backend, message))
+        _index_message(conversation_id, message)
+        self.counts["messages"] += 1
+
+    def result(self) -> Dict[str, Any]:
+        return {**self.counts, "lines": self.line_number, "first_errors": self.errors}
+
+
+def import_lines(lines: Iterable[str], overwrite: bool = False) -> Dict[str, Any]:
+    importer = Importer(overwrite)
+    for line in lines:
+        importer.feed(line)
+    return importer.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import conversations as NDJSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="Ghi NDJSON ra stdout hoặc --output")
+    export_parser.add_argument("--since")
+    export_parser.add_argument("--until")
+    export_parser.add_argument("--task-type")
+    export_parser.add_argument("--unit", choices=UNITS, default=UNIT_CONVERSATION)
+    export_parser.add_argument("--detail", choices=DETAIL_LEVELS, default=DETAIL_FULL)
+    export_parser.add_argument("--no-archived", action="store_true", help="Bỏ qua hội thoại trong archive")
+    export_parser.add_argument("--output", "-o")
+
+    import_parser = sub.add_parser("import", help="Đọc NDJSON từ file hoặc stdin ('-')")
+    import_parser.add_argument("path", nargs="?", default="-")
+    import_parser.add_argument("--overwrite", action="store_true", help="Ghi đè hội thoại đã tồn tại")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        lines = iter_export(args.since, args.until, args.task_type, args.unit, args.detail,
+                            archived=not args.no_archived)
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            count = 0
+            for line in lines:
+                out.write(line)
+                count += 1
+        finally:
+            if args.output:
+                out.close()
+        print(f"✅ Exported {count} lines", file=sys.stderr)
+    else:
+        source = sys.stdin if args.path == "-" else open(args.path, "r", encoding="utf-8")
+        with source:
+            result = import_lines(source, args.overwrite)
+        print(json.dumps(result, indent=2, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""JSON-based storage for conversations (mỗi hội thoại một file)."""
+
+import json
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from pathlib import Path
+
+from ..config import COUNCIL_BLOBS
+from .base import StorageBackend, KeyedLocks, atomic_open, now_iso, set_image_url
+from .meta_index import MetadataIndex, conversation_meta
+
+INDEX_FILENAME = "_index.jsonl"
+BLOB_DIRNAME = "_blobs"
+
+
+class JsonStorage(StorageBackend):
+    name = "json"
+
+    def __init__(self, data_dir: str, fsync: bool = True):
+        self.data_dir = data_dir
+        self.fsync = fsync
+        self._index: Optional[MetadataIndex] = None
+        # Đọc-sửa-ghi trên cùng một hội thoại phải tuần tự, hội thoại khác chạy song song
+        self._locks = KeyedLocks()
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> MetadataIndex:
+        """Index metadata (sidecar), dựng lại từ các file nếu chưa có."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self.ensure_data_dir()
+                    index = MetadataIndex(os.path.join(self.data_dir, INDEX_FILENAME))
+                    index.load(lambda: (conversation_meta(c) for c in self.iter_conversations()))
+                    self._index = index
+        return self._index
+
+    def rebuild_index(self):
+        """Quét lại thư mục (khi file JSON bị sửa từ bên ngoài)."""
+        path = os.path.join(self.data_dir, INDEX_FILENAME)
+        if os.path.exists(path):
+            os.remove(path)
+        self._index = None
+        return self.index
+
+    def ensure_data_dir(self):
+        Path(self.data_dir).mkdir(parents=True, exist_ok=True)
+
+    def get_conversation_path(self, conversation_id: str) -> str:
+        return os.path.join(self.data_dir, f"{conversation_id}.json")
+
+    def create_conversation(self, conversation_id: str) -> Dict[str, Any]:
+        self.ensure_data_dir()
+        conversation = {
+            "id": conversation_id,
+            "created_at": now_iso(),
+            "title": "New Session",
+            "messages": []
+        }
+        self.save_conversation(conversation)
+        return conversation
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        path = self.get_conversation_path(conversation_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_conversation(self, conversation: Dict[str, Any]):
+        self.ensure_data_dir()
+        path = self.get_conversation_path(conversation['id'])
+        data = json.dumps(conversation, indent=2, ensure_ascii=False).encode('utf-8')
+        with self._locks.hold(conversation['id']):
+            # Ghi file tạm rồi rename: crash giữa chừng không làm hỏng file cũ
+            with atomic_open(path, self.fsync) as f:
+                f.write(data)
+            self.index.upsert(conversation_meta(conversation))
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        with self._locks.hold(conversation_id):
+            path = self.get_conversation_path(conversation_id)
+            if not os.path.exists(path):
+                return False
+            os.remove(path)
+            self.index.remove(conversation_id)
+            return True
+
+    def compact_storage(self):
+        # Blob được dùng chung giữa các hội thoại: chỉ dọn theo lượt quét (mark-and-sweep)
+        self.gc_council_blobs()
+        self.index.compact()
+
+    def disk_bytes(self) -> Optional[int]:
+        total = 0
+        for root, _, files in os.walk(self.data_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass  # File vừa bị xoá/đổi tên trong lúc quét
+        return total
+
+    def _blob_path(self, ref: str) -> str:
+        return os.path.join(self.data_dir, BLOB_DIRNAME, ref[:2], f"{ref}.zz")
+
+    def put_council_blob(self, ref: str, data: bytes):
+        path = self._blob_path(ref)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # mtime = lần dùng gần nhất (xem gc_council_blobs)
+                return
+            except FileNotFoundError:
+                pass  # Vừa bị GC: ghi lại
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_open(path, self.fsync) as f:
+            f.write(data)
+
+    def get_council_blob(self, ref: str) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(ref), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def gc_council_blobs(self, touched_before: Optional[float] = None,
+                         dry_run: bool = False) -> Dict[str, Any]:
+        if touched_before is None:
+            touched_before = time.time() - COUNCIL_BLOBS["gc_grace_seconds"]
+        live = {
+            message["council_ref"]
+            for conversation in self.iter_conversations()
+            for message in conversation.get("messages", [])
+            if message.get("council_ref")
+        }
+        report = {"deleted": 0, "bytes_reclaimed": 0}
+        blob_dir = os.path.join(self.data_dir, BLOB_DIRNAME)
+        for root, _, files in os.walk(blob_dir):
+            for name in files:
+                if not name.endswith(".zz") or name[:-3] in live:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime >= touched_before:
+                        continue
+                    if not dry_run:
+                        os.remove(path)
+                except OSError:
+                    continue
+                report["deleted"] += 1
+                report["bytes_reclaimed"] += stat.st_size
+        return report
+
+    def list_page(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return self.index.page(limit, cursor)
+
+    def iter_conversations(self):
+        # Đọc từng file một, không cần dựng danh sách metadata trước
+        if not os.path.isdir(self.data_dir):
+            return
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        yield json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ Bỏ qua {entry.name}: {e}")
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]):
+        self.apply_batch(conversation_id, [("message", message)])
+
+    def apply_batch(self, conversation_id: str, ops: List[Tuple[str, Any]]):
+        with self._locks.hold(conversation_id):
+            self._apply_batch_locked(conversation_id, ops)
+
+    def _apply_batch_locked(self, conversation_id: str, ops: List[Tuple[str, Any]]):
+        # Một lần đọc + một lần ghi file cho cả batch
+        conversation = self.get_conversation(conversation_id)
+        if conversation is None:
+            if any(kind == "message" for kind, _ in ops):
+                raise ValueError(f"Conversation {conversation_id} not found")
+            return
+        for kind, value in ops:
+            if kind == "message":
+                conversation["messages"].append(value)
+            elif kind == "title":
+                conversation["title"] = value
+            elif kind == "image_url":
+                set_image_url(conversation["messages"], *value)
+            else:
+                raise ValueError(f"Unknown storage op: {kind}")
+        self.save_conversation(conversation)
+
+    def update_conversation_title(self, conversation_id: str, title: str):
+        self.apply_batch(conversation_id, [("title", title)])
+
+    def set_message_image_url(self, conversation_id: str, local_image_path: str, image_url: str):
+        self.apply_batch(conversation_id, [("image_url", (local_image_path, image_url))])
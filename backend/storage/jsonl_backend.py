@@ -0,0 +1,189 @@
+"""Append-only log storage: mỗi hội thoại một file JSON Lines.
+
+Dòng đầu là header (id, created_at, title); mỗi message hoặc lần đổi title là
+một dòng append, nên chi phí ghi một message là hằng số thay vì đọc và ghi lại
+cả file. Đọc hội thoại = replay log. Dòng cuối bị cắt dở (crash giữa lúc ghi)
+được bỏ qua. Compaction gộp log (header với title mới nhất + các message) vào
+file tạm rồi os.replace, nên file luôn ở trạng thái cũ hoặc mới, không dở dang.
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .base import StorageBackend, atomic_open, set_image_url
+from .json_backend import JsonStorage, INDEX_FILENAME
+from .meta_index import conversation_meta
+
+LOG_SUFFIX = ".jsonl"
+LOG_VERSION = 1
+
+
+def _line(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class JsonLogStorage(JsonStorage):
+    name = "jsonl"
+
+    def __init__(self, data_dir: str, fsync: bool = True, compact_after: int = 16):
+        super().__init__(data_dir, fsync)
+        # Số bản ghi không phải message (đổi title...) tối đa trước khi compaction
+        self.compact_after = compact_after
+        self._extra_records: Dict[str, int] = {}
+
+    def get_conversation_path(self, conversation_id: str) -> str:
+        return os.path.join(self.data_dir, f"{conversation_id}{LOG_SUFFIX}")
+
+    # Mỗi thao tác đã là một lần append, không cần gộp thành một lần ghi lại file
+    apply_batch = StorageBackend.apply_batch
+
+    # --- Đọc ---
+
+    def _replay(self, path: str) -> Tuple[Optional[Dict[str, Any]], int, bool]:
+        """
+        Dựng lại hội thoại từ log; trả về (conversation, số bản ghi không phải
+        message, có dòng hỏng hay không).
+        """
+        conversation = None
+        extra_records = 0
+        damaged = False
+        with open(path, "rb") as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    # Dòng ghi dở khi crash: bỏ qua, các dòng đã fsync vẫn còn nguyên
+                    print(f"⚠️ Bỏ qua dòng log hỏng trong {os.path.basename(path)}")
+                    damaged = True
+                    continue
+                kind = record.get("type")
+                if kind == "header":
+                    conversation = {
+                        "id": record["id"],
+                        "created_at": record["created_at"],
+                        "title": record.get("title", "New Conversation"),
+                        "messages": []
+                    }
+                elif conversation is None:
+                    continue
+                elif kind == "message":
+                    conversation["messages"].append(record["message"])
+                elif kind == "title":
+                    conversation["title"] = record["title"]
+                    extra_records += 1
+                elif kind == "image_url":
+                    set_image_url(conversation["messages"], record["local_image_path"], record["image_url"])
+                    extra_records += 1
+        return conversation, extra_records, damaged
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        path = self.get_conversation_path(conversation_id)
+        if not os.path.exists(path):
+            return None
+        conversation, extra_records, damaged = self._replay(path)
+        # Gộp log khi quá nhiều bản ghi phụ, hoặc để dọn dòng hỏng
+        if conversation is not None and (damaged or extra_records >= self.compact_after):
+            self.compact(conversation_id)
+        return conversation
+
+    def iter_conversations(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.isdir(self.data_dir):
+            return
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(LOG_SUFFIX) or entry.name == INDEX_FILENAME:
+                    continue
+                try:
+                    conversation, _, _ = self._replay(entry.path)
+                except OSError as e:
+                    print(f"⚠️ Bỏ qua {entry.name}: {e}")
+                    continue
+                if conversation is not None:
+                    yield conversation
+
+    # --- Ghi ---
+
+    def _append(self, conversation_id: str, record: Dict[str, Any]):
+        path = self.get_conversation_path(conversation_id)
+        with open(path, "a+b") as f:
+            # Nếu lần ghi trước bị cắt giữa dòng, xuống dòng trước để bản ghi mới không dính vào
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(_line(record))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _write_compacted(self, conversation: Dict[str, Any]):
+        """Ghi header + message vào file tạm rồi thay thế log cũ (atomic). Gọi khi đang giữ lock."""
+        self.ensure_data_dir()
+        path = self.get_conversation_path(conversation["id"])
+        with atomic_open(path, self.fsync) as f:
+            f.write(_line({
+                "type": "header",
+                "version": LOG_VERSION,
+                "id": conversation["id"],
+                "created_at": conversation["created_at"],
+                "title": conversation.get("title", "New Conversation"),
+            }))
+            for message in conversation.get("messages", []):
+                f.write(_line({"type": "message", "message": message}))
+        self._extra_records[conversation["id"]] = 0
+
+    def save_conversation(self, conversation: Dict[str, Any]):
+        with self._locks.hold(conversation["id"]):
+            self._write_compacted(conversation)
+            self.index.upsert(conversation_meta(conversation))
+
+    def compact(self, conversation_id: str) -> bool:
+        # Replay lại trong lock để không mất dòng vừa được append bởi thread khác
+        with self._locks.hold(conversation_id):
+            path = self.get_conversation_path(conversation_id)
+            if not os.path.exists(path):
+                return False
+            conversation, _, _ = self._replay(path)
+            if conversation is None:
+                return False
+            self._write_compacted(conversation)
+            return True
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        self._extra_records.pop(conversation_id, None)
+        return super().delete_conversation(conversation_id)
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]):
+        with self._locks.hold(conversation_id):
+            meta = self.index.get(conversation_id)
+            if meta is None:
+                raise ValueError(f"Conversation {conversation_id} not found")
+            self._append(conversation_id, {"type": "message", "message": message})
+            meta["message_count"] += 1
+            if meta.get("cover_image") is None:
+                meta["cover_image"] = message.get("local_image_path")
+            self.index.upsert(meta)
+
+    def update_conversation_title(self, conversation_id: str, title: str):
+        with self._locks.hold(conversation_id):
+            meta = self.index.get(conversation_id)
+            if meta is None: return
+            self._append(conversation_id, {"type": "title", "title": title})
+            meta["title"] = title
+            self.index.upsert(meta)
+            self._count_extra_record(conversation_id)
+
+    def set_message_image_url(self, conversation_id: str, local_image_path: str, image_url: str):
+        with self._locks.hold(conversation_id):
+            if self.index.get(conversation_id) is None:
+                return
+            self._append(conversation_id, {"type": "image_url", "local_image_path": local_image_path,
+                                           "image_url": image_url})
+            self._count_extra_record(conversation_id)
+
+    def _count_extra_record(self, conversation_id: str):
+        extra_records = self._extra_records.get(conversation_id, 0) + 1
+        self._extra_records[conversation_id] = extra_records
+        if extra_records >= self.compact_after:
+            self.compact(conversation_id)
@@ -0,0 +1,136 @@
+"""Index metadata hội thoại (id, created_at, title, message_count, cover_image) cho JSON backend.
+
+Trong RAM: dict theo id + danh sách (created_at, id) luôn được giữ sắp xếp,
+nên liệt kê/phân trang là O(log N + limit) thay vì mở và parse mọi file.
+Trên đĩa: file sidecar dạng JSON Lines, mỗi lần ghi chỉ append một dòng;
+khi số dòng vượt quá 2 lần số hội thoại thì được viết gọn lại.
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .base import atomic_open, encode_cursor, decode_cursor
+
+META_FIELDS = ("id", "created_at", "title", "message_count", "cover_image")
+
+
+def cover_image(messages: Iterable[Dict[str, Any]]) -> Optional[str]:
+    """local_image_path của ảnh đầu tiên trong hội thoại (thumbnail ở danh sách)."""
+    return next((m["local_image_path"] for m in messages if m.get("local_image_path")), None)
+
+
+def conversation_meta(conversation: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": conversation["id"],
+        "created_at": conversation["created_at"],
+        "title": conversation.get("title", "New Conversation"),
+        "message_count": len(conversation.get("messages", [])),
+        "cover_image": cover_image(conversation.get("messages", [])),
+    }
+
+
+class MetadataIndex:
+    def __init__(self, path: str, fields: Tuple[str, ...] = META_FIELDS):
+        self.path = path
+        self.fields = fields
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.order: List[Tuple[str, str]] = []  # (created_at, id) tăng dần
+        self.log_lines = 0
+        self._lock = threading.RLock()
+
+    def load(self, rebuild: Callable[[], Iterable[Dict[str, Any]]]):
+        """Đọc sidecar; nếu chưa có thì dựng lại từ `rebuild()` (quét thư mục một lần)."""
+        with self._lock:
+            if os.path.exists(self.path):
+                self._replay()
+            else:
+                for meta in rebuild():
+                    self._apply(meta)
+                self.compact()
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Dòng cuối ghi dở khi crash
+                self.log_lines += 1
+                if record.get("deleted"):
+                    self._forget(record["id"])
+                else:
+                    self._apply(record)
+
+    def _apply(self, meta: Dict[str, Any]):
+        old = self.entries.get(meta["id"])
+        if old is not None and old["created_at"] != meta["created_at"]:
+            self._remove_order(old)
+        if old is None or old["created_at"] != meta["created_at"]:
+            insort(self.order, (meta["created_at"], meta["id"]))
+        self.entries[meta["id"]] = {field: meta.get(field) for field in self.fields}
+
+    def _forget(self, conversation_id: str):
+        old = self.entries.pop(conversation_id, None)
+        if old is not None:
+            self._remove_order(old)
+
+    def _remove_order(self, meta: Dict[str, Any]):
+        key = (meta["created_at"], meta["id"])
+        position = bisect_left(self.order, key)
+        if position < len(self.order) and self.order[position] == key:
+            del self.order[position]
+
+    def _append(self, record: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.log_lines += 1
+        if self.log_lines > 2 * max(len(self.entries), 64):
+            self.compact()
+
+    def upsert(self, meta: Dict[str, Any]):
+        with self._lock:
+            if self.entries.get(meta["id"]) == meta:
+                return
+            self._apply(meta)
+            self._append(self.entries[meta["id"]])
+
+    def remove(self, conversation_id: str):
+        with self._lock:
+            if conversation_id in self.entries:
+                self._forget(conversation_id)
+                self._append({"id": conversation_id, "deleted": True})
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        meta = self.entries.get(conversation_id)
+        return dict(meta) if meta is not None else None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def compact(self):
+        """Viết lại sidecar chỉ với trạng thái hiện tại (temp file + rename)."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with atomic_open(self.path, fsync=False) as f:
+                for _, conversation_id in self.order:
+                    f.write((json.dumps(self.entries[conversation_id], ensure_ascii=False) + "\n").encode("utf-8"))
+            self.log_lines = len(self.order)
+
+    def page(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Mới nhất trước; O(log N + limit)."""
+        with self._lock:
+            end = len(self.order)
+            if cursor:
+                end = bisect_left(self.order, decode_cursor(cursor))
+            start = 0 if limit is None else max(0, end - limit)
+            keys = self.order[start:end]
+            items = [dict(self.entries[conversation_id]) for _, conversation_id in reversed(keys)]
+            next_cursor = encode_cursor(*keys[0]) if start > 0 and keys else None
+            return items, next_cursor
@@ -0,0 +1,96 @@
+"""Chuyển hội thoại từ thư mục JSON cũ sang SQLite.
+
+Đọc và ghi từng hội thoại một (không nạp cả thư mục vào RAM), mỗi hội thoại
+một transaction. Chạy lại nhiều lần được: hội thoại đã có trong DB bị bỏ qua
+trừ khi dùng --overwrite.
+
+Server tự gọi `auto_migrate` khi khởi động với DB rỗng (STORAGE_AUTO_MIGRATE).
+
+    python -m backend.storage.migrate [--source data/conversations] [--db data/council.db]
+"""
+
+import argparse
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from ..config import DATA_DIR, SQLITE_PATH
+from .json_backend import JsonStorage
+from .sqlite_backend import SQLiteStorage
+
+
+def has_json_conversations(source_dir: str) -> bool:
+    if not os.path.isdir(source_dir):
+        return False
+    with os.scandir(source_dir) as entries:
+        return any(entry.name.endswith(".json") for entry in entries)
+
+
+def migrate_into(
+    source: JsonStorage, target: SQLiteStorage, overwrite: bool = False,
+    on_migrated: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> dict:
+    counts = {"migrated": 0, "skipped": 0, "failed": 0, "messages": 0}
+    started_at = time.perf_counter()
+    for conversation in source.iter_conversations():
+        conversation_id = conversation.get("id")
+        if not conversation_id or "created_at" not in conversation:
+            counts["failed"] += 1
+            continue
+        if not overwrite and target.exists(conversation_id):
+            counts["skipped"] += 1
+            continue
+        try:
+            target.save_conversation(conversation)
+        except Exception as e:
+            print(f"⚠️ Không migrate được {conversation_id}: {e}")
+            counts["failed"] += 1
+            continue
+        counts["migrated"] += 1
+        counts["messages"] += len(conversation.get("messages", []))
+        if on_migrated is not None:
+            on_migrated(conversation)
+    counts["seconds"] = round(time.perf_counter() - started_at, 3)
+    return counts
+
+
+def migrate(source_dir: str, db_path: str, overwrite: bool = False) -> dict:
+    target = SQLiteStorage(db_path)
+    try:
+        return migrate_into(JsonStorage(source_dir), target, overwrite)
+    finally:
+        target.close()
+
+
+def auto_migrate(
+    target: SQLiteStorage, source_dir: str = DATA_DIR,
+    on_migrated: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Optional[dict]:
+    """
+    Migrate thư mục JSON cũ vào `target` nếu DB còn rỗng và thư mục có hội
+    thoại; None nếu không cần. File JSON được giữ nguyên (có thể quay lại
+    STORAGE_BACKEND=json).
+    """
+    if not target.is_empty() or not has_json_conversations(source_dir):
+        return None
+    print(f"📦 DB SQLite rỗng, tự migrate hội thoại JSON từ {source_dir}...")
+    counts = migrate_into(JsonStorage(source_dir), target, on_migrated=on_migrated)
+    print(f"✅ Migrated {counts['migrated']} conversations ({counts['messages']} messages), "
+          f"failed {counts['failed']} in {counts['seconds']}s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate JSON conversations to SQLite")
+    parser.add_argument("--source", default=DATA_DIR, help="Thư mục JSON cũ")
+    parser.add_argument("--db", default=SQLITE_PATH, help="File SQLite đích")
+    parser.add_argument("--overwrite", action="store_true", help="Ghi đè hội thoại đã có trong DB")
+    args = parser.parse_args()
+
+    counts = migrate(args.source, args.db, args.overwrite)
+    print(f"✅ Migrated {counts['migrated']} conversations ({counts['messages']} messages), "
+          f"skipped {counts['skipped']}, failed {counts['failed']} in {counts['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Dựng lại search index (FTS5) từ toàn bộ hội thoại trong storage.
+
+    python -m backend.storage.reindex ["truy vấn thử"]
+"""
+
+import argparse
+import time
+
+from . import get_backend, hydrate_message
+from . import search_index
+
+
+def index_conversation(conversation):
+    """Index title + mọi message của một hội thoại (không xoá dữ liệu cũ)."""
+    conversation_id = conversation["id"]
+    search_index.index_title(conversation_id, conversation.get("title", ""))
+    for message in conversation.get("messages", []):
+        if message.get("role") == "user":
+            search_index.index_user_message(conversation_id, message)
+        else:
+            council_result = hydrate_message(message).get("council_response") or {}
+            search_index.index_assistant_message(conversation_id, message, council_result)
+
+
+def rebuild() -> int:
+    """Xoá và dựng lại index. Trả về số hội thoại đã index."""
+    index = search_index.get_index()
+    if index is None:
+        return 0
+    index.clear()
+    count = 0
+    for conversation in get_backend().iter_conversations():
+        index_conversation(conversation)
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the conversation search index")
+    parser.add_argument("query", nargs="?", help="Tìm thử một truy vấn sau khi dựng xong")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    count = rebuild()
+    print(f"✅ Indexed {count} conversations in {time.perf_counter() - started_at:.2f}s")
+    if args.query:
+        index = search_index.get_index()
+        results, _ = index.search(args.query) if index else ([], None)
+        for result in results:
+            print(f"{result['score']:>8} {result['conversation_id']} [{result['kind']}] {result['snippet']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Retention: lưu trữ hội thoại cũ + dọn ảnh local không còn được dùng.
+
+Một lượt chạy:
+1. Quét các hội thoại trong backend; hội thoại không hoạt động (message cuối,
+   hoặc created_at nếu chưa có message) quá `max_age_days` được ghi vào segment
+   zip trong archive (kết quả council ghi inline, không giữ council_ref) rồi
+   xoá khỏi backend. Blob council không còn message
+   nào trỏ tới bị xoá, sau đó backend được thu gọn (VACUUM với SQLite, viết
+   gọn index với JSON).
+2. Xoá các file trong LOCAL_IMG_DIR không còn message nào (kể cả trong archive
+   và hội thoại JSON cũ chưa migrate) tham chiếu và đã cũ hơn
+   `image_min_age_hours`; với image_store thì đếm lại refcount và xoá ảnh
+   refcount 0 (kèm derivative).
+
+Báo cáo gồm dung lượng thu hồi được và thời gian liệt kê hội thoại / quét thư
+mục ảnh trước và sau. Chạy tay:
+
+    python -m backend.storage.retention [--dry-run] [--max-age-days 30]
+    python -m backend.storage.retention --restore <conversation_id>
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from ..config import RETENTION, LOCAL_IMG_DIR
+from .. import image_store
+from . import (get_backend, get_archive, restore_conversation, iter_unmigrated_legacy,
+               inline_conversation)
+from .archive import image_paths
+
+# Lượt chạy đầu tiên sau khi server khởi động (giây), tránh tranh I/O lúc startup
+INITIAL_DELAY = 60.0
+
+_task: Optional[asyncio.Task] = None
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def last_activity(conversation: Dict[str, Any]) -> str:
+    timestamps = [m["timestamp"] for m in conversation.get("messages", []) if m.get("timestamp")]
+    return max([conversation["created_at"], *timestamps])
+
+
+def _timed_ms(fn) -> float:
+    started_at = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - started_at) * 1000, 3)
+
+
+def _scan_images(image_dir: str) -> List[os.DirEntry]:
+    if not os.path.isdir(image_dir):
+        return []
+    with os.scandir(image_dir) as entries:
+        return [entry for entry in entries if entry.is_file()]
+
+
+def archive_expired(cutoff: str, dry_run: bool = False) -> Dict[str, Any]:
+    backend = get_backend()
+    archive = get_archive()
+    # Lượt 1 chỉ giữ id, không nạp mọi hội thoại hết hạn vào RAM cùng lúc
+    expired = [c["id"] for c in backend.iter_conversations() if last_activity(c) < cutoff]
+
+    report = {"expired": len(expired), "archived": 0, "skipped": 0, "segments": 0,
+              "conversation_bytes": 0, "segment_bytes": 0}
+    if dry_run:
+        report["council_blobs"] = backend.gc_council_blobs(dry_run=True)
+        return report
+
+    # Segment cũ còn council_ref: inline trước khi GC blob xoá mất dữ liệu của chúng
+    report["reinlined"] = archive.inline_council_results(inline_conversation)
+
+    segment_size = RETENTION["segment_size"]
+    for start in range(0, len(expired), segment_size):
+        batch = [backend.get_conversation(cid) for cid in expired[start:start + segment_size]]
+        batch = [c for c in batch if c is not None]
+        inlined = {c["id"]: inline_conversation(c) for c in batch}
+        segment = archive.write_segment(inlined.values())
+        if segment is None:
+            continue
+        report["segments"] += 1
+        report["segment_bytes"] += os.path.getsize(os.path.join(archive.archive_dir, segment))
+        for conversation in batch:
+            # Hội thoại vừa có message mới trong lúc ghi segment: giữ lại ở backend
+            current = backend.get_conversation(conversation["id"])
+            if current is None or current != conversation:
+                report["skipped"] += 1
+                continue
+            archive.register(inlined[conversation["id"]], segment)
+            backend.delete_conversation(conversation["id"])
+            report["archived"] += 1
+            report["conversation_bytes"] += len(json.dumps(conversation, ensure_ascii=False).encode("utf-8"))
+
+    report["council_blobs"] = backend.gc_council_blobs(dry_run=dry_run)
+    if report["archived"]:
+        backend.compact_storage()
+    return report
+
+
+def collect_image_refs() -> List[str]:
+    """
+    local_image_path của mọi message (live + archive + JSON cũ chưa migrate),
+    mỗi tham chiếu một phần tử.
+    """
+    refs = []
+    for conversation in get_backend().iter_conversations():
+        refs.extend(image_paths(conversation))
+    refs.extend(get_archive().image_paths())
+    for conversation in iter_unmigrated_legacy():
+        refs.extend(image_paths(conversation))
+    return refs
+
+
+def gc_images(image_dir: str = LOCAL_IMG_DIR, dry_run: bool = False) -> Dict[str, Any]:
+    paths = collect_image_refs()
+    refs = {os.path.abspath(path) for path in paths}
+    min_age = RETENTION["image_min_age_hours"] * 3600
+    min_mtime = time.time() - min_age
+    report = {"scanned": 0, "deleted": 0, "bytes_reclaimed": 0}
+    for entry in _scan_images(image_dir):
+        report["scanned"] += 1
+        if os.path.abspath(entry.path) in refs:
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_mtime > min_mtime:
+                continue  # Có thể đang upload, message chưa kịp được lưu
+            if not dry_run:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"⚠️ Không xoá được ảnh {entry.name}: {e}")
+            continue
+        report["deleted"] += 1
+        report["bytes_reclaimed"] += stat.st_size
+
+    # Ảnh trong image_store: đếm lại refcount rồi xoá ảnh không còn ai dùng
+    store = image_store.get_store()
+    if not dry_run:
+        store.reconcile(image_store.count_references(paths))
+    report["store"] = store.gc(min_age, dry_run)
+    report["deleted"] += report["store"]["deleted"]
+    report["bytes_reclaimed"] += report["store"]["bytes_reclaimed"]
+    return report
+
+
+def run(max_age_days: Optional[float] = None, images: bool = True, dry_run: bool = False) -> Dict[str, Any]:
+    """Một lượt retention đầy đủ; trả về báo cáo (xem docstring module)."""
+    global _last_report
+    backend = get_backend()
+    max_age_days = RETENTION["max_age_days"] if max_age_days is None else max_age_days
+    cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat()
+    started_at = time.perf_counter()
+
+    disk_before = backend.disk_bytes()
+    list_before = _timed_ms(backend.list_conversations)
+    image_scan_before = _timed_ms(lambda: _scan_images(LOCAL_IMG_DIR))
+
+    conversations = archive_expired(cutoff, dry_run)
+    image_report = gc_images(dry_run=dry_run) if images else None
+
+    disk_after = backend.disk_bytes()
+    list_after = _timed_ms(backend.list_conversations)
+    image_scan_after = _timed_ms(lambda: _scan_images(LOCAL_IMG_DIR))
+    reclaimed = disk_before - disk_after if disk_before is not None and disk_after is not None else None
+    report = {
+        "dry_run": dry_run,
+        "cutoff": cutoff,
+        "conversations": conversations,
+        "images": image_report,
+        "storage_bytes_before": disk_before,
+        "storage_bytes_after": disk_after,
+        "storage_bytes_reclaimed": reclaimed,
+        "list_ms_before": list_before,
+        "list_ms_after": list_after,
+        "image_scan_ms_before": image_scan_before,
+        "image_scan_ms_after": image_scan_after,
+        "duration_s": round(time.perf_counter() - started_at, 3),
+        "finished_at": datetime.utcnow().isoformat(),
+    }
+    if not dry_run:
+        _last_report = report
+    print(f"🗄️ Retention: archived {conversations['archived']}/{conversations['expired']} conversations, "
+          f"deleted {image_report['deleted'] if image_report else 0} images in {report['duration_s']}s")
+    return report
+
+
+# --- Chạy nền trong server ---
+
+async def _loop():
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(INITIAL_DELAY)
+    while True:
+        try:
+            await loop.run_in_executor(None, run)
+        except Exception as e:
+            print(f"⚠️ Retention thất bại: {e}")
+        await asyncio.sleep(RETENTION["interval_hours"] * 3600)
+
+
+def start():
+    global _task
+    if RETENTION["enabled"] and (_task is None or _task.done()):
+        _task = asyncio.create_task(_loop())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "enabled": RETENTION["enabled"],
+        "max_age_days": RETENTION["max_age_days"],
+        "last_run": _last_report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old conversations and delete unreferenced images")
+    parser.add_argument("--max-age-days", type=float, default=None, help="Mặc định RETENTION['max_age_days']")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm, không ghi/xoá gì")
+    parser.add_argument("--no-images", action="store_true", help="Bỏ qua bước dọn ảnh")
+    parser.add_argument("--restore", metavar="CONVERSATION_ID", help="Đưa một hội thoại từ archive về backend")
+    args = parser.parse_args()
+
+    if args.restore:
+        ok = restore_conversation(args.restore)
+        print(f"✅ Restored {args.restore}" if ok else f"❌ {args.restore} is not archived")
+        return
+    report = run(args.max_age_days, images=not args.no_images, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
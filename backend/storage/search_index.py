@@ -0,0 +1,259 @@
+"""Full-text search (SQLite FTS5) trên hội thoại và các prompt outpainting đã tạo.
+
+Index được cập nhật tăng dần từ các hàm storage.add_* / update_conversation_title:
+- "user": nội dung tin nhắn của người dùng
+- "prompt": kịch bản JSON được chairman chọn (final_result.selected_response)
+- "evaluation": phần đánh giá của chairman
+- "title": tiêu đề hội thoại
+
+Tokenizer unicode61 bỏ dấu, nên "ho sen" cũng khớp "hồ sen". Kết quả xếp theo
+bm25. Cột UNINDEXED của FTS5 không có index (lọc theo chúng là quét cả bảng),
+nên rowid của từng document và title hiện tại được giữ ở bảng thường theo
+conversation_id: đổi title, xoá hội thoại và lấy title cho kết quả tìm kiếm
+đều là lookup theo khóa. Dựng lại toàn bộ index từ storage hiện có:
+
+    python -m backend.storage.reindex
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import SEARCH_INDEX
+
+KIND_USER = "user"
+KIND_PROMPT = "prompt"
+KIND_EVALUATION = "evaluation"
+KIND_TITLE = "title"
+KINDS = (KIND_USER, KIND_PROMPT, KIND_EVALUATION, KIND_TITLE)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(
+    body,
+    conversation_id UNINDEXED,
+    kind UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+-- rowid của documents theo hội thoại (xoá hội thoại không phải quét FTS)
+CREATE TABLE IF NOT EXISTS document_owners (
+    doc_rowid INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_document_owners_conversation ON document_owners(conversation_id);
+
+-- Title hiện tại + rowid document title của nó
+CREATE TABLE IF NOT EXISTS titles (
+    conversation_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    doc_rowid INTEGER NOT NULL
+);
+"""
+
+SQL_INSERT = "INSERT INTO documents (body, conversation_id, kind, timestamp) VALUES (?, ?, ?, ?)"
+SQL_INSERT_OWNER = "INSERT INTO document_owners (doc_rowid, conversation_id) VALUES (?, ?)"
+SQL_GET_TITLE_ROWID = "SELECT doc_rowid FROM titles WHERE conversation_id = ?"
+SQL_UPSERT_TITLE = (
+    "INSERT INTO titles (conversation_id, title, doc_rowid) VALUES (?, ?, ?) "
+    "ON CONFLICT(conversation_id) DO UPDATE SET title = excluded.title, doc_rowid = excluded.doc_rowid"
+)
+SQL_DELETE_DOCUMENT = "DELETE FROM documents WHERE rowid = ?"
+SQL_DELETE_OWNER = "DELETE FROM document_owners WHERE doc_rowid = ?"
+SQL_DELETE_CONVERSATION_DOCUMENTS = (
+    "DELETE FROM documents WHERE rowid IN "
+    "(SELECT doc_rowid FROM document_owners WHERE conversation_id = ?)"
+)
+SQL_DELETE_CONVERSATION_OWNERS = "DELETE FROM document_owners WHERE conversation_id = ?"
+SQL_DELETE_CONVERSATION_TITLE = "DELETE FROM titles WHERE conversation_id = ?"
+SQL_SEARCH = (
+    "SELECT d.conversation_id, d.kind, d.timestamp, "
+    "snippet(documents, 0, '[', ']', '…', 16), bm25(documents), t.title "
+    "FROM documents d LEFT JOIN titles t ON t.conversation_id = d.conversation_id "
+    "WHERE documents MATCH ? {kind_filter}"
+    "ORDER BY bm25(documents) LIMIT ? OFFSET ?"
+)
+# Index tạo trước khi có document_owners/titles: điền một lần từ bảng FTS
+SQL_BACKFILL_OWNERS = (
+    "INSERT OR IGNORE INTO document_owners (doc_rowid, conversation_id) "
+    "SELECT rowid, conversation_id FROM documents"
+)
+SQL_BACKFILL_TITLES = (
+    "INSERT OR REPLACE INTO titles (conversation_id, title, doc_rowid) "
+    "SELECT conversation_id, body, rowid FROM documents WHERE kind = 'title' ORDER BY rowid"
+)
+
+_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def to_fts_query(text: str) -> str:
+    """
+    Chuyển chuỗi người dùng nhập thành truy vấn FTS5 an toàn: mỗi từ (hoặc cụm
+    trong ngoặc kép) thành một phrase, các phrase nối bằng AND.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(text):
+        term = (phrase or word).strip()
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"')
+    return " ".join(terms)
+
+
+class SearchIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            had_owners = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'document_owners'").fetchone() is not None
+            conn.executescript(SCHEMA)
+            if not had_owners:
+                conn.execute(SQL_BACKFILL_OWNERS)
+                conn.execute(SQL_BACKFILL_TITLES)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def add(self, conversation_id: str, kind: str, body: Optional[str], timestamp: Optional[str]):
+        if not body:
+            return
+        with self._conn() as conn:
+            self._insert(conn, conversation_id, kind, body, timestamp)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, conversation_id: str, kind: str, body: str,
+                timestamp: Optional[str]) -> int:
+        rowid = conn.execute(SQL_INSERT, (body, conversation_id, kind, timestamp)).lastrowid
+        conn.execute(SQL_INSERT_OWNER, (rowid, conversation_id))
+        return rowid
+
+    def set_title(self, conversation_id: str, title: str):
+        with self._conn() as conn:
+            row = conn.execute(SQL_GET_TITLE_ROWID, (conversation_id,)).fetchone()
+            if row is not None:
+                conn.execute(SQL_DELETE_DOCUMENT, row)
+                conn.execute(SQL_DELETE_OWNER, row)
+            rowid = self._insert(conn, conversation_id, KIND_TITLE, title, None)
+            conn.execute(SQL_UPSERT_TITLE, (conversation_id, title, rowid))
+
+    def remove_conversation(self, conversation_id: str):
+        with self._conn() as conn:
+            conn.execute(SQL_DELETE_CONVERSATION_DOCUMENTS, (conversation_id,))
+            conn.execute(SQL_DELETE_CONVERSATION_OWNERS, (conversation_id,))
+            conn.execute(SQL_DELETE_CONVERSATION_TITLE, (conversation_id,))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM document_owners")
+            conn.execute("DELETE FROM titles")
+
+    def search(
+        self, text: str, limit: int = 20, cursor: Optional[str] = None, kind: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Kết quả xếp theo độ liên quan; cursor là offset của trang kế tiếp."""
+        query = to_fts_query(text)
+        if not query:
+            return [], None
+        try:
+            offset = int(cursor) if cursor else 0
+        except ValueError:
+            raise ValueError("Invalid cursor")
+
+        params: List[Any] = [query]
+        kind_filter = ""
+        if kind:
+            kind_filter = "AND d.kind = ? "
+            params.append(kind)
+        params += [limit + 1, offset]
+        rows = self._conn().execute(SQL_SEARCH.format(kind_filter=kind_filter), params).fetchall()
+
+        next_cursor = str(offset + limit) if len(rows) > limit else None
+        return [
+            {
+                "conversation_id": row[0],
+                "kind": row[1],
+                "timestamp": row[2],
+                "snippet": row[3],
+                "score": round(-row[4], 4),
+                "title": row[5],
+            }
+            for row in rows[:limit]
+        ], next_cursor
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[SearchIndex]:
+    """None nếu SEARCH_INDEX bị tắt."""
+    global _index
+    if not SEARCH_INDEX["enabled"]:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex(SEARCH_INDEX["path"])
+    return _index
+
+
+def _safe(fn, *args):
+    # Index lỗi không được làm hỏng việc lưu hội thoại
+    index = get_index()
+    if index is None:
+        return
+    try:
+        fn(index, *args)
+    except sqlite3.Error as e:
+        print(f"⚠️ Search index update failed: {e}")
+
+
+def index_user_message(conversation_id: str, message: Dict[str, Any]):
+    _safe(SearchIndex.add, conversation_id, KIND_USER, message.get("content"), message.get("timestamp"))
+
+
+def index_assistant_message(conversation_id: str, message: Dict[str, Any], council_result: Dict[str, Any]):
+    if message.get("task_type") != "outpainting":
+        return
+    final = council_result.get("final_result") or {}
+    timestamp = message.get("timestamp")
+    _safe(SearchIndex.add, conversation_id, KIND_PROMPT, final.get("selected_response"), timestamp)
+    _safe(SearchIndex.add, conversation_id, KIND_EVALUATION, final.get("evaluation"), timestamp)
+
+
+def index_title(conversation_id: str, title: str):
+    _safe(SearchIndex.set_title, conversation_id, title)
+
+
+def remove_conversation(conversation_id: str):
+    _safe(SearchIndex.remove_conversation, conversation_id)
+
+
+def close():
+    global _index
+    if _index is not None:
+        _index.close()
+        _index = None
@@ -0,0 +1,373 @@
+"""SQLite storage (WAL) cho hội thoại.
+
+Mỗi message là một dòng, kết quả council nằm ở bảng blob riêng (message chỉ
+giữ cột council_ref), nên thêm một message chỉ ghi đúng message đó thay vì
+đọc/ghi lại cả hội thoại. Blob dùng chung theo content hash: khi xoá/ghi đè
+hội thoại, blob không còn message nào trỏ tới (tra qua index council_ref) bị
+xoá luôn. Mỗi thread dùng một connection riêng; câu SQL là hằng số nên được
+sqlite3 cache sẵn (prepared statement) trên từng connection.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+from ..config import COUNCIL_BLOBS
+from .base import StorageBackend, now_iso, encode_cursor, decode_cursor
+from . import council_blob
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT,
+    task_type TEXT,
+    timestamp TEXT,
+    image_url TEXT,
+    local_image_path TEXT,
+    extra TEXT,
+    council_ref TEXT,
+    UNIQUE (conversation_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+
+-- Kết quả council đã nén (backend/storage/council_blob.py), theo sha256 nội dung.
+-- touched_at: lần ghi gần nhất (kể cả ghi trùng), blob mới không bị GC ngay
+CREATE TABLE IF NOT EXISTS council_blobs (
+    ref TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    touched_at REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Index cho phân trang keyset (created_at, id) và tra blob theo council_ref;
+# tạo sau khi _upgrade_schema đã thêm cột
+SCHEMA_INDEXES = """
+DROP INDEX IF EXISTS idx_conversations_created_at;
+CREATE INDEX IF NOT EXISTS idx_conversations_created_at_id ON conversations(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_messages_council_ref ON messages(council_ref) WHERE council_ref IS NOT NULL;
+"""
+
+SQL_INSERT_CONVERSATION = "INSERT INTO conversations (id, created_at, title) VALUES (?, ?, ?)"
+SQL_UPSERT_CONVERSATION = (
+    "INSERT INTO conversations (id, created_at, title) VALUES (?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET created_at = excluded.created_at, title = excluded.title"
+)
+SQL_GET_CONVERSATION = "SELECT id, created_at, title FROM conversations WHERE id = ?"
+SQL_ANY_CONVERSATION = "SELECT 1 FROM conversations LIMIT 1"
+SQL_GET_MESSAGES = (
+    "SELECT role, content, task_type, timestamp, image_url, local_image_path, council_ref, extra "
+    "FROM messages WHERE conversation_id = ? ORDER BY seq"
+)
+# Ảnh đầu tiên của hội thoại (thumbnail): mỗi dòng một lookup trên UNIQUE (conversation_id, seq)
+SQL_LIST_COLUMNS = (
+    "SELECT id, created_at, title, message_count, "
+    "(SELECT local_image_path FROM messages m WHERE m.conversation_id = conversations.id "
+    "AND m.local_image_path IS NOT NULL ORDER BY m.seq LIMIT 1) FROM conversations "
+)
+SQL_LIST_FIRST_PAGE = SQL_LIST_COLUMNS + "ORDER BY created_at DESC, id DESC LIMIT ?"
+SQL_LIST_AFTER_CURSOR = (
+    SQL_LIST_COLUMNS + "WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+SQL_INCREMENT_MESSAGE_COUNT = "UPDATE conversations SET message_count = message_count + 1 WHERE id = ?"
+SQL_SET_MESSAGE_COUNT = "UPDATE conversations SET message_count = ? WHERE id = ?"
+SQL_NEXT_SEQ = "SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE conversation_id = ?"
+SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages (conversation_id, seq, role, content, task_type, timestamp, "
+    "image_url, local_image_path, council_ref, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_CONVERSATION_REFS = (
+    "SELECT DISTINCT council_ref FROM messages WHERE conversation_id = ? AND council_ref IS NOT NULL"
+)
+SQL_DELETE_MESSAGES = "DELETE FROM messages WHERE conversation_id = ?"
+SQL_DELETE_CONVERSATION = "DELETE FROM conversations WHERE id = ?"
+SQL_SET_IMAGE_URL = (
+    "UPDATE messages SET image_url = ? "
+    "WHERE conversation_id = ? AND local_image_path = ? AND image_url IS NULL"
+)
+SQL_UPDATE_TITLE = "UPDATE conversations SET title = ? WHERE id = ?"
+SQL_PUT_BLOB = (
+    "INSERT INTO council_blobs (ref, data, touched_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(ref) DO UPDATE SET touched_at = excluded.touched_at"
+)
+SQL_GET_BLOB = "SELECT data FROM council_blobs WHERE ref = ?"
+_UNREFERENCED_BLOB = (
+    "touched_at < ? AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.council_ref = council_blobs.ref)"
+)
+SQL_RELEASE_BLOB = "DELETE FROM council_blobs WHERE ref = ? AND " + _UNREFERENCED_BLOB
+SQL_COUNT_UNREFERENCED_BLOBS = (
+    "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM council_blobs WHERE " + _UNREFERENCED_BLOB
+)
+SQL_DELETE_UNREFERENCED_BLOBS = "DELETE FROM council_blobs WHERE " + _UNREFERENCED_BLOB
+
+# Các khóa message có cột riêng; khóa khác được giữ trong cột `extra` (JSON)
+MESSAGE_COLUMNS = ("role", "content", "task_type", "timestamp", "image_url", "local_image_path",
+                   "council_ref")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _gc_cutoff(touched_before: Optional[float] = None) -> float:
+    # Blob vừa ghi có thể thuộc message còn nằm trong cache write-behind
+    if touched_before is not None:
+        return touched_before
+    return time.time() - COUNCIL_BLOBS["gc_grace_seconds"]
+
+
+class SQLiteStorage(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            self._upgrade_schema(conn)
+            conn.executescript(SCHEMA_INDEXES)
+
+    @staticmethod
+    def _upgrade_schema(conn: sqlite3.Connection):
+        """Nâng cấp DB tạo bởi bản cũ (mỗi bước chạy một lần)."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+        if "message_count" not in columns:
+            conn.execute("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "UPDATE conversations SET message_count = "
+                "(SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id)"
+            )
+
+        # council_ref từ cột extra (JSON) sang cột riêng có index
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "council_ref" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN council_ref TEXT")
+            conn.execute(
+                "UPDATE messages SET council_ref = json_extract(extra, '$.council_ref'), "
+                "extra = json_remove(extra, '$.council_ref') "
+                "WHERE extra IS NOT NULL AND json_extract(extra, '$.council_ref') IS NOT NULL"
+            )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(council_blobs)")}
+        if "touched_at" not in columns:
+            conn.execute("ALTER TABLE council_blobs ADD COLUMN touched_at REAL NOT NULL DEFAULT 0")
+
+        # Bảng council_results (kết quả inline của bản đầu) -> blob + council_ref
+        has_results = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'council_results'").fetchone()
+        if has_results:
+            rows = conn.execute(
+                "SELECT r.message_id, r.data, m.extra FROM council_results r "
+                "JOIN messages m ON m.id = r.message_id").fetchall()
+            for message_id, data, extra in rows:
+                extra = json.loads(extra) if extra else {}
+                ref = SQLiteStorage._put_packed(conn, json.loads(data), extra)
+                conn.execute("UPDATE messages SET council_ref = ?, extra = ? WHERE id = ?",
+                             (ref, _dumps(extra), message_id))
+            conn.execute("DROP TABLE council_results")
+            if rows:
+                print(f"📦 Chuyển {len(rows)} kết quả council từ council_results sang council_blobs")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=128,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def create_conversation(self, conversation_id: str) -> Dict[str, Any]:
+        conversation = {
+            "id": conversation_id,
+            "created_at": now_iso(),
+            "title": "New Session",
+            "messages": []
+        }
+        with self._conn() as conn:
+            conn.execute(SQL_INSERT_CONVERSATION,
+                         (conversation_id, conversation["created_at"], conversation["title"]))
+        return conversation
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        row = conn.execute(SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "created_at": row[1],
+            "title": row[2],
+            "messages": [self._row_to_message(r) for r in conn.execute(SQL_GET_MESSAGES, (conversation_id,))]
+        }
+
+    def save_conversation(self, conversation: Dict[str, Any]):
+        conn = self._conn()
+        with conn:
+            conn.execute(SQL_UPSERT_CONVERSATION, (
+                conversation["id"], conversation["created_at"],
+                conversation.get("title", "New Conversation")
+            ))
+            old_refs = self._conversation_refs(conn, conversation["id"])
+            conn.execute(SQL_DELETE_MESSAGES, (conversation["id"],))
+            messages = conversation.get("messages", [])
+            for seq, message in enumerate(messages):
+                self._insert_message(conn, conversation["id"], seq, message)
+            conn.execute(SQL_SET_MESSAGE_COUNT, (len(messages), conversation["id"]))
+            self._release_blobs(conn, old_refs)
+
+    def list_page(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Keyset pagination trên index (created_at, id): không phụ thuộc tổng số hội thoại."""
+        # Lấy dư một dòng để biết còn trang sau hay không; LIMIT -1 = không giới hạn
+        fetch = -1 if limit is None else limit + 1
+        if cursor:
+            created_at, conversation_id = decode_cursor(cursor)
+            rows = self._conn().execute(SQL_LIST_AFTER_CURSOR, (created_at, conversation_id, fetch)).fetchall()
+        else:
+            rows = self._conn().execute(SQL_LIST_FIRST_PAGE, (fetch,)).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if rows else None
+        items = [
+            {"id": row[0], "created_at": row[1], "title": row[2], "message_count": row[3],
+             "cover_image": row[4]}
+            for row in rows
+        ]
+        return items, next_cursor
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]):
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE: giữ write lock từ lúc đọc seq tới lúc insert
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute(SQL_GET_CONVERSATION, (conversation_id,)).fetchone() is None:
+                raise ValueError(f"Conversation {conversation_id} not found")
+            seq = conn.execute(SQL_NEXT_SEQ, (conversation_id,)).fetchone()[0]
+            self._insert_message(conn, conversation_id, seq, message)
+            conn.execute(SQL_INCREMENT_MESSAGE_COUNT, (conversation_id,))
+
+    def update_conversation_title(self, conversation_id: str, title: str):
+        with self._conn() as conn:
+            conn.execute(SQL_UPDATE_TITLE, (title, conversation_id))
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        # messages bị xoá theo ON DELETE CASCADE; blob chỉ hội thoại này dùng bị xoá theo
+        with self._conn() as conn:
+            refs = self._conversation_refs(conn, conversation_id)
+            deleted = conn.execute(SQL_DELETE_CONVERSATION, (conversation_id,)).rowcount > 0
+            self._release_blobs(conn, refs)
+            return deleted
+
+    def gc_council_blobs(self, touched_before: Optional[float] = None,
+                         dry_run: bool = False) -> Dict[str, Any]:
+        touched_before = _gc_cutoff(touched_before)
+        conn = self._conn()
+        deleted, size = conn.execute(SQL_COUNT_UNREFERENCED_BLOBS, (touched_before,)).fetchone()
+        if not dry_run and deleted:
+            with conn:
+                conn.execute(SQL_DELETE_UNREFERENCED_BLOBS, (touched_before,))
+        return {"deleted": deleted, "bytes_reclaimed": size}
+
+    def compact_storage(self):
+        # Dòng bị xoá chỉ để lại trang trống trong file; VACUUM mới trả dung lượng cho hệ điều hành
+        self.gc_council_blobs()
+        conn = self._conn()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+
+    def disk_bytes(self) -> Optional[int]:
+        return sum(
+            os.path.getsize(self.path + suffix)
+            for suffix in ("", "-wal", "-shm")
+            if os.path.exists(self.path + suffix)
+        )
+
+    def set_message_image_url(self, conversation_id: str, local_image_path: str, image_url: str):
+        with self._conn() as conn:
+            conn.execute(SQL_SET_IMAGE_URL, (image_url, conversation_id, local_image_path))
+
+    def put_council_blob(self, ref: str, data: bytes):
+        with self._conn() as conn:
+            conn.execute(SQL_PUT_BLOB, (ref, data, time.time()))
+
+    def get_council_blob(self, ref: str) -> Optional[bytes]:
+        row = self._conn().execute(SQL_GET_BLOB, (ref,)).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def exists(self, conversation_id: str) -> bool:
+        return self._conn().execute(SQL_GET_CONVERSATION, (conversation_id,)).fetchone() is not None
+
+    def is_empty(self) -> bool:
+        return self._conn().execute(SQL_ANY_CONVERSATION).fetchone() is None
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    @staticmethod
+    def _put_packed(conn: sqlite3.Connection, council_response: Dict[str, Any], extra: Dict[str, Any]) -> str:
+        """Lưu council_response inline thành blob; ghi council_summary vào `extra`."""
+        ref, blob = council_blob.pack(council_response)
+        conn.execute(SQL_PUT_BLOB, (ref, blob, time.time()))
+        extra["council_summary"] = council_blob.summarize(council_response)
+        return ref
+
+    @staticmethod
+    def _insert_message(conn: sqlite3.Connection, conversation_id: str, seq: int, message: Dict[str, Any]):
+        extra = {k: v for k, v in message.items() if k not in MESSAGE_COLUMNS and k != "council_response"}
+        council_ref = message.get("council_ref")
+        if "council_response" in message:
+            # Message kiểu cũ (JSON migrate, archive...): lưu như message mới
+            council_ref = SQLiteStorage._put_packed(conn, message["council_response"], extra)
+        conn.execute(SQL_INSERT_MESSAGE, (
+            conversation_id, seq,
+            *(message.get(column) for column in MESSAGE_COLUMNS[:-1]),
+            council_ref,
+            _dumps(extra) if extra else None
+        ))
+
+    @staticmethod
+    def _conversation_refs(conn: sqlite3.Connection, conversation_id: str) -> List[str]:
+        return [row[0] for row in conn.execute(SQL_CONVERSATION_REFS, (conversation_id,))]
+
+    @staticmethod
+    def _release_blobs(conn: sqlite3.Connection, refs: Iterable[str]):
+        """Xoá các blob trong `refs` không còn message nào trỏ tới (trừ blob vừa ghi)."""
+        touched_before = _gc_cutoff()
+        for ref in refs:
+            conn.execute(SQL_RELEASE_BLOB, (ref, touched_before))
+
+    @staticmethod
+    def _row_to_message(row) -> Dict[str, Any]:
+        count = len(MESSAGE_COLUMNS)
+        message = {column: value for column, value in zip(MESSAGE_COLUMNS, row[:count]) if value is not None}
+        if row[count]:
+            message.update(json.loads(row[count]))
+        return message
@@ -0,0 +1,86 @@
+"""Nhận ảnh upload theo kiểu stream: đọc từng chunk, ghi thẳng xuống file tạm.
+
+Trong lúc ghi: tính sha256 và nhận diện MIME từ magic bytes của chunk đầu, dừng
+ngay khi vượt UPLOAD["max_bytes"]. Xong thì chuyển file vào image_store (trùng
+nội dung thì bỏ file tạm). Bộ nhớ dùng cho mỗi upload chỉ cỡ một chunk, bất kể
+ảnh lớn tới đâu; ghi file + hash chạy trong thread pool.
+"""
+
+import asyncio
+import hashlib
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import UploadFile
+
+from .config import UPLOAD
+from . import image_store
+from .image_preprocess import sniff_mime
+
+# Số byte đầu cần giữ lại để nhận diện MIME (WebP cần 12)
+_HEAD_BYTES = 16
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Image exceeds the {max_bytes} byte upload limit")
+        self.max_bytes = max_bytes
+
+
+class EmptyUpload(Exception):
+    pass
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+def _finish(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def save_upload(
+    upload: UploadFile,
+    fallback_mime: str = "image/jpeg",
+    original_name: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Stream `upload` vào image_store. Trả về (record, created) như ImageStore.put.
+    UploadTooLarge nếu vượt giới hạn, EmptyUpload nếu file rỗng.
+    """
+    max_bytes = UPLOAD["max_bytes"] if max_bytes is None else max_bytes
+    # Biết trước kích thước (multipart đã được Starlette nhận xong) thì từ chối sớm
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    store = image_store.get_store()
+    temp_path = store.temp_path()
+    hasher = hashlib.sha256()
+    head = b""
+    size = 0
+    f = open(temp_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD["chunk_size"])
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            if len(head) < _HEAD_BYTES:
+                head += chunk[:_HEAD_BYTES - len(head)]
+            await asyncio.to_thread(_write_chunk, f, hasher, chunk)
+        await asyncio.to_thread(_finish, f)
+        if size == 0:
+            raise EmptyUpload("Uploaded image is empty")
+        mime = sniff_mime(head) or fallback_mime
+        return await asyncio.to_thread(store.put_file, temp_path, hasher.hexdigest(), size, mime, original_name)
+    except BaseException:
+        f.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,101 @@
+"""
+Benchmark: encode ảnh cho một lượt chạy council (2 + 2x2 + 1 = 7 lần gọi).
+
+So sánh cách cũ (mỗi lần gọi base64-encode lại + copy vào JSON payload) với
+ImageHandle (encode một lần, các request body dùng chung buffer ảnh).
+Các body được giữ sống đồng thời giống như lúc các request đang in-flight.
+
+Chạy: python bench_image_handle.py [đường_dẫn_ảnh]
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+current_dir = os.getcwd()
+sys.path.append(current_dir)
+
+from backend.image_handle import ImageHandle, IMAGE_PART_PLACEHOLDER, build_json_body
+
+# Provider của từng lần gọi trong một lượt chạy: stage 1, stage 2 (M×N), chairman
+RUN_PROVIDERS = ["openai", "google"] + ["openai", "google"] * 2 + ["google"]
+PROMPT = "Return ONLY valid JSON. " * 200
+
+
+def _legacy_body(provider, image_data, mime):
+    # Tái hiện payload của llm_client trước khi có ImageHandle
+    b64_image = base64.b64encode(image_data).decode('utf-8')
+    if provider == "openai":
+        payload = {"model": "gpt-4o-mini", "temperature": 0.7, "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": PROMPT},
+                {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64_image}", "detail": "auto"}},
+            ],
+        }]}
+    else:
+        payload = {"contents": [{"role": "user", "parts": [
+            {"inline_data": {"mime_type": mime, "data": b64_image}},
+            {"text": PROMPT},
+        ]}], "generationConfig": {"temperature": 0.7}}
+    return [json.dumps(payload, ensure_ascii=False).encode("utf-8")]
+
+
+def _handle_body(provider, image):
+    if provider == "openai":
+        payload = {"model": "gpt-4o-mini", "temperature": 0.7, "messages": [{
+            "role": "user",
+            "content": [{"type": "text", "text": PROMPT}, IMAGE_PART_PLACEHOLDER],
+        }]}
+    else:
+        payload = {"contents": [{"role": "user", "parts": [IMAGE_PART_PLACEHOLDER, {"text": PROMPT}]}],
+                   "generationConfig": {"temperature": 0.7}}
+    return build_json_body(payload, image.json_part(provider))
+
+
+def run_legacy(image_data, mime):
+    return [_legacy_body(p, image_data, mime) for p in RUN_PROVIDERS]
+
+
+def run_handle(image_data, mime):
+    image = ImageHandle(image_data, mime)
+    return [_handle_body(p, image) for p in RUN_PROVIDERS]
+
+
+def measure(label, fn, image_data, mime, rounds=5):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        bodies = fn(image_data, mime)
+        timings.append(time.perf_counter() - start)
+        del bodies
+
+    tracemalloc.start()
+    bodies = fn(image_data, mime)
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.stop()
+    del bodies
+
+    print(f"{label:<10} time/run={min(timings) * 1000:8.2f} ms  "
+          f"retained={current / 1024:9.1f} KiB  peak={peak / 1024:9.1f} KiB  live_blocks={blocks}")
+    return current, peak
+
+
+def main():
+    image_path = sys.argv[1] if len(sys.argv) > 1 else "img/hangtrong_0128_tranh-tho-thanh-mau.jpg"
+    with open(image_path, "rb") as f:
+        image_data = f.read()
+    mime = "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
+
+    print(f"Image: {image_path} ({len(image_data) / 1024:.1f} KiB), {len(RUN_PROVIDERS)} calls per run")
+    legacy = measure("legacy", run_legacy, image_data, mime)
+    handle = measure("handle", run_handle, image_data, mime)
+    print(f"peak memory reduction: {legacy[1] / max(handle[1], 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
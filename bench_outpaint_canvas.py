@@ -0,0 +1,107 @@
+"""
+Benchmark: dựng canvas + mask outpainting (backend/outpaint_canvas.py) trên các ảnh trong img/.
+
+Với mỗi ảnh và mỗi expansion_settings mẫu: thời gian generate (canvas, mask,
+feathered_mask, preview) và riêng bước làm mờ mask theo 4 cách:
+- profile: feathered_mask (blur 2 vector 1D rồi nhân ngoài), cách generate dùng
+- 1D x2: box blur tách trục (cumsum, 3 lượt) trên cả mask 2D
+- 2D: cửa sổ vuông không tách trục, cộng dồn từng offset (chỉ chạy với setting
+  đầu tiên, bán kính nhỏ, vì rất chậm)
+- Pillow GaussianBlur (C), để tham chiếu tốc độ và độ sai lệch (cột diff)
+
+Chạy: python bench_outpaint_canvas.py [thư_mục_ảnh] [số_lần_lặp]
+"""
+
+import json
+import os
+import sys
+import time
+
+current_dir = os.getcwd()
+sys.path.append(current_dir)
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from backend import outpaint_canvas
+
+IMG_DIR = sys.argv[1] if len(sys.argv) > 1 else os.path.join(current_dir, "img")
+REPEAT = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+SETTINGS = [
+    {"direction": "all", "pixel_amount": 256, "mask_blur": 8},
+    {"direction": "left, right", "pixel_amount": 512, "mask_blur": 32},
+    {"directions": ["top", "bottom"], "expansion_amount": {"top": 25, "bottom": 10, "unit": "percent"},
+     "mask_blur": 16},
+]
+
+
+def _best_ms(fn, repeat=REPEAT):
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started_at)
+    return best * 1000, result
+
+
+def _blur_2d(mask, sigma):
+    # Cùng 3 lượt box blur nhưng cửa sổ vuông (2r+1)^2 offset: O(r^2) mỗi pixel
+    radius = max(1, round(((4 * sigma * sigma + 1) ** 0.5 - 1) / 2))
+    size = 2 * radius + 1
+    values = mask.astype(np.float64)
+    for _ in range(3):
+        padded = np.pad(values, radius, mode="edge")
+        acc = np.zeros_like(values)
+        for dy in range(size):
+            for dx in range(size):
+                acc += padded[dy:dy + values.shape[0], dx:dx + values.shape[1]]
+        values = acc / (size * size)
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def main():
+    names = sorted(name for name in os.listdir(IMG_DIR) if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+    print(f"{len(names)} images in {IMG_DIR}, best of {REPEAT}")
+    print(f"{'image':<40} {'size':>10} {'canvas':>10} {'generate':>9} {'profile':>8} {'1D x2':>8} "
+          f"{'2D':>9} {'Pillow':>7} {'diff':>5}")
+    totals = {"generate": 0.0, "profile": 0.0, "separable": 0.0, "pil": 0.0}
+    window_totals = {"separable": 0.0, "window": 0.0}
+    for name in names:
+        pixels = outpaint_canvas.load_pixels(os.path.join(IMG_DIR, name))
+        height, width = pixels.shape[:2]
+        for index, settings in enumerate(SETTINGS):
+            plan = outpaint_canvas.parse_expansion(json.dumps({"expansion_settings": settings}), width, height)
+            generate_ms, result = _best_ms(lambda: outpaint_canvas.generate(pixels, plan, "reflect"))
+            mask = result["mask"]
+            sigma = plan["mask_blur"]
+            profile_ms, feathered = _best_ms(lambda: outpaint_canvas.feathered_mask(height, width, plan))
+            separable_ms, blurred = _best_ms(lambda: outpaint_canvas.blur_mask(mask, sigma))
+            assert np.array_equal(feathered, blurred)
+            window = "-"
+            if index == 0:
+                window_ms, _ = _best_ms(lambda: _blur_2d(mask, sigma), repeat=1)
+                window_totals["separable"] += separable_ms
+                window_totals["window"] += window_ms
+                window = f"{window_ms:.0f}ms"
+            pil_ms, reference = _best_ms(
+                lambda: np.asarray(Image.fromarray(mask).filter(ImageFilter.GaussianBlur(sigma))))
+            diff = np.abs(feathered.astype(np.int16) - reference).mean()
+            totals["generate"] += generate_ms
+            totals["profile"] += profile_ms
+            totals["separable"] += separable_ms
+            totals["pil"] += pil_ms
+            print(f"{name[:40]:<40} {width:>4}x{height:<5} {mask.shape[1]:>4}x{mask.shape[0]:<5} "
+                  f"{generate_ms:7.1f}ms {profile_ms:6.1f}ms {separable_ms:6.1f}ms {window:>9} "
+                  f"{pil_ms:5.1f}ms {diff:5.2f}")
+    runs = len(names) * len(SETTINGS)
+    print(f"\n{runs} runs: generate {totals['generate']:.0f} ms total; mask blur: profile "
+          f"{totals['profile']:.0f} ms, 1D x2 on full mask {totals['separable']:.0f} ms, "
+          f"Pillow {totals['pil']:.0f} ms")
+    print(f"2D window vs 1D x2 (setting 1 only): {window_totals['window']:.0f} ms vs "
+          f"{window_totals['separable']:.0f} ms "
+          f"({window_totals['window'] / max(window_totals['separable'], 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: độ trễ event loop khi ghi kết quả council vào storage.
+
+Mô phỏng N request đồng thời cùng lưu assistant message (kết quả council lớn)
+trong lúc một task khác đo loop lag (giống một SSE stream đang chờ được
+phục vụ). So sánh gọi storage đồng bộ ngay trên event loop với
+backend.storage.aio (thread pool + batch theo hội thoại).
+
+Chạy: python bench_storage_lag.py [json|jsonl|sqlite]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+current_dir = os.getcwd()
+sys.path.append(current_dir)
+
+from backend import storage
+from backend.storage import aio as async_storage
+from backend.loop_monitor import LoopLagMonitor
+
+CONCURRENT_REQUESTS = 16
+CONVERSATIONS = 4
+HISTORY_MESSAGES = 20
+
+COUNCIL_RESULT = {
+    "stage1_results": [{"model": f"m{i}", "response": "draft " * 4000} for i in range(2)],
+    "stage2_results": [{"model": f"m{i}", "perfected_response": "refined " * 4000} for i in range(4)],
+    "final_result": {"selected_response": "final " * 1000, "evaluation": "BEST RESPONSE: Response A"},
+}
+
+
+def _seed(ids):
+    for conversation_id in ids:
+        storage.create_conversation(conversation_id)
+        for _ in range(HISTORY_MESSAGES):
+            storage.add_assistant_message(conversation_id, COUNCIL_RESULT)
+
+
+async def _run(label, save):
+    monitor = LoopLagMonitor(interval=0.005, window=100000)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    started_at = time.perf_counter()
+    await asyncio.gather(*(save(f"c{i % CONVERSATIONS}") for i in range(CONCURRENT_REQUESTS)))
+    elapsed = time.perf_counter() - started_at
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    lag = monitor.as_dict()
+    print(f"{label:<8} total {elapsed * 1000:8.1f} ms | loop lag p99 {lag['lag_p99_ms']:8.1f} ms"
+          f" | max {lag['lag_max_ms']:8.1f} ms | stalls {lag['stalls']}")
+
+
+async def main(backend_name):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.set_backend(storage.make_backend(backend_name, os.path.join(tmp, "store")))
+        ids = [f"c{i}" for i in range(CONVERSATIONS)]
+        _seed(ids)
+
+        async def save_sync(conversation_id):
+            storage.add_assistant_message(conversation_id, COUNCIL_RESULT)
+
+        async def save_async(conversation_id):
+            await async_storage.add_assistant_message(conversation_id, COUNCIL_RESULT)
+
+        print(f"Backend: {backend_name}, {CONCURRENT_REQUESTS} concurrent saves over {CONVERSATIONS} conversations")
+        await _run("sync", save_sync)
+        await _run("async", save_async)
+        print(async_storage.stats())
+        await async_storage.shutdown()
+        storage.set_backend(None)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "json"))
@@ -0,0 +1,106 @@
+"""
+Benchmark: bộ nhớ khi nhận nhiều ảnh upload lớn cùng lúc.
+
+So sánh cách cũ (`await image.read()` rồi giữ bytes suốt lượt chạy council)
+với upload.save_upload (stream theo chunk xuống image_store, council nhận
+ImageHandle.from_file). Các handle được giữ sống đồng thời giống như lúc
+các SSE stream đang chạy. Đo peak heap Python bằng tracemalloc.
+
+Chạy: python bench_upload_memory.py [số_upload] [MB_mỗi_ảnh]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+current_dir = os.getcwd()
+sys.path.append(current_dir)
+
+from starlette.datastructures import UploadFile
+
+from backend.config import IMAGE_STORE
+from backend import image_store
+from backend.image_handle import ImageHandle
+
+UPLOADS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+SIZE_MB = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+
+def _make_files(directory):
+    paths = []
+    for i in range(UPLOADS):
+        path = os.path.join(directory, f"upload_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xd8\xff\xe0")
+            f.write(os.urandom(SIZE_MB * 1024 * 1024 - 4))
+        paths.append(path)
+    return paths
+
+
+async def _legacy(paths):
+    handles = []
+
+    async def one(path):
+        upload_file = UploadFile(open(path, "rb"), filename=os.path.basename(path))
+        data = await upload_file.read()
+        record, _ = await asyncio.to_thread(image_store.get_store().put, data, "image/jpeg", upload_file.filename)
+        handles.append(ImageHandle(data, "image/jpeg", sha256=record["sha256"]))
+        await upload_file.close()
+
+    await asyncio.gather(*(one(path) for path in paths))
+    return handles
+
+
+async def _streaming(paths):
+    from backend import upload
+
+    handles = []
+
+    async def one(path):
+        upload_file = UploadFile(open(path, "rb"), filename=os.path.basename(path))
+        record, _ = await upload.save_upload(upload_file, "image/jpeg", upload_file.filename)
+        handles.append(ImageHandle.from_file(record["path"], record["mime"], sha256=record["sha256"]))
+        await upload_file.close()
+
+    await asyncio.gather(*(one(path) for path in paths))
+    return handles
+
+
+def _fresh_store(tmp, tag):
+    # Store riêng cho mỗi lần đo để không lần nào chỉ toàn dedup hit
+    image_store.close()
+    IMAGE_STORE["dir"] = os.path.join(tmp, f"objects_{tag}")
+    IMAGE_STORE["derived_dir"] = os.path.join(tmp, f"derived_{tag}")
+    IMAGE_STORE["db"] = os.path.join(tmp, f"image_store_{tag}.db")
+
+
+def _measure(name, fn, paths, tmp):
+    # tracemalloc làm chậm code nhiều allocation, nên đo thời gian ở một lần chạy riêng
+    _fresh_store(tmp, f"{name}_time")
+    started_at = time.perf_counter()
+    asyncio.run(fn(paths))
+    elapsed = time.perf_counter() - started_at
+
+    _fresh_store(tmp, f"{name}_mem")
+    tracemalloc.start()
+    handles = asyncio.run(fn(paths))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {len(handles)} uploads  peak heap {peak / 1024 / 1024:8.1f} MB  {elapsed * 1000:8.1f} ms")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = os.path.join(tmp, "src")
+        os.makedirs(source_dir)
+        paths = _make_files(source_dir)
+        print(f"{UPLOADS} concurrent uploads x {SIZE_MB} MB")
+        _measure("read()", _legacy, paths, tmp)
+        _measure("streaming", _streaming, paths, tmp)
+
+
+if __name__ == "__main__":
+    main()
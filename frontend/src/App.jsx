@@ -10,6 +10,29 @@ function App() {
   const [currentConversation, setCurrentConversation] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
 
+  // Khóa của một ứng viên trong stage{1,2,3}_delta
+  const deltaKey = (stage, data) => {
+    if (stage === 'stage2') return `${data.original_model} → ${data.stage2_model}`;
+    return data.model;
+  };
+
+  // Nối text đang stream của một ứng viên (xoá khi stage{n}_complete tới).
+  // `replace`: lời gọi hedge thắng, thay toàn bộ text đã stream của lời gọi chính.
+  const appendDelta = (stage, data) => {
+    updateLastAssistant(msg => {
+      const parts = msg.streaming?.[stage] || {};
+      const key = deltaKey(stage, data);
+      const text = data.replace ? data.delta : (parts[key] || '') + data.delta;
+      return {
+        ...msg,
+        streaming: {
+          ...msg.streaming,
+          [stage]: { ...parts, [key]: text },
+        },
+      };
+    });
+  };
+
   const updateLastAssistant = (updater) => {
     setCurrentConversation(prev => {
       if (!prev) return prev;
@@ -91,6 +114,7 @@ function App() {
         stage2: null,
         stage3: null,
         metadata: null,
+        streaming: { stage1: {}, stage2: {}, stage3: {} },
         loading: {
           stage1: false,
           stage2: false,
@@ -117,10 +141,15 @@ function App() {
               }));
               break;
 
+            case "stage1_delta":
+              appendDelta("stage1", payload);
+              break;
+
             case "stage1_complete":
               updateLastAssistant(msg => ({
                 ...msg,
                 stage1: payload,
+                streaming: { ...msg.streaming, stage1: {} },
                 loading: { ...msg.loading, stage1: false }
               }));
               break;
@@ -132,10 +161,15 @@ function App() {
               }));
               break;
 
+            case "stage2_delta":
+              appendDelta("stage2", payload);
+              break;
+
             case "stage2_complete":
               updateLastAssistant(msg => ({
                 ...msg,
                 stage2: payload,
+                streaming: { ...msg.streaming, stage2: {} },
                 loading: { ...msg.loading, stage2: false }
               }));
               break;
@@ -147,10 +181,15 @@ function App() {
               }));
               break;
 
+            case "stage3_delta":
+              appendDelta("stage3", payload);
+              break;
+
             case "stage3_complete":
               updateLastAssistant(msg => ({
                 ...msg,
                 stage3: payload,
+                streaming: { ...msg.streaming, stage3: {} },
                 loading: { ...msg.loading, stage3: false }
               }));
               break;
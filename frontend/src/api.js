@@ -4,6 +4,15 @@
 
 const API_BASE = 'http://localhost:8000';
 
+/**
+ * Absolute URL for an image served by the backend (/api/images/...).
+ * Blob/absolute URLs are returned unchanged.
+ */
+export function imageSrc(url) {
+  if (!url) return null;
+  return url.startsWith('/') ? `${API_BASE}${url}` : url;
+}
+
 export const api = {
   /**
    * List all conversations.
@@ -3,8 +3,10 @@ import ReactMarkdown from 'react-markdown';
 import Stage1 from './Stage1';
 import Stage2 from './Stage2';
 import Stage3 from './Stage3';
+import StreamingPreview from './StreamingPreview';
 import './ChatInterface.css';
 import ImageUploader from './ImageUploader';
+import { imageSrc } from '../api';
 
 export default function ChatInterface({
   conversation,
@@ -66,6 +68,20 @@ export default function ChatInterface({
                 <div className="user-message">
                   <div className="message-label">You</div>
                   <div className="message-content">
+                    {(msg.thumbnail_url || msg.image) && (
+                      <a
+                        href={imageSrc(msg.local_image_url || msg.image_url || msg.image)}
+                        target="_blank"
+                        rel="noreferrer"
+                      >
+                        <img
+                          className="message-image"
+                          src={imageSrc(msg.thumbnail_url || msg.image)}
+                          alt=""
+                          loading="lazy"
+                        />
+                      </a>
+                    )}
                     <div className="markdown-content">
                       <ReactMarkdown>{msg.content}</ReactMarkdown>
                     </div>
@@ -82,6 +98,9 @@ export default function ChatInterface({
                       <span>Running Stage 1: Collecting individual responses...</span>
                     </div>
                   )}
+                  {msg.loading?.stage1 && (
+                    <StreamingPreview parts={msg.streaming?.stage1} />
+                  )}
                   {msg.stage1 && <Stage1 responses={msg.stage1} />}
 
                   {/* Stage 2 */}
@@ -91,6 +110,9 @@ export default function ChatInterface({
                       <span>Running Stage 2: Cross refinement...</span>
                     </div>
                   )}
+                  {msg.loading?.stage2 && (
+                    <StreamingPreview parts={msg.streaming?.stage2} />
+                  )}
                   {msg.stage2 && (
                     <Stage2 results={msg.stage2} />
                   )}
@@ -102,6 +124,9 @@ export default function ChatInterface({
                       <span>Running Stage 3: Final synthesis...</span>
                     </div>
                   )}
+                  {msg.loading?.stage3 && (
+                    <StreamingPreview parts={msg.streaming?.stage3} />
+                  )}
                   {msg.stage3 && <Stage3 finalResponse={msg.stage3} />}
                 </div>
               )}
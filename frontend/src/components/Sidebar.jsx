@@ -1,4 +1,5 @@
 import { useState, useEffect } from 'react';
+import { imageSrc } from '../api';
 import './Sidebar.css';
 
 export default function Sidebar({
@@ -28,11 +29,21 @@ export default function Sidebar({
               }`}
               onClick={() => onSelectConversation(conv.id)}
             >
-              <div className="conversation-title">
-                {conv.title || 'New Conversation'}
-              </div>
-              <div className="conversation-meta">
-                {conv.message_count} messages
+              {conv.thumbnail_url && (
+                <img
+                  className="conversation-thumbnail"
+                  src={imageSrc(conv.thumbnail_url)}
+                  alt=""
+                  loading="lazy"
+                />
+              )}
+              <div className="conversation-info">
+                <div className="conversation-title">
+                  {conv.title || 'New Conversation'}
+                </div>
+                <div className="conversation-meta">
+                  {conv.message_count} messages
+                </div>
               </div>
             </div>
           ))
@@ -0,0 +1,21 @@
+import './Stage1.css';
+
+// Text đang stream (stage{1,2,3}_delta) của từng ứng viên, trước khi stage xong.
+// Nội dung thường là JSON dở dang nên hiển thị thô, không qua markdown.
+export default function StreamingPreview({ parts }) {
+  const entries = Object.entries(parts || {});
+  if (entries.length === 0) {
+    return null;
+  }
+
+  return (
+    <div className="stage streaming-preview">
+      {entries.map(([label, text]) => (
+        <div key={label} className="tab-content streaming-item">
+          <div className="model-name">{label}</div>
+          <pre className="response-text streaming-text">{text}</pre>
+        </div>
+      ))}
+    </div>
+  );
+}